@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the performance benchmarks
+# of the hot paths: synthetic data generation, dataloader throughput,
+# the ResNet-18 forward pass and the order aggregate query. Results
+# are stored as JSON baselines together with machine metadata, and a
+# compare mode flags regressions beyond a threshold.
+#
+# Usage (from the src folder):
+#   python -m benchmarks.benchmark_suite run --output ../reports/benchmarks/baseline.json
+#   python -m benchmarks.benchmark_suite run --compare ../reports/benchmarks/baseline.json --set HEIGHT=64
+#   python -m benchmarks.benchmark_suite compare baseline.json current.json --threshold 0.15
+######################################################################
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+from omegaconf import DictConfig, OmegaConf
+from sqlalchemy import create_engine
+from torch.utils.data import DataLoader
+from torchvision.models import resnet18
+
+from data.synthetic_data import generate_synthetic_data_for_products
+from mockup.fake_db_data_generation import bulk_populate_tables, create_tables, fetch_order_info
+from models.augmentation import build_augmentation
+from models.custom_dataset import CustomDataset
+
+# Default location of the config file, relative to the src folder
+CONFIG_PATH = Path("..") / "config" / "config.yaml"
+
+# Version of the JSON layout of the results
+RESULTS_VERSION = 1
+
+# Product IDs of the data benchmarks, matching the dummy products of the training script
+PRODUCT_IDS = [1, 2, 3]
+
+
+def measure(fn: Callable[[], Any], repeat: int = 5, warmup: int = 1, items: int = 1) -> Dict[str, Any]:
+    """Time repeated calls of a function.
+
+    :param fn: Function to time
+    :param repeat: Number of timed calls (default: 5)
+    :param warmup: Number of untimed calls before the measurement (default: 1)
+    :param items: Number of items processed per call, used for the throughput (default: 1)
+    :return: Dictionary with the single timings and their min, median, mean and standard deviation in seconds,
+        plus the throughput at the median in items per second
+    """
+    for _ in range(warmup):
+        fn()
+
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    median = statistics.median(times)
+    return {
+        "times_s": times,
+        "min_s": min(times),
+        "median_s": median,
+        "mean_s": statistics.fmean(times),
+        "stdev_s": statistics.stdev(times) if len(times) > 1 else 0.0,
+        "items": items,
+        "items_per_s": items / median if median > 0 else float("inf"),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    with contextlib.suppress(OSError, subprocess.CalledProcessError):
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    return None
+
+
+def machine_metadata() -> Dict[str, Any]:
+    """Describe the machine and software versions that produced a result."""
+    return {
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "hostname": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "torch": torch.__version__,
+        "torch_threads": torch.get_num_threads(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "git_commit": _git_commit(),
+    }
+
+
+def _params(config: DictConfig) -> Dict[str, Any]:
+    return {
+        "height": config.HEIGHT,
+        "width": config.WIDTH,
+        "channels": config.CHANNELS,
+        "n_images": config.N_IMAGES,
+        "dtype": config.DTYPE,
+        "seed": config.SEED,
+    }
+
+
+def bench_synthetic_generation(config: DictConfig, repeat: int) -> Dict[str, Any]:
+    """Benchmark generate_synthetic_data_for_products without cache; throughput in images per second."""
+    params = _params(config)
+
+    def run() -> None:
+        generate_synthetic_data_for_products(PRODUCT_IDS, params, show_progress=False, n_workers=config.N_GEN_WORKERS)
+
+    return measure(run, repeat=repeat, items=len(PRODUCT_IDS) * config.N_IMAGES)
+
+
+def bench_dataloader(config: DictConfig, repeat: int) -> Dict[str, Any]:
+    """Benchmark one pass over CustomDataset with the configured transforms; throughput in images per second."""
+    synthetic_data = generate_synthetic_data_for_products(
+        PRODUCT_IDS, _params(config), show_progress=False, n_workers=config.N_GEN_WORKERS
+    )
+    transform, augment = build_augmentation(config.AUGMENTATION)
+    dataset = CustomDataset.from_products(synthetic_data, transform=transform)
+    loader = DataLoader(dataset, shuffle=True, num_workers=config.N_WORKERS, batch_size=config.BATCH_SIZE)
+
+    def run() -> None:
+        for images, _ in loader:
+            if augment is not None:
+                augment(images)
+
+    return measure(run, repeat=repeat, items=len(dataset))
+
+
+def bench_resnet_forward(config: DictConfig, repeat: int) -> Dict[str, Any]:
+    """Benchmark the ResNet-18 inference forward pass at BATCH_SIZE; throughput in images per second."""
+    model = resnet18(weights=None, num_classes=len(PRODUCT_IDS) + 1).eval()
+    generator = torch.Generator().manual_seed(config.SEED)
+    images = torch.randn(config.BATCH_SIZE, config.CHANNELS, config.HEIGHT, config.WIDTH, generator=generator)
+
+    def run() -> None:
+        with torch.inference_mode():
+            model(images)
+
+    return measure(run, repeat=repeat, items=config.BATCH_SIZE)
+
+
+def bench_fetch_order_info(config: DictConfig, repeat: int) -> Dict[str, Any]:
+    """Benchmark the fetch_order_info aggregate against a seeded SQLite database; throughput in queries per second."""
+    with tempfile.TemporaryDirectory(prefix="lego-bench-") as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'benchmark.db'}")
+        create_tables(engine)
+        bulk_populate_tables(
+            engine,
+            num_orders=config.BENCH_DB_ORDERS,
+            num_sets=max(1, config.BENCH_DB_ORDERS // 10),
+            num_pieces=max(1, config.BENCH_DB_ORDERS // 20),
+            seed=config.SEED,
+        )
+
+        def run() -> None:
+            # fetch_order_info prints every row, which is not part of what is measured
+            with contextlib.redirect_stdout(io.StringIO()):
+                fetch_order_info(engine)
+
+        try:
+            return measure(run, repeat=repeat)
+        finally:
+            engine.dispose()
+
+
+# Registry of all benchmarks, in execution order
+BENCHMARKS: Dict[str, Callable[[DictConfig, int], Dict[str, Any]]] = {
+    "synthetic_generation": bench_synthetic_generation,
+    "dataloader": bench_dataloader,
+    "resnet18_forward": bench_resnet_forward,
+    "fetch_order_info": bench_fetch_order_info,
+}
+
+
+def run_benchmarks(config: DictConfig, names: Optional[List[str]] = None, repeat: int = 5) -> Dict[str, Any]:
+    """Run the selected benchmarks.
+
+    :param config: Config with the data, model and benchmark settings
+    :param names: Names of the benchmarks to run (default: None, i.e. all of them)
+    :param repeat: Number of timed repetitions per benchmark (default: 5)
+    :return: Results document with version, machine metadata, the benchmark settings and one entry per benchmark
+    """
+    if config.NUM_THREADS:
+        torch.set_num_threads(config.NUM_THREADS)
+
+    results: Dict[str, Any] = {}
+    for name in names or list(BENCHMARKS):
+        if name not in BENCHMARKS:
+            raise ValueError(f"Unknown benchmark '{name}', expected one of {list(BENCHMARKS)}")
+        print(f"[INFO] Running benchmark {name}...")
+        results[name] = BENCHMARKS[name](config, repeat)
+        print(f"[INFO] {name}: median {results[name]['median_s']:.4f} s ({results[name]['items_per_s']:.1f} items/s)")
+
+    settings = [
+        "HEIGHT", "WIDTH", "CHANNELS", "N_IMAGES", "DTYPE", "SEED", "BATCH_SIZE", "N_WORKERS", "N_GEN_WORKERS",
+        "NUM_THREADS", "AUGMENTATION", "BENCH_DB_ORDERS",
+    ]  # fmt: skip
+    return {
+        "version": RESULTS_VERSION,
+        "metadata": machine_metadata(),
+        "settings": {key: config[key] for key in settings} | {"repeat": repeat},
+        "results": results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """Compare the median timings of two results documents.
+
+    :param baseline: Results document of the baseline
+    :param current: Results document of the current run
+    :param threshold: Relative slowdown of the median above which a benchmark counts as regression, e.g. 0.15
+    :return: One row per benchmark present in both documents with both medians, the relative change and a
+        regression flag
+    """
+    rows = []
+    for name, result in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median_s"]
+        after = result["median_s"]
+        change = after / before - 1 if before > 0 else 0.0
+        rows.append(
+            {
+                "name": name,
+                "baseline_s": before,
+                "current_s": after,
+                "change": change,
+                "regression": change > threshold,
+            }
+        )
+    return rows
+
+
+def print_comparison(baseline: Dict[str, Any], current: Dict[str, Any], rows: List[Dict[str, Any]]) -> None:
+    """Print a comparison table and warn about settings or machines that differ between the documents."""
+    if baseline.get("settings") != current.get("settings"):
+        print("[WARNING] Benchmark settings differ from the baseline; timings are not comparable")
+    for key in ("processor", "cpu_count", "torch", "numpy"):
+        if baseline["metadata"].get(key) != current["metadata"].get(key):
+            print(f"[WARNING] Machine {key} differs: {baseline['metadata'].get(key)} -> {current['metadata'].get(key)}")
+
+    print(f"{'benchmark':<24}{'baseline [s]':>14}{'current [s]':>14}{'change':>10}")
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['name']:<24}{row['baseline_s']:>14.4f}{row['current_s']:>14.4f}{row['change']:>+10.1%}{flag}")
+
+
+def load_results(path: str) -> Dict[str, Any]:
+    """Load a results document and check its version."""
+    with open(path) as file:
+        results = json.load(file)
+    if results.get("version") != RESULTS_VERSION:
+        raise ValueError(f"{path} has results version {results.get('version')}, expected {RESULTS_VERSION}")
+    return results
+
+
+def save_results(path: str, results: Dict[str, Any]) -> None:
+    """Write a results document as JSON, creating missing directories."""
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(results, file, indent=2)
+    print(f"[INFO] Wrote benchmark results to {path}")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Run the performance benchmarks and compare them to a baseline.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument("--config", default=str(CONFIG_PATH), help="Path of the config file")
+    run_parser.add_argument("--only", nargs="+", choices=list(BENCHMARKS), help="Benchmarks to run (default: all)")
+    run_parser.add_argument("--repeat", type=int, help="Timed repetitions per benchmark (default: BENCH_REPEAT)")
+    run_parser.add_argument("--set", nargs="+", default=[], metavar="KEY=VALUE", help="Override config values")
+    run_parser.add_argument("--output", help="Path of the JSON results file")
+    run_parser.add_argument("--compare", metavar="BASELINE", help="Compare the results to a baseline file")
+    run_parser.add_argument("--threshold", type=float, help="Allowed relative slowdown (default: BENCH_THRESHOLD)")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("baseline", help="Path of the baseline results file")
+    compare_parser.add_argument("current", help="Path of the current results file")
+    compare_parser.add_argument("--threshold", type=float, default=0.15, help="Allowed relative slowdown")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        baseline, current, threshold = load_results(args.baseline), load_results(args.current), args.threshold
+    else:
+        config = OmegaConf.merge(OmegaConf.load(args.config), OmegaConf.from_dotlist(args.set))
+        current = run_benchmarks(config, args.only, repeat=args.repeat or config.BENCH_REPEAT)
+        if args.output:
+            save_results(args.output, current)
+        if not args.compare:
+            return 0
+        baseline = load_results(args.compare)
+        threshold = config.BENCH_THRESHOLD if args.threshold is None else args.threshold
+
+    rows = compare_results(baseline, current, threshold)
+    print_comparison(baseline, current, rows)
+
+    # A non-zero exit code lets CI fail on regressions
+    regressions = [row["name"] for row in rows if row["regression"]]
+    if regressions:
+        print(f"[ERROR] Regressions beyond {threshold:.0%}: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
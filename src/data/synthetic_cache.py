@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors:  David Anthony Parham
+
+# Module Description: This script contains a persistent on-disk cache
+# for the synthetic reference images. Every product is stored as its
+# own .npy file and reopened lazily as memory map on a cache hit.
+######################################################################
+
+import contextlib
+import hashlib
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Union
+
+import numpy as np
+
+from data.synthetic_data import GENERATOR_VERSION, fill_synthetic_blocks, resolve_dtype
+
+
+class SyntheticDataCache:
+    """Size-capped, least-recently-used cache of generated synthetic data on disk."""
+
+    def __init__(self, root: Union[str, Path], max_bytes: Optional[int] = None):
+        """Initialize the cache.
+
+        :param root: Directory that holds the cached .npy files
+        :param max_bytes: Maximum total size of the cache in bytes (default: None, i.e. unbounded)
+        """
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def cache_key(product_id: int, params: Dict[str, Any]) -> str:
+        """Build the cache key of a product for the given generation parameters.
+
+        :param product_id: Product ID of the cached data
+        :param params: Dictionary containing parameters like height, width, channels, n_images, dtype and seed
+        :return: Hex digest identifying (product_id, params, generator version, seed)
+        """
+        key = {
+            "product_id": int(product_id),
+            "height": int(params["height"]),
+            "width": int(params["width"]),
+            "channels": int(params["channels"]),
+            "n_images": int(params["n_images"]),
+            "dtype": resolve_dtype(params["dtype"]).str,
+            "seed": int(params.get("seed", 42)),
+            "version": GENERATOR_VERSION,
+        }
+        return hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:24]
+
+    def path_for(self, product_id: int, params: Dict[str, Any]) -> Path:
+        """Return the file path of a product's cache entry.
+
+        :param product_id: Product ID of the cached data
+        :param params: Dictionary containing the generation parameters
+        :return: Path of the .npy file (it may not exist yet)
+        """
+        return self.root / f"product-{product_id}-{self.cache_key(product_id, params)}.npy"
+
+    def get(self, product_id: int, params: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Open a cached product as read-only memory map.
+
+        :param product_id: Product ID of the cached data
+        :param params: Dictionary containing the generation parameters
+        :return: Memory-mapped array on a cache hit, otherwise None
+        """
+        path = self.path_for(product_id, params)
+        try:
+            data = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError):
+            return None
+
+        # Mark the entry as recently used for the LRU eviction
+        with contextlib.suppress(OSError):
+            os.utime(path)
+
+        return data
+
+    def load_or_generate(
+        self, product_ids: List[int], params: Dict[str, Any], show_progress: bool = True, n_workers: int = 1
+    ) -> Dict[int, np.ndarray]:
+        """Return the synthetic data of all products, generating only those that are not cached yet.
+
+        Missing products are generated straight into their cache files, so the images are never held in
+        RAM as a whole. All returned arrays are read-only memory maps.
+
+        :param product_ids: List of product IDs for which synthetic data is needed
+        :param params: Dictionary containing parameters like height, width, channels, n_images, dtype and seed
+        :param show_progress: Flag to show or suppress the progress bar (default: True)
+        :param n_workers: Number of worker processes used for missing products (default: 1)
+        :return: Dictionary mapping product IDs to memory-mapped synthetic data
+        """
+        dtype = resolve_dtype(params["dtype"])
+        dim = (params["height"], params["width"], params["channels"])
+        n_images = params["n_images"]
+        seed = params.get("seed", 42)
+
+        product_ids = list(dict.fromkeys(product_ids))
+        missing = [product_id for product_id in product_ids if self.get(product_id, params) is None]
+
+        if missing:
+            # Write into temporary files first, so an interrupted run never leaves a partial entry behind
+            staged = {}
+            blocks = []
+            for product_id in missing:
+                tmp_path = self.root / f".tmp-{uuid.uuid4().hex}.npy"
+                data = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(n_images, *dim))
+                blocks.append((str(tmp_path), data.offset, product_id))
+                staged[product_id] = tmp_path
+                del data
+
+            try:
+                fill_synthetic_blocks(blocks, n_images, dim, dtype, seed, n_workers, show_progress)
+                for product_id, tmp_path in staged.items():
+                    os.replace(tmp_path, self.path_for(product_id, params))
+            finally:
+                for tmp_path in staged.values():
+                    tmp_path.unlink(missing_ok=True)
+
+        keep = {self.path_for(product_id, params) for product_id in product_ids}
+        self.evict(keep=keep)
+
+        synthetic_data: Dict[int, np.ndarray] = {}
+        for product_id in product_ids:
+            data = self.get(product_id, params)
+            if data is None:
+                raise RuntimeError(f"Cache entry for product {product_id} is missing after generation")
+            synthetic_data[product_id] = data
+
+        return synthetic_data
+
+    def size(self) -> int:
+        """Return the total size of all cache entries in bytes."""
+        return sum(path.stat().st_size for path in self.root.glob("product-*.npy"))
+
+    def evict(self, keep: Optional[Set[Path]] = None) -> List[Path]:
+        """Remove least recently used entries until the cache fits its size cap.
+
+        :param keep: Entries that must not be evicted, e.g. the ones currently in use (default: None)
+        :return: List of removed entries
+        """
+        if self.max_bytes is None:
+            return []
+
+        keep = keep or set()
+        entries = sorted(self.root.glob("product-*.npy"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in entries)
+        removed = []
+
+        for path in entries:
+            if total <= self.max_bytes:
+                break
+            if path in keep:
+                continue
+            total -= path.stat().st_size
+            path.unlink(missing_ok=True)
+            removed.append(path)
+
+        return removed
+
+    def invalidate(self, product_id: Optional[int] = None) -> int:
+        """Delete the cache entries of one product or the whole cache.
+
+        :param product_id: Product ID whose entries are removed (default: None, i.e. all entries)
+        :return: Number of removed entries
+        """
+        pattern = f"product-{product_id}-*.npy" if product_id is not None else "product-*.npy"
+        removed = 0
+        for path in self.root.glob(pattern):
+            path.unlink(missing_ok=True)
+            removed += 1
+
+        return removed
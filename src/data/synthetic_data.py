@@ -7,11 +7,24 @@
 # corresponding CAT models, sourced from the database.
 ######################################################################
 
-from typing import Any, Dict, List, Tuple
+import contextlib
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
 import numpy as np
 from tqdm import tqdm
 
+if TYPE_CHECKING:
+    from data.synthetic_cache import SyntheticDataCache
+
+# Version of the generation logic; bump it whenever the produced images change for identical params
+GENERATOR_VERSION = 2
+
+# Upper bound for the scratch buffer used when filling an image batch chunk by chunk
+_CHUNK_BYTES = 1 << 24
+
 
 # Placeholder function to simulate fetching product information based on product ID
 def fetch_product_info(product_id: int) -> Any:
@@ -51,8 +64,119 @@ def generate_synthetic_image(  # noqa
     return image
 
 
+def resolve_dtype(dtype: Any) -> np.dtype:
+    """Resolve a dtype given as NumPy type or as config string (e.g. "np.uint8").
+
+    :param dtype: NumPy dtype, scalar type or its string representation
+    :return: Resolved NumPy dtype
+    """
+    if isinstance(dtype, str):
+        dtype = dtype.removeprefix("np.").removeprefix("numpy.")
+    return np.dtype(dtype)
+
+
+def product_seed(product_id: int, seed: int = 42) -> np.random.SeedSequence:
+    """Derive the seed sequence of a product's random stream.
+
+    :param product_id: Product ID for which the stream is derived
+    :param seed: Base seed shared by all products (default: 42)
+    :return: Seed sequence that is unique and reproducible per (seed, product_id)
+    """
+    return np.random.SeedSequence([seed, product_id])
+
+
+def _add_param(images: np.ndarray, param: int) -> None:
+    """Add a product parameter to images in place, wrapping the pixel values modulo 256.
+
+    uint8 arithmetic wraps by itself, whereas wider integer types need an explicit modulo.
+
+    :param images: Integer images with pixel values in [0, 256)
+    :param param: Product parameter to add
+    """
+    images += np.asarray(param % 256).astype(images.dtype)
+    if images.dtype.itemsize > 1:
+        np.remainder(images, 256, out=images)
+
+
+def generate_synthetic_batch(  # noqa
+    product_id: int,
+    n_images: int,
+    dim: Tuple[int, int, int],
+    dtype: np.dtype = np.uint8,
+    seed: int = 42,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """Generate a batch of synthetic images for a product from a single random stream.
+
+    The images are written chunk-wise into one (n_images, height, width, channels) array, so no
+    per-image arrays are allocated and no list of images needs to be stacked afterwards. Every image
+    of the batch is distinct, while the batch as a whole is reproducible for a given (product_id, seed).
+
+    :param product_id: Product ID for which synthetic data needs to be generated
+    :param n_images: Number of images to generate
+    :param dim: Dimensions of each image (height, width, channels)
+    :param dtype: Integer data type of the images (default: np.uint8)
+    :param seed: Base seed for the product's random stream (default: 42)
+    :param out: Optional preallocated array of shape (n_images, height, width, channels) to fill
+    :return: Generated synthetic data as a NumPy array (``out`` if it was provided)
+    """
+    dtype = resolve_dtype(dtype)
+    shape = (n_images, *dim)
+
+    if out is None:
+        out = np.empty(shape, dtype=dtype)
+    elif out.shape != shape or out.dtype != dtype:
+        raise ValueError(f"Output array must have shape {shape} and dtype {dtype}, got {out.shape} and {out.dtype}")
+
+    # Fetch product information based on product_id
+    product_info = fetch_product_info(product_id)
+    model = product_info["model"]  # noqa
+    param = product_info["param"]
+
+    rng = np.random.default_rng(product_seed(product_id, seed))
+
+    # Always fill in chunks of whole images, so the stream is consumed identically regardless of
+    # whether the target array lives in memory, in shared memory or in a memory-mapped file
+    image_bytes = max(1, int(np.prod(dim)) * dtype.itemsize)
+    chunk = max(1, _CHUNK_BYTES // image_bytes)
+
+    for start in range(0, n_images, chunk):
+        stop = min(start + chunk, n_images)
+        out[start:stop] = rng.integers(0, 256, size=(stop - start, *dim), dtype=dtype)
+
+        # Custom logic based on model/param can be added here (wraps modulo 256 like the per-image baseline)
+        _add_param(out[start:stop], param)
+
+    return out
+
+
+def generate_synthetic_sample(
+    product_id: int, index: int, dim: Tuple[int, int, int], dtype: np.dtype = np.uint8, seed: int = 42
+) -> np.ndarray:
+    """Generate a single synthetic image of a product independently of all other images.
+
+    Each (product_id, index) pair owns its own random stream, which allows images to be produced lazily and
+    in any order, e.g. by several DataLoader workers, while remaining reproducible.
+
+    :param product_id: Product ID for which the image is generated
+    :param index: Index of the image within the product's images
+    :param dim: Dimensions of the image (height, width, channels)
+    :param dtype: Integer data type of the image (default: np.uint8)
+    :param seed: Base seed for the random stream (default: 42)
+    :return: Generated synthetic image as a NumPy array
+    """
+    dtype = resolve_dtype(dtype)
+    param = fetch_product_info(product_id)["param"]
+
+    rng = np.random.default_rng(np.random.SeedSequence([seed, product_id, index]))
+    image = rng.integers(0, 256, size=dim, dtype=dtype)
+    _add_param(image, param)
+
+    return image
+
+
 def generate_synthetic_data(
-    product_id: int, n_images: int, dim: Tuple[int, int, int], dtype: np.dtype = np.uint8
+    product_id: int, n_images: int, dim: Tuple[int, int, int], dtype: np.dtype = np.uint8, seed: int = 42
 ) -> np.ndarray:
     """Generate synthetic data for a specific product ID.
 
@@ -60,44 +184,152 @@ def generate_synthetic_data(
     :param n_images: Number of images to generate
     :param dim: Dimensions of each image (height, width, channels)
     :param dtype: Data type of the image (default: np.uint8)
+    :param seed: Base seed for the product's random stream (default: 42)
     :return: Generated synthetic data as a NumPy array
     """
-    height, width, channels = dim
+    return generate_synthetic_batch(product_id, n_images, dim, dtype, seed)
 
-    # Fetch product information based on product_id
-    product_info = fetch_product_info(product_id)
 
-    # Generate synthetic data
-    synthetic_data = [generate_synthetic_image(height, width, channels, product_info, dtype) for _ in range(n_images)]
+def fill_synthetic_block(  # noqa
+    path: str,
+    offset: int,
+    product_id: int,
+    n_images: int,
+    dim: Tuple[int, int, int],
+    dtype: np.dtype = np.uint8,
+    seed: int = 42,
+) -> int:
+    """Generate a product's synthetic data directly into a block of a memory-mapped file.
+
+    This is the unit of work executed by the worker processes. Only the file location is passed in
+    and only the product ID is returned, so no image data is pickled between processes.
+
+    :param path: Path of the memory-mapped file that holds the block
+    :param offset: Byte offset of the block within the file
+    :param product_id: Product ID for which synthetic data needs to be generated
+    :param n_images: Number of images to generate
+    :param dim: Dimensions of each image (height, width, channels)
+    :param dtype: Data type of the image (default: np.uint8)
+    :param seed: Base seed for the product's random stream (default: 42)
+    :return: Product ID of the generated block
+    """
+    block = np.memmap(path, dtype=resolve_dtype(dtype), mode="r+", offset=offset, shape=(n_images, *dim))
+    generate_synthetic_batch(product_id, n_images, dim, dtype, seed, out=block)
+    block.flush()
+    del block
+
+    return product_id
 
-    # Convert synthetic_data list to a NumPy array
-    return np.array(synthetic_data)
+
+def _shared_memory_dir() -> Optional[str]:
+    """Return a RAM-backed directory for temporary shared blocks if the platform provides one."""
+    return "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+
+def fill_synthetic_blocks(  # noqa
+    blocks: List[Tuple[str, int, int]],
+    n_images: int,
+    dim: Tuple[int, int, int],
+    dtype: np.dtype = np.uint8,
+    seed: int = 42,
+    n_workers: int = 1,
+    show_progress: bool = True,
+) -> None:
+    """Generate several products into their memory-mapped blocks, optionally with a process pool.
+
+    :param blocks: List of (path, offset, product_id) tuples describing where each product is written
+    :param n_images: Number of images to generate per product
+    :param dim: Dimensions of each image (height, width, channels)
+    :param dtype: Data type of the image (default: np.uint8)
+    :param seed: Base seed for the products' random streams (default: 42)
+    :param n_workers: Number of worker processes (default: 1, i.e. generation in this process)
+    :param show_progress: Flag to show or suppress the progress bar (default: True)
+    """
+    dtype_str = resolve_dtype(dtype).str
+
+    if n_workers <= 1 or len(blocks) <= 1:
+        iterator = tqdm(blocks, desc="Generating Synthetic Data") if show_progress else blocks
+        for path, offset, product_id in iterator:
+            fill_synthetic_block(path, offset, product_id, n_images, dim, dtype_str, seed)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(blocks))) as executor:
+        futures = [
+            executor.submit(fill_synthetic_block, path, offset, product_id, n_images, dim, dtype_str, seed)
+            for path, offset, product_id in blocks
+        ]
+        completed = as_completed(futures)
+        if show_progress:
+            completed = tqdm(completed, total=len(futures), desc="Generating Synthetic Data")
+
+        for future in completed:
+            future.result()
 
 
 def generate_synthetic_data_for_products(
-    product_ids: List[int], params: Dict[str, Any], show_progress: bool = True
+    product_ids: List[int],
+    params: Dict[str, Any],
+    show_progress: bool = True,
+    n_workers: int = 1,
+    cache: Optional["SyntheticDataCache"] = None,
 ) -> Dict[int, np.ndarray]:
     """Generate synthetic data for a list of product IDs.
 
+    With ``n_workers > 1`` the products are generated by a pool of worker processes. All products share a
+    single memory-mapped array that the workers write into directly, and the returned arrays are views into
+    it. Since each product is generated from its own seeded stream, the result is bit-identical to the
+    serial mode.
+
     :param product_ids: List of product IDs for which synthetic data needs to be generated
-    :param params: Dictionary containing parameters like height, width, channels, n_images, and dtype
+    :param params: Dictionary containing parameters like height, width, channels, n_images, dtype and
+        optionally seed
     :param show_progress: Flag to show or suppress the progress bar (default: True)
+    :param n_workers: Number of worker processes (default: 1, i.e. serial generation in this process)
+    :param cache: Optional on-disk cache; cached products are memory-mapped instead of regenerated
     :return: Dictionary mapping product IDs to generated synthetic data
     """
+    if cache is not None:
+        return cache.load_or_generate(product_ids, params, show_progress=show_progress, n_workers=n_workers)
+
     height = params["height"]
     width = params["width"]
     channels = params["channels"]
     n_images = params["n_images"]
-    dtype = params["dtype"]
+    dtype = resolve_dtype(params["dtype"])
+    seed = params.get("seed", 42)
+    dim = (height, width, channels)
 
+    # Drop duplicates while keeping the order, since every product maps to exactly one block
+    product_ids = list(dict.fromkeys(product_ids))
     synthetic_data: Dict[int, np.ndarray] = {}
 
-    # Flag to display or suppress progress bar
-    iterator = tqdm(product_ids, desc="Generating Synthetic Data") if show_progress else product_ids
+    if n_workers <= 1 or len(product_ids) <= 1:
+        # Flag to display or suppress progress bar
+        iterator = tqdm(product_ids, desc="Generating Synthetic Data") if show_progress else product_ids
+
+        for product_id in iterator:
+            data = generate_synthetic_data(product_id, n_images, dim, dtype, seed)
+            synthetic_data[product_id] = data
+
+        return synthetic_data
+
+    # Allocate one shared block for all products; the mapping outlives the unlinked file
+    block_bytes = n_images * height * width * channels * dtype.itemsize
+    fd, path = tempfile.mkstemp(prefix="lego-synthetic-", suffix=".dat", dir=_shared_memory_dir())
+    os.close(fd)
+
+    try:
+        shared = np.memmap(path, dtype=dtype, mode="w+", shape=(len(product_ids), n_images, *dim))
+        blocks = [(path, i * block_bytes, product_id) for i, product_id in enumerate(product_ids)]
+        fill_synthetic_blocks(blocks, n_images, dim, dtype, seed, n_workers, show_progress)
+
+    finally:
+        # Windows refuses to delete mapped files, in which case the file is left to the temp dir cleanup
+        with contextlib.suppress(OSError):
+            os.unlink(path)
 
-    for product_id in iterator:
-        data = generate_synthetic_data(product_id, n_images, (height, width, channels), dtype)
-        synthetic_data[product_id] = data
+    for i, product_id in enumerate(product_ids):
+        synthetic_data[product_id] = shared[i]
 
     return synthetic_data
 
@@ -106,6 +338,6 @@ if __name__ == "__main__":
     # Example usage:
     product_ids = [1, 2, 3]  # Replace with actual product IDs sources from the dummy database
     params = {"height": 256, "width": 256, "channels": 3, "n_images": 10, "dtype": np.uint8}
-    synthetic_data = generate_synthetic_data_for_products(product_ids, params)
+    synthetic_data = generate_synthetic_data_for_products(product_ids, params, n_workers=os.cpu_count() or 1)
     for pid, data in synthetic_data.items():
         print(f"Product ID {pid}: Data shape {data.shape}")
@@ -0,0 +1,2 @@
+# The piece totals listeners must be registered on SessionLocal before any session writes order sets or set pieces
+from database import piece_totals  # noqa: F401
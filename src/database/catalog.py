@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the read-only catalog
+# access layer. The set and piece graph of orders is eager-loaded in a
+# fixed number of statements and returned as lightweight slotted
+# dataclasses or NumPy structured arrays instead of live ORM instances,
+# and every read reports the number of SQL statements it issued.
+######################################################################
+
+import datetime
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import Select, event, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import raiseload, selectinload
+
+from database.config import get_session
+from database.schema import Order, OrderSet, Piece, Set, SetPiece
+
+# Record layouts of the flat relationship arrays
+ORDER_SET_DTYPE = np.dtype([("order_id", np.int64), ("set_id", np.int64), ("quantity", np.int64)])
+SET_PIECE_DTYPE = np.dtype([("set_id", np.int64), ("piece_id", np.int64), ("quantity", np.int64)])
+
+
+@dataclass(frozen=True, slots=True)
+class PieceInfo:
+    """Read-only view of a LEGO brick."""
+
+    id: int
+    name: str
+    color: str
+    dimension: Optional[str]
+    pattern: Optional[str]
+
+
+@dataclass(frozen=True, slots=True)
+class SetPieceInfo:
+    """Brick of a set with its quantity per set."""
+
+    piece: PieceInfo
+    quantity: int
+
+
+@dataclass(frozen=True, slots=True)
+class SetInfo:
+    """Read-only view of a LEGO set and its bricks."""
+
+    id: int
+    name: str
+    theme: Optional[str]
+    year_released: Optional[int]
+    piece_count: Optional[int]
+    pieces: Tuple[SetPieceInfo, ...]
+
+
+@dataclass(frozen=True, slots=True)
+class OrderSetInfo:
+    """Set of an order with its ordered quantity."""
+
+    set: SetInfo
+    quantity: int
+
+
+@dataclass(frozen=True, slots=True)
+class OrderInfo:
+    """Read-only view of an order with its full set and piece graph."""
+
+    id: int
+    date: datetime.date
+    total_sets: int
+    sets: Tuple[OrderSetInfo, ...]
+
+    def piece_totals(self) -> Dict[int, int]:
+        """Return the total quantity of every piece of the order, computed from the loaded graph."""
+        totals: Dict[int, int] = {}
+        for order_set in self.sets:
+            for set_piece in order_set.set.pieces:
+                totals[set_piece.piece.id] = totals.get(set_piece.piece.id, 0) + set_piece.quantity * order_set.quantity
+        return dict(sorted(totals.items()))
+
+
+class QueryCounter:
+    """Context manager that counts the SQL statements an engine executes in the current thread.
+
+    Example:
+        with QueryCounter(engine) as counter:
+            reader.orders([1, 2, 3])
+        assert counter.count == 3
+    """
+
+    def __init__(self, engine: Engine, record: bool = False):
+        """Initialize the counter.
+
+        :param engine: Engine whose statements are counted
+        :param record: Flag to keep the SQL text of every statement in statements (default: False)
+        """
+        self.engine = engine
+        self.record = record
+        self.count = 0
+        self.statements: List[str] = []
+        self._thread = threading.get_ident()
+
+    def _on_execute(self, conn: Any, cursor: Any, statement: str, *args: Any) -> None:
+        # Statements of other threads that share the engine are not part of the measured code
+        if threading.get_ident() != self._thread:
+            return
+        self.count += 1
+        if self.record:
+            self.statements.append(statement)
+
+    def __enter__(self) -> "QueryCounter":
+        self._thread = threading.get_ident()
+        event.listen(self.engine, "before_cursor_execute", self._on_execute)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        event.remove(self.engine, "before_cursor_execute", self._on_execute)
+
+
+def orders_statement(order_ids: Iterable[int]) -> Select:
+    """Build the statement that eager-loads the set and piece graph of orders and forbids any other loading.
+
+    :param order_ids: Order IDs to load
+    :return: Statement selecting Order entities ordered by ID
+    """
+    return (
+        select(Order)
+        .where(Order.id.in_(list(order_ids)))
+        .order_by(Order.id)
+        .options(
+            selectinload(Order.order_sets)
+            .joinedload(OrderSet.set, innerjoin=True)
+            .selectinload(Set.set_pieces)
+            .joinedload(SetPiece.piece, innerjoin=True),
+            raiseload("*"),
+        )
+    )
+
+
+class CatalogReader:
+    """Read-only access to orders, sets and pieces without lazy loading.
+
+    Loading the graph of any number of orders takes three statements: the orders, their order sets joined
+    with the sets, and the set pieces joined with the pieces (SQLAlchemy splits the IN lists of selectinload
+    into batches of 500 keys, so very large requests add one statement per further batch). Any other
+    relationship access raises instead of silently issuing N+1 queries. The statement count of the last
+    read is available as last_query_count, the total of all reads as query_count.
+    """
+
+    def __init__(self, engine: Engine):
+        """Initialize the reader.
+
+        :param engine: SQLAlchemy engine object
+        """
+        self.engine = engine
+        self.last_query_count = 0
+        self.query_count = 0
+
+    def _counted(self) -> QueryCounter:
+        return QueryCounter(self.engine)
+
+    def _finish(self, counter: QueryCounter) -> None:
+        self.last_query_count = counter.count
+        self.query_count += counter.count
+
+    def orders(self, order_ids: Iterable[int]) -> Dict[int, OrderInfo]:
+        """Load the full set and piece graph of several orders.
+
+        :param order_ids: Order IDs to load
+        :return: Dictionary mapping the IDs of the existing orders to their graphs
+        """
+        order_ids = sorted({int(order_id) for order_id in order_ids})
+
+        with self._counted() as counter, get_session(self.engine) as session:
+            orders = session.scalars(orders_statement(order_ids)).all() if order_ids else []
+
+            # Sets and pieces shared between orders are converted once and shared as well
+            pieces: Dict[int, PieceInfo] = {}
+            sets: Dict[int, SetInfo] = {}
+            result = {order.id: self._order_info(order, sets, pieces) for order in orders}
+            session.rollback()
+
+        self._finish(counter)
+        return result
+
+    def order(self, order_id: int) -> Optional[OrderInfo]:
+        """Load the full set and piece graph of one order.
+
+        :param order_id: Order ID of the scanned order
+        :return: Graph of the order, or None if it does not exist
+        """
+        return self.orders([order_id]).get(order_id)
+
+    @staticmethod
+    def _piece_info(piece: Piece, pieces: Dict[int, PieceInfo]) -> PieceInfo:
+        if piece.id not in pieces:
+            pieces[piece.id] = PieceInfo(piece.id, piece.name, piece.color, piece.dimension, piece.pattern)
+        return pieces[piece.id]
+
+    def _set_info(self, set_: Set, sets: Dict[int, SetInfo], pieces: Dict[int, PieceInfo]) -> SetInfo:
+        if set_.id not in sets:
+            set_pieces = tuple(
+                SetPieceInfo(self._piece_info(set_piece.piece, pieces), set_piece.quantity)
+                for set_piece in sorted(set_.set_pieces, key=lambda set_piece: set_piece.piece_id)
+            )
+            sets[set_.id] = SetInfo(set_.id, set_.name, set_.theme, set_.year_released, set_.piece_count, set_pieces)
+        return sets[set_.id]
+
+    def _order_info(self, order: Order, sets: Dict[int, SetInfo], pieces: Dict[int, PieceInfo]) -> OrderInfo:
+        order_sets = tuple(
+            OrderSetInfo(self._set_info(order_set.set, sets, pieces), order_set.quantity)
+            for order_set in sorted(order.order_sets, key=lambda order_set: order_set.set_id)
+        )
+        return OrderInfo(order.id, order.date, order.total_sets, order_sets)
+
+    def order_arrays(self, order_ids: Iterable[int]) -> Dict[str, np.ndarray]:
+        """Load the relationships of several orders as flat structured arrays, without any ORM objects.
+
+        Two statements are issued: one for the order sets and one for the pieces of all their sets.
+
+        :param order_ids: Order IDs to load
+        :return: Dictionary with 'order_sets' (ORDER_SET_DTYPE) and 'set_pieces' (SET_PIECE_DTYPE), sorted by key
+        """
+        order_ids = sorted({int(order_id) for order_id in order_ids})
+        order_sets_statement = (
+            select(OrderSet.order_id, OrderSet.set_id, OrderSet.quantity)
+            .where(OrderSet.order_id.in_(order_ids))
+            .order_by(OrderSet.order_id, OrderSet.set_id)
+        )
+        set_pieces_statement = (
+            select(SetPiece.set_id, SetPiece.piece_id, SetPiece.quantity)
+            .where(SetPiece.set_id.in_(order_sets_statement.with_only_columns(OrderSet.set_id).order_by(None)))
+            .order_by(SetPiece.set_id, SetPiece.piece_id)
+        )
+
+        with self._counted() as counter, self.engine.connect() as connection:
+            order_sets = connection.execute(order_sets_statement).all()
+            set_pieces = connection.execute(set_pieces_statement).all()
+
+        self._finish(counter)
+        return {
+            "order_sets": np.array([tuple(row) for row in order_sets], dtype=ORDER_SET_DTYPE),
+            "set_pieces": np.array([tuple(row) for row in set_pieces], dtype=SET_PIECE_DTYPE),
+        }
+
+
+if __name__ == "__main__":
+    from sqlalchemy import create_engine
+
+    from mockup.fake_db_data_generation import create_tables, populate_tables
+
+    # Example usage against an in-memory SQLite database
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    populate_tables(engine, num_records=5)
+
+    reader = CatalogReader(engine)
+    orders = reader.orders(range(1, 6))
+    print(f"[INFO] Loaded {len(orders)} orders with {reader.last_query_count} statements")
+    print(f"[INFO] Order 1 piece totals: {orders[1].piece_totals()}")
+
+    arrays = reader.order_arrays([1, 2])
+    print(
+        f"[INFO] Loaded {len(arrays['order_sets'])} order sets and {len(arrays['set_pieces'])} set pieces "
+        f"with {reader.last_query_count} statements"
+    )
+
+    # The same walk over lazily loaded ORM instances issues one statement per relationship access
+    with QueryCounter(engine) as counter, get_session(engine) as session:
+        for order in session.scalars(select(Order)):
+            for order_set in order.order_sets:
+                _ = [set_piece.piece.name for set_piece in order_set.set.set_pieces]
+    print(f"[INFO] Lazy loading issued {counter.count} statements for the same graph")
@@ -3,38 +3,106 @@
 # Authors: David Anthony Parham
 #
 # Module Description: This script loads the environment variables
-# and establishes a connection to the database.
+# and establishes a connection to the database. The engine is created
+# lazily on first use and cached, so importing this module neither
+# requires a reachable database nor complete environment variables.
 ######################################################################
 
 import os
+from functools import lru_cache
+from typing import Any, Dict, Optional
 from urllib.parse import quote_plus
 
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Fetch database connection details from environment variables
-db_user = os.getenv("DB_USER")
-db_password = os.getenv("DB_PASSWORD")
-db_host = os.getenv("DB_HOST")
-db_port = os.getenv("DB_PORT")
-db_name = os.getenv("DB_NAME")
+# Session factory shared by all modules; sessions are bound to an engine when they are created
+SessionLocal = sessionmaker(expire_on_commit=False)
 
-# Ensure all necessary environment variables are set
-if not all([db_user, db_password, db_host, db_name]):
-    raise OSError("Database environment variables are not fully set.")
 
-# Ensure db_password is a string or handle the case where it's None
-if db_password is None:
-    raise ValueError("DB_PASSWORD environment variable must be set")
+def database_url() -> str:
+    """Build the database URL from the environment variables.
 
-# Handle special characters in the password variable
-encoded_password = quote_plus(db_password)
+    ``DATABASE_URL`` takes precedence. With ``DB_BACKEND=sqlite`` a local SQLite database at ``DB_PATH`` is
+    used, or an in-memory database if no path is set. Otherwise the PostgreSQL connection details are read
+    from ``DB_USER``, ``DB_PASSWORD``, ``DB_HOST``, ``DB_PORT`` and ``DB_NAME``.
 
-# Construct the database URL
-database_url = f"postgresql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
+    :return: SQLAlchemy database URL
+    """
+    if url := os.getenv("DATABASE_URL"):
+        return url
 
-# Create the SQLAlchemy engine
-engine = create_engine(database_url)
+    if os.getenv("DB_BACKEND", "postgresql").lower() == "sqlite":
+        db_path = os.getenv("DB_PATH")
+        return f"sqlite:///{db_path}" if db_path else "sqlite://"
+
+    # Fetch database connection details from environment variables
+    db_user = os.getenv("DB_USER")
+    db_password = os.getenv("DB_PASSWORD")
+    db_host = os.getenv("DB_HOST")
+    db_port = os.getenv("DB_PORT")
+    db_name = os.getenv("DB_NAME")
+
+    # Ensure all necessary environment variables are set
+    if not all([db_user, db_password, db_host, db_name]):
+        raise OSError("Database environment variables are not fully set.")
+
+    # Ensure db_password is a string or handle the case where it's None
+    if db_password is None:
+        raise ValueError("DB_PASSWORD environment variable must be set")
+
+    # Handle special characters in the password variable
+    encoded_password = quote_plus(db_password)
+
+    # Construct the database URL
+    return f"postgresql://{db_user}:{encoded_password}@{db_host}:{db_port}/{db_name}"
+
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """Return the connection pool settings for a database URL."""
+    if make_url(url).get_backend_name() == "sqlite":
+        if make_url(url).database in (None, "", ":memory:"):
+            # A single shared connection keeps the in-memory database alive across sessions and threads
+            return {"poolclass": StaticPool, "connect_args": {"check_same_thread": False}}
+        return {"connect_args": {"check_same_thread": False}}
+
+    return {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_pre_ping": True,
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+    }
+
+
+@lru_cache(maxsize=None)
+def get_engine(url: Optional[str] = None) -> Engine:
+    """Create the SQLAlchemy engine on first use and return the cached instance afterwards.
+
+    :param url: Database URL (default: None, i.e. built from the environment variables)
+    :return: Pooled SQLAlchemy engine
+    """
+    url = url or database_url()
+    return create_engine(url, **_engine_options(url))
+
+
+def get_session(engine: Optional[Engine] = None) -> Session:
+    """Open a session from the shared session factory.
+
+    :param engine: Engine the session is bound to (default: None, i.e. the cached default engine)
+    :return: New SQLAlchemy session
+    """
+    return SessionLocal(bind=engine or get_engine())
+
+
+def __getattr__(name: str) -> Any:
+    # Keep `from database.config import engine` working while deferring the engine creation
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -7,15 +7,32 @@
 # for this project.
 ######################################################################
 
-from database.config import engine
-from mockup.fake_db_data_generation import create_tables, fetch_order_info, populate_tables
+import argparse
+
+from database.config import get_engine
+from mockup.fake_db_data_generation import bulk_populate_tables, create_tables, fetch_order_info, populate_tables
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create and populate the dummy database.")
+    parser.add_argument("--bulk", action="store_true", help="Stream large volumes of rows in chunks")
+    parser.add_argument("--orders", type=int, default=100_000, help="Number of orders in bulk mode")
+    parser.add_argument("--sets", type=int, default=10_000, help="Number of sets in bulk mode")
+    parser.add_argument("--pieces", type=int, default=5_000, help="Number of pieces in bulk mode")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Rows per inserted chunk in bulk mode")
+    args = parser.parse_args()
+    engine = get_engine()
+
     # Create database tables
     create_tables(engine)
 
-    # Populate tables with synthetic (fake dummy) data
-    populate_tables(engine)
+    if args.bulk:
+        # Populate tables with large volumes of synthetic data
+        bulk_populate_tables(
+            engine, num_orders=args.orders, num_sets=args.sets, num_pieces=args.pieces, batch_size=args.batch_size
+        )
+    else:
+        # Populate tables with synthetic (fake dummy) data
+        populate_tables(engine)
 
-    # Retrieve order information
-    fetch_order_info(engine)
+        # Retrieve order information
+        fetch_order_info(engine)
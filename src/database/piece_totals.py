@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script maintains the materialized piece
+# totals of every order in the order_piece_totals table. The table is
+# rebuilt in bulk after large loads, refreshed incrementally for the
+# orders affected by changed order_sets or set_pieces rows, and can be
+# verified against the live aggregate.
+#
+# The incremental refresh is wired into the SessionLocal sessions when
+# the database package is imported: it covers flushed ORM objects as
+# well as ORM bulk INSERT, UPDATE and DELETE statements run with
+# session.execute. Writes that bypass these
+# sessions (Core statements on an engine or connection, raw SQL, other
+# session factories or processes) leave the totals stale; call
+# refresh_piece_totals in the same transaction, or rebuild afterwards.
+######################################################################
+
+import argparse
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from sqlalchemy import Select, delete, event, func, insert, inspect, select, update
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.orm import ORMExecuteState, Session
+
+from database.config import SessionLocal
+from database.schema import Order, OrderPieceTotal, OrderSet, SetPiece, utc_now
+
+# Number of order IDs per IN clause; SQLite limits the number of bound parameters per statement
+_CHUNK_SIZE = 500
+
+
+def piece_totals_statement(order_ids: Optional[Iterable[int]] = None) -> Select:
+    """Build the live aggregate of the piece totals per order.
+
+    Only ``order_sets`` and ``set_pieces`` are joined, on the covering (set_id, ...) indexes of both tables.
+
+    :param order_ids: Order IDs to aggregate (default: None, i.e. all orders)
+    :return: Statement selecting (order_id, piece_id, total_quantity)
+    """
+    statement = (
+        select(
+            OrderSet.order_id,
+            SetPiece.piece_id,
+            func.sum(SetPiece.quantity * OrderSet.quantity).label("total_quantity"),
+        )
+        .join(SetPiece, SetPiece.set_id == OrderSet.set_id)
+        .group_by(OrderSet.order_id, SetPiece.piece_id)
+    )
+    if order_ids is not None:
+        statement = statement.where(OrderSet.order_id.in_(list(order_ids)))
+    return statement
+
+
+def _chunks(values: Iterable[int]) -> Iterable[List[int]]:
+    values = sorted(set(values))
+    for start in range(0, len(values), _CHUNK_SIZE):
+        yield values[start : start + _CHUNK_SIZE]
+
+
+def _insert_totals(connection: Connection, order_ids: Optional[Iterable[int]] = None) -> int:
+    columns = ["order_id", "piece_id", "total_quantity"]
+    result = connection.execute(insert(OrderPieceTotal).from_select(columns, piece_totals_statement(order_ids)))
+    return max(result.rowcount, 0)
+
+
+def rebuild_piece_totals(engine: Engine) -> Dict[str, float]:
+    """Recompute the whole table with one INSERT ... SELECT, e.g. after a bulk load that bypassed the ORM.
+
+    :param engine: SQLAlchemy engine object
+    :return: Dictionary with the number of rows and the elapsed seconds
+    """
+    start = time.perf_counter()
+    with engine.begin() as connection:
+        connection.execute(delete(OrderPieceTotal))
+        n_rows = _insert_totals(connection)
+    return {"rows": n_rows, "seconds": time.perf_counter() - start}
+
+
+def orders_of_sets(connection: Connection, set_ids: Iterable[int]) -> Set[int]:
+    """Return the IDs of all orders that contain one of the sets.
+
+    :param connection: Connection of the current transaction
+    :param set_ids: Set IDs whose pieces changed
+    :return: Set of affected order IDs
+    """
+    order_ids: Set[int] = set()
+    for chunk in _chunks(set_ids):
+        order_ids.update(connection.execute(select(OrderSet.order_id).where(OrderSet.set_id.in_(chunk))).scalars())
+    return order_ids
+
+
+def refresh_piece_totals(connection: Connection, order_ids: Iterable[int], touch: bool = True) -> int:
+    """Recompute the piece totals of the given orders within the current transaction.
+
+    :param connection: Connection of the transaction that changed the orders
+    :param order_ids: IDs of the orders whose sets or set pieces changed
+    :param touch: Flag to bump Order.updated_at, so OrderBomCache revalidates the orders (default: True)
+    :return: Number of written rows
+    """
+    n_rows = 0
+    for chunk in _chunks(order_ids):
+        connection.execute(delete(OrderPieceTotal).where(OrderPieceTotal.order_id.in_(chunk)))
+        n_rows += _insert_totals(connection, chunk)
+        if touch:
+            connection.execute(update(Order).where(Order.id.in_(chunk)).values(updated_at=utc_now()))
+    return n_rows
+
+
+def _changed_values(instance: Any, attribute: str) -> Set[int]:
+    """Return the current and all previous values of an attribute that were changed in this flush."""
+    history = inspect(instance).attrs[attribute].history
+    values = {getattr(instance, attribute), *history.deleted}
+    return {int(value) for value in values if value is not None}
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _refresh_after_flush(session: Session, flush_context: Any) -> None:
+    """Refresh the piece totals of all orders affected by the flushed OrderSet and SetPiece changes."""
+    order_ids: Set[int] = set()
+    set_ids: Set[int] = set()
+
+    for instance in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(instance, OrderSet):
+            order_ids |= _changed_values(instance, "order_id")
+        elif isinstance(instance, SetPiece):
+            set_ids |= _changed_values(instance, "set_id")
+
+    if not order_ids and not set_ids:
+        return
+
+    # The flushed rows are visible to this connection, so the refresh commits or rolls back with them
+    connection = session.connection()
+    refresh_piece_totals(connection, order_ids | orders_of_sets(connection, set_ids))
+
+
+def _parameter_values(orm_execute_state: ORMExecuteState, key: str) -> Set[int]:
+    """Return the values of a column in the parameter sets of a statement."""
+    parameters = orm_execute_state.parameters or {}
+    rows = parameters if isinstance(parameters, (list, tuple)) else [parameters]
+    return {int(row[key]) for row in rows if row.get(key) is not None}
+
+
+def _affected_keys(connection: Connection, orm_execute_state: ORMExecuteState, column: Any) -> Dict[int, Optional[int]]:
+    """Return the primary keys and key column values of the rows an UPDATE or DELETE statement will change."""
+    entity = column.class_
+    statement = select(entity.id, column)
+    if orm_execute_state.is_executemany:
+        # ORM bulk UPDATE by primary key, with one parameter set per row
+        statement = statement.where(entity.id.in_(_parameter_values(orm_execute_state, "id")))
+    elif orm_execute_state.statement.whereclause is not None:
+        statement = statement.where(orm_execute_state.statement.whereclause)
+    rows = connection.execute(statement).all()
+    return {int(row_id): value for row_id, value in rows}
+
+
+@event.listens_for(SessionLocal, "do_orm_execute")
+def _refresh_after_bulk(orm_execute_state: ORMExecuteState) -> Optional[Any]:
+    """Refresh the piece totals of all orders affected by an ORM bulk statement on OrderSet or SetPiece."""
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return None
+    mapper = orm_execute_state.bind_mapper
+    entity = mapper.class_ if mapper is not None else None
+    if entity is OrderSet:
+        column = OrderSet.order_id
+    elif entity is SetPiece:
+        column = SetPiece.set_id
+    else:
+        return None
+
+    connection = orm_execute_state.session.connection()
+    if orm_execute_state.is_insert:
+        # Rows of a VALUES clause are found by their new primary keys, rows of parameter sets by their values
+        last_id = connection.execute(select(func.max(entity.id))).scalar()
+        result = orm_execute_state.invoke_statement()
+        new_rows = select(column) if last_id is None else select(column).where(entity.id > last_id)
+        keys = {*_parameter_values(orm_execute_state, column.key), *connection.execute(new_rows).scalars()}
+    else:
+        # The rows are selected before the statement, and re-read after an UPDATE that may move them
+        before = _affected_keys(connection, orm_execute_state, column)
+        result = orm_execute_state.invoke_statement()
+        keys = set(before.values())
+        if orm_execute_state.is_update and before:
+            for chunk in _chunks(before):
+                keys.update(connection.execute(select(column).where(entity.id.in_(chunk))).scalars())
+
+    keys.discard(None)
+    order_ids = keys if entity is OrderSet else orders_of_sets(connection, keys)
+    refresh_piece_totals(connection, order_ids)
+    return result
+
+
+def verify_piece_totals(engine: Engine, order_ids: Optional[Iterable[int]] = None) -> Dict[str, Any]:
+    """Compare the materialized table against the live aggregate.
+
+    :param engine: SQLAlchemy engine object
+    :param order_ids: Order IDs to verify (default: None, i.e. all orders)
+    :return: Dictionary with the number of live rows, the rows missing from and the rows only present in the table
+    """
+    order_ids = None if order_ids is None else list(order_ids)
+    materialized = select(OrderPieceTotal.order_id, OrderPieceTotal.piece_id, OrderPieceTotal.total_quantity)
+    if order_ids is not None:
+        materialized = materialized.where(OrderPieceTotal.order_id.in_(order_ids))
+    live = piece_totals_statement(order_ids)
+
+    with engine.connect() as connection:
+        n_live = connection.execute(select(func.count()).select_from(live.subquery())).scalar()
+        missing = connection.execute(live.except_(materialized)).all()
+        unexpected = connection.execute(materialized.except_(live)).all()
+
+    return {
+        "rows": int(n_live),
+        "missing": [tuple(row) for row in missing],
+        "unexpected": [tuple(row) for row in unexpected],
+        "ok": not missing and not unexpected,
+    }
+
+
+if __name__ == "__main__":
+    from database.config import get_engine
+
+    parser = argparse.ArgumentParser(description="Maintain the materialized order piece totals.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Recompute the whole table")
+    verify_parser = subparsers.add_parser("verify", help="Compare the table against the live aggregate")
+    verify_parser.add_argument("--orders", type=int, nargs="+", help="Order IDs to verify (default: all)")
+    args = parser.parse_args()
+    engine = get_engine()
+
+    if args.command == "rebuild":
+        stats = rebuild_piece_totals(engine)
+        print(f"[INFO] Rebuilt {stats['rows']} piece totals in {stats['seconds']:.2f} s")
+    else:
+        report = verify_piece_totals(engine, args.orders)
+        for row in report["missing"][:10]:
+            print(f"[ERROR] Missing or stale: order {row[0]}, piece {row[1]}, total quantity {row[2]}")
+        for row in report["unexpected"][:10]:
+            print(f"[ERROR] Unexpected: order {row[0]}, piece {row[1]}, total quantity {row[2]}")
+        print(
+            f"[INFO] Verified {report['rows']} piece totals: {len(report['missing'])} missing or stale, "
+            f"{len(report['unexpected'])} unexpected"
+        )
+        sys.exit(0 if report["ok"] else 1)
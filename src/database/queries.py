@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the production queries
+# that are executed when an order is scanned, most importantly the
+# bill of materials (piece totals) of a single order, read from the
+# materialized order_piece_totals table, together with a result cache
+# for repeated scans of the same order.
+######################################################################
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+
+import numpy as np
+from sqlalchemy import Select, select
+from sqlalchemy.engine import Connection, Engine
+
+from database.schema import Order, OrderPieceTotal
+
+# Record layout of a bill of materials
+BOM_DTYPE = np.dtype([("piece_id", np.int64), ("total_quantity", np.int64)])
+
+
+def order_bom_statement(order_id: int) -> Select:
+    """Build the statement for the piece totals of one order.
+
+    The totals are materialized per (order_id, piece_id), so this is a single range scan of the primary key.
+
+    :param order_id: Order ID of the scanned order
+    :return: Statement selecting (piece_id, total_quantity) ordered by piece ID
+    """
+    return (
+        select(OrderPieceTotal.piece_id, OrderPieceTotal.total_quantity)
+        .where(OrderPieceTotal.order_id == order_id)
+        .order_by(OrderPieceTotal.piece_id)
+    )
+
+
+def _fetch_bom(connection: Connection, order_id: int) -> np.ndarray:
+    rows = connection.execute(order_bom_statement(order_id)).all()
+    bom = np.array([tuple(row) for row in rows], dtype=BOM_DTYPE)
+
+    # Cached results are shared between callers, so they must not be modified in place
+    bom.flags.writeable = False
+    return bom
+
+
+def fetch_order_bom(engine: Engine, order_id: int) -> np.ndarray:
+    """Retrieve the bill of materials of a single order from the materialized piece totals.
+
+    :param engine: SQLAlchemy engine object
+    :param order_id: Order ID of the scanned order
+    :return: Read-only structured array with the fields piece_id and total_quantity
+    """
+    with engine.connect() as connection:
+        return _fetch_bom(connection, order_id)
+
+
+class _CacheEntry(NamedTuple):
+    bom: np.ndarray
+    updated_at: Optional[datetime]
+    checked_at: float
+
+
+class OrderBomCache:
+    """LRU cache of order bills of materials that is invalidated by ``Order.updated_at``.
+
+    A cached order is revalidated with a single primary-key lookup of its ``updated_at`` column, which is
+    much cheaper than reading the totals. Within ``revalidate_after`` seconds of the last check, repeated scans
+    of the same order are answered without touching the database at all. The incremental refresh of the piece
+    totals bumps ``Order.updated_at`` of the affected orders with a microsecond timestamp, so even two updates
+    within the same second are detected; writers that bypass it (e.g. Core bulk loads) should call invalidate.
+    """
+
+    def __init__(self, engine: Engine, maxsize: int = 128, revalidate_after: float = 10.0):
+        """Initialize the cache.
+
+        :param engine: SQLAlchemy engine object
+        :param maxsize: Maximum number of cached orders (default: 128)
+        :param revalidate_after: Seconds during which a cached order is trusted without a check (default: 10.0)
+        """
+        self.engine = engine
+        self.maxsize = maxsize
+        self.revalidate_after = revalidate_after
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, _CacheEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, order_id: int) -> Optional[_CacheEntry]:
+        with self._lock:
+            entry = self._entries.get(order_id)
+            if entry is not None:
+                self._entries.move_to_end(order_id)
+            return entry
+
+    def _store(self, order_id: int, entry: _CacheEntry) -> None:
+        with self._lock:
+            self._entries[order_id] = entry
+            self._entries.move_to_end(order_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, order_id: int) -> np.ndarray:
+        """Return the bill of materials of an order, querying the database only when needed.
+
+        :param order_id: Order ID of the scanned order
+        :return: Read-only structured array with the fields piece_id and total_quantity
+        """
+        entry = self._lookup(order_id)
+        now = time.monotonic()
+
+        if entry is not None and now - entry.checked_at < self.revalidate_after:
+            self.hits += 1
+            return entry.bom
+
+        with self.engine.connect() as connection:
+            updated_at = connection.execute(select(Order.updated_at).where(Order.id == order_id)).scalar()
+
+            if entry is not None and entry.updated_at == updated_at:
+                self.hits += 1
+                self._store(order_id, entry._replace(checked_at=now))
+                return entry.bom
+
+            self.misses += 1
+            bom = _fetch_bom(connection, order_id)
+
+        self._store(order_id, _CacheEntry(bom, updated_at, now))
+        return bom
+
+    def invalidate(self, order_id: Optional[int] = None) -> None:
+        """Drop one cached order or the whole cache.
+
+        :param order_id: Order ID to drop (default: None, i.e. all orders)
+        """
+        with self._lock:
+            if order_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(order_id, None)
+
+
+if __name__ == "__main__":
+    from sqlalchemy import create_engine
+
+    from mockup.fake_db_data_generation import create_tables, populate_tables
+
+    # Example usage against an in-memory SQLite database
+    engine = create_engine("sqlite://")
+    create_tables(engine)
+    populate_tables(engine, num_records=5)
+
+    cache = OrderBomCache(engine)
+    for _ in range(3):
+        bom = cache.get(1)
+
+    print(f"[INFO] Order 1 bill of materials: {bom.tolist()}")
+    print(f"[INFO] Cache hits: {cache.hits}, misses: {cache.misses}")
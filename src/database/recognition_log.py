@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the asynchronous writer of
+# the recognition events. Events are buffered in a bounded in-memory
+# queue and written by a background thread in batches, triggered by a
+# batch size or a time interval, so the video loop never waits on the
+# database unless the buffer is full.
+######################################################################
+
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+
+from database.schema import RecognitionEvent, utc_now
+
+# Marker that stops the writer thread
+_STOP = object()
+
+
+class RecognitionEventWriter:
+    """Buffers recognition events and writes them with Core bulk inserts on a background thread.
+
+    A batch is written as soon as ``batch_size`` events are buffered or ``flush_interval`` seconds after its
+    first event arrived. When the database falls behind, the buffer of ``max_pending`` events fills up and
+    record blocks for at most ``put_timeout`` seconds before the event is dropped and counted, which bounds
+    both the memory and the stall of the video loop. A batch that fails with a database error is retried with
+    exponential backoff before its events are counted as failed; any other error fails the batch at once. The
+    thread survives every failed batch, and metrics reports the last error and whether the thread is alive.
+    """
+
+    def __init__(  # noqa
+        self,
+        engine: Engine,
+        batch_size: int = 256,
+        flush_interval: float = 1.0,
+        max_pending: int = 10_000,
+        put_timeout: Optional[float] = 0.05,
+        max_retries: int = 3,
+        retry_backoff: float = 0.1,
+    ):
+        """Initialize the writer and start its background thread.
+
+        :param engine: SQLAlchemy engine object
+        :param batch_size: Maximum number of events per insert (default: 256)
+        :param flush_interval: Maximum time an event waits for its batch in seconds (default: 1.0)
+        :param max_pending: Maximum number of buffered events (default: 10000)
+        :param put_timeout: Maximum time record blocks on a full buffer in seconds; None blocks until there is
+            space, 0 drops immediately (default: 0.05)
+        :param max_retries: Number of retries of a failed batch (default: 3)
+        :param retry_backoff: Delay before the first retry in seconds, doubled for every further one (default: 0.1)
+        """
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._queue: "queue.Queue[Any]" = queue.Queue(max_pending)
+        self._flush_latencies: Deque[float] = deque(maxlen=1000)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+        self.last_error: Optional[BaseException] = None
+
+        self._thread = threading.Thread(target=self._run, name="recognition-writer", daemon=True)
+        self._thread.start()
+
+    def __enter__(self) -> "RecognitionEventWriter":
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def record(  # noqa
+        self,
+        order_id: int,
+        piece_id: Optional[int],
+        confidence: Optional[float] = None,
+        stream_id: Optional[int] = None,
+        track_id: Optional[int] = None,
+        frame_index: Optional[int] = None,
+        recognized_at: Optional[datetime] = None,
+        redundant: Optional[bool] = None,
+    ) -> bool:
+        """Buffer one recognition event.
+
+        :param order_id: Order ID the brick was recognized for
+        :param piece_id: Recognized piece ID, or None for a redundant brick
+        :param confidence: Confidence of the recognition (default: None)
+        :param stream_id: ID of the camera stream (default: None)
+        :param track_id: Track ID of the brick (default: None)
+        :param frame_index: Index of the frame the brick was recognized in (default: None)
+        :param recognized_at: Time of the recognition in naive UTC (default: None, i.e. now)
+        :param redundant: Flag of a brick that is not part of the order; False with piece_id None records a brick
+            that could not be classified (default: None, i.e. piece_id is None)
+        :return: True if the event was buffered, False if it was dropped because the buffer stayed full or the
+            writer is closed
+        """
+        row = {
+            "order_id": int(order_id),
+            "piece_id": None if piece_id is None else int(piece_id),
+            "redundant": piece_id is None if redundant is None else redundant,
+            "confidence": None if confidence is None else float(confidence),
+            "stream_id": stream_id,
+            "track_id": None if track_id is None else int(track_id),
+            "frame_index": None if frame_index is None else int(frame_index),
+            "recognized_at": recognized_at or utc_now(),
+        }
+        try:
+            if not self._thread.is_alive():
+                raise queue.Full
+            self._queue.put(row, block=self.put_timeout != 0, timeout=self.put_timeout or None)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            return False
+
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    def recorder(
+        self, order_id: Union[int, Callable[[], Optional[int]]], stream_id: Optional[int] = None
+    ) -> Callable[[Any], None]:
+        """Return an on_result callback of VideoStreamRunner that records every recognition.
+
+        :param order_id: Order ID, or a callable returning the current order ID (None while no order is active)
+        :param stream_id: ID of the camera stream (default: None)
+        :return: Callback taking a Recognition
+        """
+
+        def on_result(recognition: Any) -> None:
+            current = order_id() if callable(order_id) else order_id
+            if current is None:
+                return
+            # Labels are product IDs, the REDUNDANT_BRICK string for bricks that are not part of the order, or None
+            # for tracks that ended without a classification
+            piece_id = recognition.label if isinstance(recognition.label, (int, np.integer)) else None
+            self.record(
+                current,
+                piece_id,
+                confidence=getattr(recognition, "confidence", None),
+                stream_id=stream_id,
+                track_id=getattr(recognition, "track_id", None),
+                frame_index=recognition.frame_index,
+                redundant=isinstance(recognition.label, str),
+            )
+
+        return on_result
+
+    def _collect(self) -> Tuple[List[Dict[str, Any]], List[threading.Event], bool]:
+        """Wait for the first event, then for more until the batch is full, the interval passed or a flush."""
+        batch: List[Dict[str, Any]] = []
+        flushes: List[threading.Event] = []
+        item = self._queue.get()
+        deadline = time.perf_counter() + self.flush_interval
+
+        while True:
+            if item is _STOP:
+                return batch, flushes, True
+            if isinstance(item, threading.Event):
+                flushes.append(item)
+                return batch, flushes, False
+
+            batch.append(item)
+            remaining = deadline - time.perf_counter()
+            if len(batch) >= self.batch_size or remaining <= 0:
+                return batch, flushes, False
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                return batch, flushes, False
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        start = time.perf_counter()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with self.engine.begin() as connection:
+                    connection.execute(insert(RecognitionEvent), batch)
+                break
+            except SQLAlchemyError as error:
+                if attempt == self.max_retries:
+                    raise
+                self.last_error = error
+                time.sleep(self.retry_backoff * 2**attempt)
+
+        with self._lock:
+            self.written += len(batch)
+            self.batches += 1
+            self._flush_latencies.append(time.perf_counter() - start)
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            batch, flushes, stop = self._collect()
+            try:
+                if batch:
+                    self._write(batch)
+            except Exception as error:
+                # Whatever went wrong with this batch, the thread keeps serving the next ones
+                self.last_error = error
+                print(f"[ERROR] Dropping {len(batch)} recognition events: {error!s}")
+                with self._lock:
+                    self.failed += len(batch)
+            finally:
+                for flushed in flushes:
+                    flushed.set()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Write all events buffered so far.
+
+        :param timeout: Maximum time to wait in seconds (default: None, i.e. until they are written)
+        :return: True if the events were written within the timeout
+        """
+        if not self._thread.is_alive():
+            return self._queue.empty()
+        flushed = threading.Event()
+        self._queue.put(flushed)
+        return flushed.wait(timeout)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Write all buffered events and stop the background thread.
+
+        :param timeout: Maximum time to wait for the thread in seconds (default: None)
+        """
+        if self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def metrics(self) -> Dict[str, Any]:
+        """Return the queue depth, the event counters, the flush latency percentiles and the writer health."""
+        with self._lock:
+            latencies = np.asarray(self._flush_latencies)
+            counters = {
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+                "batches": self.batches,
+            }
+        return {
+            "queue_depth": self._queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            **counters,
+            "mean_batch": counters["written"] / counters["batches"] if counters["batches"] else 0.0,
+            "flush_latency_ms": {
+                f"p{q}": float(np.percentile(latencies, q) * 1000) if len(latencies) else 0.0 for q in (50, 90, 99)
+            },
+            "thread_alive": self._thread.is_alive(),
+            "last_error": None if self.last_error is None else repr(self.last_error),
+        }
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    from sqlalchemy import create_engine, func, select
+
+    from mockup.fake_db_data_generation import create_tables, populate_tables
+
+    # Example usage against a local SQLite database, with a burst of events from four cameras
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{Path(directory) / 'recognitions.db'}")
+        create_tables(engine)
+        populate_tables(engine, num_records=5)
+
+        rng = np.random.default_rng(42)
+        start = time.perf_counter()
+        with RecognitionEventWriter(engine, batch_size=256, flush_interval=0.2) as writer:
+            for index in range(20_000):
+                piece_id = int(rng.integers(1, 6)) if rng.random() > 0.1 else None
+                writer.record(1, piece_id, confidence=float(rng.random()), stream_id=index % 4, frame_index=index)
+            enqueued = time.perf_counter() - start
+        elapsed = time.perf_counter() - start
+
+        with engine.connect() as connection:
+            n_rows = connection.execute(select(func.count()).select_from(RecognitionEvent)).scalar()
+        print(f"[INFO] Enqueued 20000 events in {enqueued:.2f} s, written after {elapsed:.2f} s ({n_rows} rows)")
+        print(f"[INFO] Writer metrics: {writer.metrics()}")
+        engine.dispose()
@@ -7,9 +7,10 @@
 # used at a Lego Play Day Event.
 ######################################################################
 
+from datetime import datetime, timezone
 from typing import TYPE_CHECKING
 
-from sqlalchemy import TIMESTAMP, Column, Date, ForeignKey, Integer, String, func
+from sqlalchemy import TIMESTAMP, Boolean, Column, Date, Float, ForeignKey, Index, Integer, String, func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -19,6 +20,15 @@ if TYPE_CHECKING:
 Base: "DeclarativeMeta" = declarative_base()
 
 
+def utc_now() -> datetime:
+    """Return the current UTC time with microseconds.
+
+    SQLite's CURRENT_TIMESTAMP has a resolution of one second, which is too coarse to detect two updates of
+    the same order within a second, so update timestamps are set on the Python side.
+    """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class Order(Base):
     """Represents a order history in the database."""
 
@@ -27,7 +37,8 @@ class Order(Base):
     date = Column(Date, nullable=False, name="order_date")
     total_sets = Column(Integer, nullable=False)
     created_at = Column(TIMESTAMP, server_default=func.now())
-    updated_at = Column(TIMESTAMP, server_default=func.now(), onupdate=func.now())
+    # Set on the Python side in naive UTC, so inserts and updates agree regardless of the server time zone
+    updated_at = Column(TIMESTAMP, default=utc_now, onupdate=utc_now)
     order_sets = relationship("OrderSet", back_populates="order")
 
 
@@ -60,6 +71,7 @@ class OrderSet(Base):
     """Represents a relationship between an order and a set in the database."""
 
     __tablename__ = "order_sets"
+    __table_args__ = (Index("ix_order_sets_set_id_order_id", "set_id", "order_id", "quantity"),)
     id = Column(Integer, primary_key=True, name="order_set_id")
     order_id = Column(Integer, ForeignKey("orders.order_id"), index=True)
     set_id = Column(Integer, ForeignKey("sets.set_id"), index=True)
@@ -72,9 +84,44 @@ class SetPiece(Base):
     """Represents a relationship between a set and a piece (brick) in the database."""
 
     __tablename__ = "set_pieces"
+    __table_args__ = (Index("ix_set_pieces_set_id_piece_id", "set_id", "piece_id", "quantity"),)
     id = Column(Integer, primary_key=True, name="set_piece_id")
     set_id = Column(Integer, ForeignKey("sets.set_id"), index=True)
     piece_id = Column(Integer, ForeignKey("pieces.piece_id"), index=True)
     quantity = Column(Integer, nullable=False)
     set = relationship("Set", back_populates="set_pieces")
     piece = relationship("Piece", back_populates="set_pieces")
+
+
+class OrderPieceTotal(Base):
+    """Represents the materialized total quantity of a piece (brick) in an order.
+
+    The rows are derived from ``order_sets`` and ``set_pieces`` and maintained by database.piece_totals.
+    """
+
+    __tablename__ = "order_piece_totals"
+    __table_args__ = (Index("ix_order_piece_totals_piece_id_order_id", "piece_id", "order_id"),)
+    order_id = Column(Integer, ForeignKey("orders.order_id"), primary_key=True)
+    piece_id = Column(Integer, ForeignKey("pieces.piece_id"), primary_key=True)
+    total_quantity = Column(Integer, nullable=False)
+
+
+class RecognitionEvent(Base):
+    """Represents a brick recognized on the conveyor belt while an order was processed.
+
+    Redundant bricks, i.e. bricks that are not part of the order, have no piece ID. Bricks that could not be
+    classified have no piece ID either, but are not flagged as redundant.
+    """
+
+    __tablename__ = "recognition_events"
+    __table_args__ = (Index("ix_recognition_events_order_id_recognized_at", "order_id", "recognized_at"),)
+    id = Column(Integer, primary_key=True, name="event_id")
+    order_id = Column(Integer, ForeignKey("orders.order_id"), nullable=False)
+    piece_id = Column(Integer, ForeignKey("pieces.piece_id"))
+    redundant = Column(Boolean, nullable=False, default=False)
+    confidence = Column(Float)
+    stream_id = Column(Integer)
+    track_id = Column(Integer)
+    frame_index = Column(Integer)
+    recognized_at = Column(TIMESTAMP, nullable=False)
+    created_at = Column(TIMESTAMP, server_default=func.now())
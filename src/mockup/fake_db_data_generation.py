@@ -7,14 +7,25 @@
 # and retrieval of table data.
 ######################################################################
 
-from database.schema import Base, Order, OrderSet, Piece, Set, SetPiece
+import csv
+import datetime
+import io
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from database.config import get_session
+from database.piece_totals import rebuild_piece_totals
+from database.schema import Base, Order, OrderPieceTotal, OrderSet, Piece, Set, SetPiece, utc_now
 from faker import Faker
-from sqlalchemy import func
-from sqlalchemy.engine import Engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import Table, func, select, text
+from sqlalchemy.engine import Connection, Engine, Row
 
 fake = Faker()
 
+# Number of distinct Faker values that bulk-generated rows are drawn from
+_BULK_VOCABULARY = 1000
+
 
 def create_tables(engine: Engine) -> None:
     """Create all tables defined in the SQLAlchemy Base.
@@ -30,8 +41,7 @@ def populate_tables(engine: Engine, num_records: int = 10) -> None:
     :param engine: SQLAlchemy engine object
     :param num_records: Number of records to generate for each table
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    session = get_session(engine)
 
     try:
         # Generate dummy data for orders
@@ -90,20 +100,212 @@ def populate_tables(engine: Engine, num_records: int = 10) -> None:
         session.close()
 
 
-def fetch_order_info(engine: Engine) -> None:
+def _next_id(connection: Connection, column: Any) -> int:
+    """Return the first free primary key of a table."""
+    return int(connection.execute(select(func.coalesce(func.max(column), 0))).scalar()) + 1
+
+
+def _skewed_children(
+    rng: np.random.Generator, n_parents: int, n_children: int, count_range: Tuple[int, int]
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Draw a sparse parent-child relationship in which a few children are much more popular than others.
+
+    :param rng: Random number generator
+    :param n_parents: Number of parents in this chunk
+    :param n_children: Number of available children
+    :param count_range: Inclusive range of the number of distinct children per parent
+    :return: Tuple of (parent offsets, child offsets), both sorted by parent and unique per pair
+    """
+    counts = rng.integers(count_range[0], count_range[1] + 1, size=n_parents)
+    parents = np.repeat(np.arange(n_parents, dtype=np.int64), counts)
+
+    # Squaring a uniform sample concentrates the draws on low offsets, i.e. on popular sets and bricks
+    children = (rng.random(len(parents)) ** 2 * n_children).astype(np.int64)
+    pairs = np.unique(parents * n_children + children)
+
+    return pairs // n_children, pairs % n_children
+
+
+def _insert_chunk(connection: Connection, table: Table, columns: Sequence[str], rows: List[Tuple]) -> None:
+    """Insert a chunk of rows with PostgreSQL COPY if available, otherwise as Core executemany."""
+    if connection.dialect.name == "postgresql" and connection.dialect.driver == "psycopg2":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+        return
+
+    connection.execute(table.insert(), [dict(zip(columns, row, strict=True)) for row in rows])
+
+
+def _load_table(
+    engine: Engine, table: Table, columns: Sequence[str], chunks: Iterator[List[Tuple]]
+) -> Tuple[int, float]:
+    """Stream generated chunks into a table within one transaction.
+
+    :return: Tuple of (number of inserted rows, elapsed seconds)
+    """
+    start = time.perf_counter()
+    n_rows = 0
+
+    with engine.begin() as connection:
+        for rows in chunks:
+            _insert_chunk(connection, table, columns, rows)
+            n_rows += len(rows)
+
+        # Explicit IDs bypass the PostgreSQL sequences, which therefore have to be moved past them
+        primary_key = table.primary_key.columns.values()[0].name
+        if connection.dialect.name == "postgresql":
+            connection.execute(
+                text(
+                    f"SELECT setval(pg_get_serial_sequence('{table.name}', '{primary_key}'), "
+                    f"(SELECT MAX({primary_key}) FROM {table.name}))"
+                )
+            )
+
+    return n_rows, time.perf_counter() - start
+
+
+def bulk_populate_tables(  # noqa
+    engine: Engine,
+    num_orders: int = 100_000,
+    num_sets: int = 10_000,
+    num_pieces: int = 5_000,
+    sets_per_order: Tuple[int, int] = (1, 5),
+    pieces_per_set: Tuple[int, int] = (10, 60),
+    batch_size: int = 10_000,
+    seed: Optional[int] = None,
+) -> Dict[str, Dict[str, float]]:
+    """Populate tables with large volumes of dummy data.
+
+    Rows are generated with NumPy and streamed in chunks of batch_size rows, via PostgreSQL COPY when the
+    psycopg2 driver is used and Core executemany inserts otherwise (e.g. on SQLite). Orders reference a few
+    sets and sets a few pieces, drawn with a popularity skew, instead of the all-pairs cross products of
+    populate_tables. The bulk inserts bypass the incremental refresh, so the order piece totals are rebuilt
+    afterwards.
+
+    :param engine: SQLAlchemy engine object
+    :param num_orders: Number of orders to generate (default: 100000)
+    :param num_sets: Number of sets to generate (default: 10000)
+    :param num_pieces: Number of pieces to generate (default: 5000)
+    :param sets_per_order: Inclusive range of distinct sets per order (default: (1, 5))
+    :param pieces_per_set: Inclusive range of distinct pieces per set (default: (10, 60))
+    :param batch_size: Number of rows per inserted chunk (default: 10000)
+    :param seed: Seed for the random number generator (default: None)
+    :return: Dictionary mapping table names to their number of rows, seconds and rows per second
+    """
+    rng = np.random.default_rng(seed)
+    entropy = np.random.SeedSequence(seed).entropy
+    Faker.seed(seed)
+
+    words = [fake.word() for _ in range(_BULK_VOCABULARY)]
+    companies = [fake.company() for _ in range(_BULK_VOCABULARY)]
+    colors = [fake.color_name() for _ in range(_BULK_VOCABULARY)]
+    start_of_year = datetime.date(datetime.date.today().year, 1, 1)
+
+    # COPY bypasses the Python-side column defaults, so the update timestamp is written explicitly
+    loaded_at = utc_now()
+
+    with engine.connect() as connection:
+        first_order = _next_id(connection, Order.id)
+        first_set = _next_id(connection, Set.id)
+        first_piece = _next_id(connection, Piece.id)
+        first_order_set = _next_id(connection, OrderSet.id)
+        first_set_piece = _next_id(connection, SetPiece.id)
+
+    def pick(values: List[str], size: int) -> List[str]:
+        return [values[i] for i in rng.integers(0, len(values), size=size)]
+
+    def relationship_chunks(
+        n_parents: int, n_children: int, count_range: Tuple[int, int], stream: int
+    ) -> Iterator[Tuple[int, int, np.ndarray, np.ndarray]]:
+        # Each chunk has its own seeded stream, so the order rows and the order_sets rows can both derive
+        # the same relationship chunk by chunk instead of keeping it in memory
+        parents_per_chunk = max(1, batch_size // max(1, sum(count_range) // 2))
+        for chunk, lo in enumerate(range(0, n_parents, parents_per_chunk)):
+            n = min(parents_per_chunk, n_parents - lo)
+            chunk_rng = np.random.default_rng([entropy, stream, chunk])
+            parents, children = _skewed_children(chunk_rng, n, n_children, count_range)
+            yield lo, n, parents + lo, children
+
+    def piece_rows() -> Iterator[List[Tuple]]:
+        for lo in range(0, num_pieces, batch_size):
+            n = min(batch_size, num_pieces - lo)
+            ids = range(first_piece + lo, first_piece + lo + n)
+            yield list(zip(ids, pick(words, n), pick(colors, n), pick(words, n), pick(words, n), strict=True))
+
+    def set_rows() -> Iterator[List[Tuple]]:
+        for lo in range(0, num_sets, batch_size):
+            n = min(batch_size, num_sets - lo)
+            ids = range(first_set + lo, first_set + lo + n)
+            years = rng.integers(2000, 2024, size=n).tolist()
+            counts = rng.integers(50, 101, size=n).tolist()
+            yield list(zip(ids, pick(companies, n), pick(words, n), years, counts, strict=True))
+
+    def set_piece_rows() -> Iterator[List[Tuple]]:
+        next_id = first_set_piece
+        for _, _, sets, pieces in relationship_chunks(num_sets, num_pieces, pieces_per_set, stream=0):
+            quantities = rng.integers(5, 21, size=len(sets)).tolist()
+            ids = range(next_id, next_id + len(sets))
+            next_id += len(sets)
+            yield list(zip(ids, (sets + first_set).tolist(), (pieces + first_piece).tolist(), quantities, strict=True))
+
+    def order_rows() -> Iterator[List[Tuple]]:
+        for lo, n, orders, _ in relationship_chunks(num_orders, num_sets, sets_per_order, stream=1):
+            ids = range(first_order + lo, first_order + lo + n)
+            dates = [start_of_year + datetime.timedelta(days=day) for day in rng.integers(0, 365, size=n).tolist()]
+            total_sets = np.bincount(orders - lo, minlength=n).tolist()
+            yield list(zip(ids, dates, total_sets, [loaded_at] * n, strict=True))
+
+    def order_set_rows() -> Iterator[List[Tuple]]:
+        next_id = first_order_set
+        for _, _, orders, sets in relationship_chunks(num_orders, num_sets, sets_per_order, stream=1):
+            quantities = rng.integers(1, 4, size=len(orders)).tolist()
+            ids = range(next_id, next_id + len(orders))
+            next_id += len(orders)
+            yield list(zip(ids, (orders + first_order).tolist(), (sets + first_set).tolist(), quantities, strict=True))
+
+    loads = [
+        ("pieces", Piece.__table__, ["piece_id", "piece_name", "color", "dimension", "pattern"], piece_rows()),
+        ("sets", Set.__table__, ["set_id", "set_name", "theme", "year_released", "piece_count"], set_rows()),
+        ("set_pieces", SetPiece.__table__, ["set_piece_id", "set_id", "piece_id", "quantity"], set_piece_rows()),
+        ("orders", Order.__table__, ["order_id", "order_date", "total_sets", "updated_at"], order_rows()),
+        ("order_sets", OrderSet.__table__, ["order_set_id", "order_id", "set_id", "quantity"], order_set_rows()),
+    ]
+
+    stats: Dict[str, Dict[str, float]] = {}
+    for name, table, columns, chunks in loads:
+        n_rows, seconds = _load_table(engine, table, columns, chunks)
+        stats[name] = {"rows": n_rows, "seconds": seconds, "rows_per_s": n_rows / seconds if seconds > 0 else 0.0}
+        print(f"[INFO] Loaded {n_rows} rows into {name} in {seconds:.2f} s ({stats[name]['rows_per_s']:.0f} rows/s)")
+
+    totals = rebuild_piece_totals(engine)
+    rows_per_s = totals["rows"] / totals["seconds"] if totals["seconds"] > 0 else 0.0
+    stats["order_piece_totals"] = {**totals, "rows_per_s": rows_per_s}
+    print(f"[INFO] Rebuilt {totals['rows']} order piece totals in {totals['seconds']:.2f} s")
+
+    return stats
+
+
+def fetch_order_info(engine: Engine) -> List[Row]:
     """Retrieve total count of each piece across all orders.
 
     :param engine: SQLAlchemy engine object
+    :return: Rows with the piece ID, piece name and total quantity (empty if the query failed)
     """
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    session = get_session(engine)
+    total_counts: List[Row] = []
 
     try:
+        # The per-order totals are materialized, so only one table has to be summed up per piece
         total_counts = (
-            session.query(Piece.id, Piece.name, func.sum(SetPiece.quantity * OrderSet.quantity).label("total_quantity"))
-            .join(SetPiece, Piece.id == SetPiece.piece_id)
-            .join(Set, SetPiece.set_id == Set.id)
-            .join(OrderSet, Set.id == OrderSet.set_id)
+            session.query(Piece.id, Piece.name, func.sum(OrderPieceTotal.total_quantity).label("total_quantity"))
+            .join(OrderPieceTotal, Piece.id == OrderPieceTotal.piece_id)
             .group_by(Piece.id, Piece.name)
             .all()
         )
@@ -116,3 +318,5 @@ def fetch_order_info(engine: Engine) -> None:
 
     finally:
         session.close()
+
+    return total_counts
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains a batched, tensor-native
+# augmentation stage. It replaces the per-sample PIL transforms by
+# applying random affine transformations, flips and the normalization
+# to whole uint8 batches after collation, in the main process or on
+# the training device.
+######################################################################
+
+import math
+from typing import Callable, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+from torchvision import transforms
+
+IMAGENET_MEAN = (0.485, 0.456, 0.406)
+IMAGENET_STD = (0.229, 0.224, 0.225)
+
+
+def to_float_nchw(images: torch.Tensor) -> torch.Tensor:
+    """Convert a collated image batch to a float tensor in (N, C, H, W) layout with values in [0, 255].
+
+    :param images: Batch of images in (N, H, W, C) layout as produced by collating NumPy images, or in
+        (N, C, H, W) layout
+    :return: Float tensor in (N, C, H, W) layout
+    """
+    if images.ndim != 4:
+        raise ValueError(f"Expected a batch of images with 4 dimensions, got shape {tuple(images.shape)}")
+
+    # Collated NumPy images are channels-last; a (N, C, H, W) batch has at most 4 channels in dim 1
+    if images.shape[-1] in (1, 3, 4) and images.shape[1] not in (1, 3, 4):
+        images = images.permute(0, 3, 1, 2)
+
+    return images.float()
+
+
+class BatchAugmentation(nn.Module):
+    """Random affine transformation, horizontal flip and normalization applied to a whole batch.
+
+    The parameters follow ``transforms.RandomAffine`` and ``transforms.RandomHorizontalFlip``. All per-sample
+    transformations, including the flip, are folded into one affine matrix per image and applied with a
+    single ``affine_grid``/``grid_sample`` call. The conversion to [0, 1] and the normalization are fused into
+    one multiply-add. Augmentations are only applied in training mode; in evaluation mode the module only
+    normalizes.
+    """
+
+    def __init__(  # noqa
+        self,
+        degrees: float = 20.0,
+        translate: Tuple[float, float] = (0.2, 0.2),
+        scale: Tuple[float, float] = (0.8, 1.2),
+        shear: float = 0.2,
+        flip_p: float = 0.5,
+        mean: Sequence[float] = IMAGENET_MEAN,
+        std: Sequence[float] = IMAGENET_STD,
+    ):
+        super().__init__()
+        self.degrees = degrees
+        self.translate = translate
+        self.scale = scale
+        self.shear = shear
+        self.flip_p = flip_p
+
+        # (x / 255 - mean) / std == x * factor + offset
+        mean_t = torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1)
+        std_t = torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1)
+        self.register_buffer("factor", 1.0 / (255.0 * std_t), persistent=False)
+        self.register_buffer("offset", -mean_t / std_t, persistent=False)
+
+    def normalize(self, images: torch.Tensor) -> torch.Tensor:
+        """Convert a uint8 batch to a normalized float batch without augmenting it.
+
+        :param images: Batch of images in (N, H, W, C) or (N, C, H, W) layout
+        :return: Normalized float tensor in (N, C, H, W) layout
+        """
+        return torch.addcmul(self.offset, to_float_nchw(images), self.factor)
+
+    def _random_theta(self, n: int, height: int, width: int, device: torch.device) -> torch.Tensor:
+        """Draw one random affine matrix per image, expressed in the normalized coordinates of affine_grid."""
+
+        def uniform(low: float, high: float) -> torch.Tensor:
+            return torch.empty(n, device=device).uniform_(low, high)
+
+        angle = uniform(-self.degrees, self.degrees) * (math.pi / 180)
+        shear = uniform(-self.shear, self.shear) * (math.pi / 180)
+        scale = uniform(*self.scale)
+        tx = uniform(-self.translate[0], self.translate[0]) * width
+        ty = uniform(-self.translate[1], self.translate[1]) * height
+        flip = torch.where(torch.rand(n, device=device) < self.flip_p, -1.0, 1.0)
+
+        # Forward transformation in pixel coordinates around the image center: T * R * Sh * S * Flip
+        cos, sin, tan = torch.cos(angle), torch.sin(angle), torch.tan(shear)
+        forward = torch.zeros(n, 3, 3, device=device)
+        forward[:, 0, 0] = scale * cos * flip
+        forward[:, 0, 1] = scale * (cos * tan - sin)
+        forward[:, 1, 0] = scale * sin * flip
+        forward[:, 1, 1] = scale * (sin * tan + cos)
+        forward[:, 0, 2] = tx
+        forward[:, 1, 2] = ty
+        forward[:, 2, 2] = 1.0
+
+        # affine_grid maps output to input locations in [-1, 1] coordinates, i.e. it needs the inverse
+        to_pixels = torch.diag(torch.tensor([width / 2, height / 2, 1.0], device=device))
+        to_normalized = torch.diag(torch.tensor([2 / width, 2 / height, 1.0], device=device))
+        inverse = torch.linalg.inv(forward)
+
+        return (to_normalized @ inverse @ to_pixels)[:, :2, :]
+
+    def forward(self, images: torch.Tensor) -> torch.Tensor:
+        """Augment and normalize a uint8 batch.
+
+        :param images: Batch of images in (N, H, W, C) or (N, C, H, W) layout
+        :return: Augmented, normalized float tensor in (N, C, H, W) layout
+        """
+        if not self.training:
+            return self.normalize(images)
+
+        x = to_float_nchw(images)
+        n, _, height, width = x.shape
+
+        theta = self._random_theta(n, height, width, x.device)
+        grid = F.affine_grid(theta, list(x.shape), align_corners=False)
+        x = F.grid_sample(x, grid, mode="bilinear", padding_mode="zeros", align_corners=False)
+
+        return torch.addcmul(self.offset, x, self.factor)
+
+
+def build_augmentation(mode: str) -> Tuple[Optional[Callable], Optional[BatchAugmentation]]:
+    """Build the per-sample transform and the batched augmentation stage of an augmentation mode.
+
+    :param mode: 'batch' for the batched augmentation after collation, 'per_sample' for the PIL transforms
+    :return: Tuple (transform, augment); the part that is not used by the mode is None
+    """
+    if mode == "per_sample":
+        # Reference path: PIL-based transforms executed per sample inside the dataloader workers
+        transform = transforms.Compose(
+            [
+                transforms.ToPILImage(),
+                transforms.RandomAffine(degrees=20, translate=(0.2, 0.2), scale=(0.8, 1.2), shear=0.2),
+                transforms.RandomHorizontalFlip(p=0.5),
+                transforms.ToTensor(),
+                transforms.Normalize(mean=IMAGENET_MEAN, std=IMAGENET_STD),
+            ]
+        )
+        return transform, None
+
+    if mode == "batch":
+        # The workers only collate raw uint8 images; augmentation runs batched after collation
+        return None, BatchAugmentation(degrees=20, translate=(0.2, 0.2), scale=(0.8, 1.2), shear=0.2, flip_p=0.5)
+
+    raise ValueError(f"Unknown AUGMENTATION mode '{mode}', expected 'batch' or 'per_sample'")
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the asyncio orchestrator of
+# an order changeover. The bill-of-materials query and the reference
+# data generation and embedding of every product run concurrently in
+# an executor, each product is streamed into the matcher as soon as it
+# is ready, and the next order can be prefetched while the current one
+# is still running on the line.
+######################################################################
+
+import asyncio
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set
+
+import numpy as np
+
+from models.inference import EmbeddingIndex
+from models.support_set import SupportSetStore
+
+
+class Changeover:
+    """Preparation state of one order, with events that signal its readiness.
+
+    When the preparation fails, error is set first and then all events are set, so no waiter hangs; wait and
+    wait_product re-raise the error.
+    """
+
+    def __init__(self, order_id: int, concurrency: int):
+        """Initialize the state.
+
+        :param order_id: Order ID of the prepared order
+        :param concurrency: Number of products prepared at the same time
+        """
+        self.order_id = order_id
+        self.bom: Optional[np.ndarray] = None
+        self.product_ids: List[int] = []
+        self.embeddings: Dict[int, np.ndarray] = {}
+        self.index: Optional[EmbeddingIndex] = None
+        self.indexed: Set[int] = set()
+        self.error: Optional[BaseException] = None
+
+        self.bom_ready = asyncio.Event()
+        self.ready = asyncio.Event()
+        self.product_ready: Dict[int, asyncio.Event] = {}
+
+        self.started_at = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+        self.task: Optional["asyncio.Task[Changeover]"] = None
+        self.slots = asyncio.Semaphore(concurrency)
+        self._concurrency = concurrency
+
+    def raise_concurrency(self, concurrency: int) -> None:
+        """Allow more products to be prepared at the same time, e.g. when a prefetched order becomes current."""
+        for _ in range(concurrency - self._concurrency):
+            self.slots.release()
+        self._concurrency = max(self._concurrency, concurrency)
+
+    async def wait(self) -> "Changeover":
+        """Wait until all products are ready and re-raise a failure of the preparation."""
+        if self.task is not None:
+            await asyncio.shield(self.task)
+        await self.ready.wait()
+        return self
+
+    def fail(self, error: BaseException) -> None:
+        """Record a failure of the preparation and release everyone waiting for the order or its products."""
+        self.error = error
+        self.bom_ready.set()
+        for event in self.product_ready.values():
+            event.set()
+        self.ready.set()
+
+    async def wait_product(self, product_id: int) -> np.ndarray:
+        """Wait until one product of the order is ready and return its embeddings.
+
+        :raises BaseException: The error of the preparation if the product can no longer become ready
+        """
+        await self.bom_ready.wait()
+        if product_id not in self.product_ready:
+            if self.error is not None:
+                raise self.error
+            raise KeyError(f"Product {product_id} is not part of order {self.order_id}")
+        await self.product_ready[product_id].wait()
+        if product_id not in self.embeddings and self.error is not None:
+            raise self.error
+        return self.embeddings[product_id]
+
+    def progress(self) -> Dict[str, Any]:
+        """Return the number of ready products and the elapsed time of the preparation."""
+        total = len(self.product_ids)
+        return {
+            "order_id": self.order_id,
+            "bom_ready": self.bom_ready.is_set(),
+            "products": total,
+            "ready": len(self.embeddings),
+            "fraction": len(self.embeddings) / total if total else float(self.ready.is_set() and self.error is None),
+            "failed": self.error is not None,
+            "elapsed_s": self.timings.get("total_s", time.perf_counter() - self.started_at),
+        }
+
+
+class ChangeoverOrchestrator:
+    """Prepares the support set of orders concurrently and streams ready products into the matcher.
+
+    The blocking parts, i.e. the bill-of-materials query, the reference image generation and the embedding,
+    are offloaded to an executor. Whenever products become ready, they are merged into the index of the order,
+    which is passed to on_index, e.g. to swap the index of a running VideoStreamRunner. Products that become
+    ready within publish_interval are published together, so a large order does not swap the index per product.
+    Prefetched orders are prepared one product at a time, so they never compete with the current order for
+    more than one executor slot until they are promoted.
+    """
+
+    def __init__(  # noqa
+        self,
+        fetch_bom: Callable[[int], np.ndarray],
+        store: SupportSetStore,
+        max_concurrency: int = 4,
+        executor: Optional[Executor] = None,
+        on_index: Optional[Callable[[Changeover, EmbeddingIndex], None]] = None,
+        on_progress: Optional[Callable[[Changeover], None]] = None,
+        index_options: Optional[Dict[str, Any]] = None,
+        publish_interval: float = 0.1,
+    ):
+        """Initialize the orchestrator.
+
+        :param fetch_bom: Callable returning the bill of materials of an order, e.g. OrderBomCache(engine).get
+        :param store: Support-set store that generates and embeds missing products and reuses known ones
+        :param max_concurrency: Number of products of the current order prepared at the same time (default: 4)
+        :param executor: Executor of the blocking work (default: None, i.e. a thread pool of max_concurrency + 1)
+        :param on_index: Callback invoked with the updated index of the current order whenever a product is ready
+        :param on_progress: Callback invoked when the bill of materials or a product of any order is ready
+        :param index_options: Keyword arguments of EmbeddingIndex.from_embeddings, e.g. prototypes or quantize
+        :param publish_interval: Time in seconds that newly ready products are collected before the index of the
+            current order is updated and published; the final index is published immediately (default: 0.1)
+        """
+        self.fetch_bom = fetch_bom
+        self.store = store
+        self.max_concurrency = max_concurrency
+        self.executor = executor or ThreadPoolExecutor(max_concurrency + 1, thread_name_prefix="changeover")
+        self._owns_executor = executor is None
+        self.on_index = on_index
+        self.on_progress = on_progress
+        self.index_options = index_options or {}
+        self.publish_interval = publish_interval
+
+        self.current: Optional[Changeover] = None
+        self._prefetched: Dict[int, Changeover] = {}
+        self._publish_pending: Set[Changeover] = set()
+
+    async def _offload(self, fn: Callable[..., Any], *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def _notify(self, changeover: Changeover) -> None:
+        if self.on_progress is not None:
+            self.on_progress(changeover)
+
+    def _update_index(self, changeover: Changeover) -> bool:
+        # Only the products that became ready since the last update are processed and merged into the index
+        ready = {
+            product_id: embeddings
+            for product_id, embeddings in changeover.embeddings.items()
+            if product_id not in changeover.indexed
+        }
+        if not ready:
+            return False
+
+        index = EmbeddingIndex.from_embeddings(ready, **self.index_options)
+        changeover.index = index if changeover.index is None else changeover.index.merge(index)
+        changeover.indexed.update(ready)
+        return True
+
+    def _publish(self, changeover: Changeover) -> None:
+        self._publish_pending.discard(changeover)
+        if self._update_index(changeover) and changeover is self.current and self.on_index is not None:
+            self.on_index(changeover, changeover.index)
+
+    def _schedule_publish(self, changeover: Changeover) -> None:
+        if changeover in self._publish_pending:
+            return
+        self._publish_pending.add(changeover)
+        asyncio.get_running_loop().call_later(self.publish_interval, self._publish, changeover)
+
+    async def _prepare_product(self, changeover: Changeover, product_id: int) -> None:
+        async with changeover.slots:
+            embeddings = await self._offload(self.store.embeddings_for, [product_id])
+
+        changeover.embeddings[product_id] = embeddings[product_id]
+        changeover.product_ready[product_id].set()
+
+        # Stream the product into the matcher of the current order, together with the others ready by then
+        if changeover is self.current and self.on_index is not None:
+            self._schedule_publish(changeover)
+        self._notify(changeover)
+
+    async def _prepare(self, changeover: Changeover) -> Changeover:
+        try:
+            start = time.perf_counter()
+            changeover.bom = await self._offload(self.fetch_bom, changeover.order_id)
+            changeover.product_ids = [int(product_id) for product_id in changeover.bom["piece_id"]]
+            changeover.product_ready = {product_id: asyncio.Event() for product_id in changeover.product_ids}
+            changeover.timings["bom_s"] = time.perf_counter() - start
+            changeover.bom_ready.set()
+            self._notify(changeover)
+
+            await asyncio.gather(
+                *(self._prepare_product(changeover, product_id) for product_id in changeover.product_ids)
+            )
+
+            self._publish(changeover)
+            changeover.timings["total_s"] = time.perf_counter() - changeover.started_at
+            changeover.ready.set()
+            return changeover
+        except BaseException as error:
+            changeover.fail(error)
+            self._notify(changeover)
+            raise
+
+    def _start(self, order_id: int, concurrency: int) -> Changeover:
+        changeover = Changeover(order_id, concurrency)
+        changeover.task = asyncio.get_running_loop().create_task(self._prepare(changeover))
+        return changeover
+
+    def prefetch(self, order_id: int) -> Changeover:
+        """Start preparing the next order in the background, one product at a time.
+
+        :param order_id: Order ID of the next order in the queue
+        :return: Preparation state of the order
+        """
+        if self.current is not None and self.current.order_id == order_id:
+            return self.current
+        if order_id not in self._prefetched:
+            self._prefetched[order_id] = self._start(order_id, concurrency=1)
+        return self._prefetched[order_id]
+
+    def changeover(self, order_id: int) -> Changeover:
+        """Make an order the current one and prepare it with full concurrency.
+
+        A prefetched order keeps everything it has prepared so far. Products that are already ready are
+        published to on_index immediately; the others follow as soon as they are ready.
+
+        :param order_id: Order ID of the scanned order
+        :return: Preparation state of the order; await its wait() or ready event before relying on the index
+        """
+        changeover = self._prefetched.pop(order_id, None)
+        if changeover is None:
+            changeover = self._start(order_id, concurrency=self.max_concurrency)
+        else:
+            changeover.raise_concurrency(self.max_concurrency)
+
+        self.current = changeover
+        self._update_index(changeover)
+        if changeover.index is not None and self.on_index is not None:
+            self.on_index(changeover, changeover.index)
+        return changeover
+
+    def cancel_prefetch(self, order_id: Optional[int] = None) -> None:
+        """Cancel the preparation of one or all prefetched orders.
+
+        :param order_id: Order ID of the prefetched order (default: None, i.e. all prefetched orders)
+        """
+        order_ids = list(self._prefetched) if order_id is None else [order_id]
+        for key in order_ids:
+            changeover = self._prefetched.pop(key, None)
+            if changeover is not None and changeover.task is not None:
+                changeover.task.cancel()
+
+    def close(self) -> None:
+        """Cancel all prefetches and shut the executor down if the orchestrator created it."""
+        self.cancel_prefetch()
+        if self._owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    import tempfile
+    from pathlib import Path
+
+    import torch
+
+    from database.config import get_engine
+    from database.queries import OrderBomCache
+    from mockup.fake_db_data_generation import create_tables, populate_tables
+    from models.inference import load_classifier
+
+    # Example usage against an in-memory SQLite database with an untrained checkpoint
+    engine = get_engine("sqlite://")
+    create_tables(engine)
+    populate_tables(engine, num_records=4)
+
+    params = {"height": 64, "width": 64, "channels": 3, "n_images": 16, "dtype": np.uint8, "seed": 42}
+
+    async def demo(directory: Path) -> None:
+        checkpoint_path = directory / "model.pth"
+        torch.save({"model_state_dict": load_classifier(num_classes=5).state_dict()}, checkpoint_path)
+        store = SupportSetStore(directory / "support_set", checkpoint_path, params)
+
+        def report(changeover: Changeover) -> None:
+            progress = changeover.progress()
+            print(f"[INFO] Order {progress['order_id']}: {progress['ready']}/{progress['products']} products ready")
+
+        orchestrator = ChangeoverOrchestrator(OrderBomCache(engine).get, store, on_progress=report)
+        try:
+            current = orchestrator.changeover(1)
+            orchestrator.prefetch(2)
+            await current.wait()
+            print(f"[INFO] Order 1 ready after {current.timings['total_s']:.2f} s")
+
+            # By the time order 2 is scanned, its preparation has overlapped with order 1
+            await orchestrator.changeover(2).wait()
+        finally:
+            orchestrator.close()
+
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(demo(Path(directory)))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the asynchronous checkpoint
+# writer of the training loop. State dicts are snapshotted to CPU on the
+# training thread and serialized on a background thread, using a
+# temporary file and an atomic rename. Only the last N periodic
+# checkpoints are kept, and the latest one can be used to resume.
+######################################################################
+
+import os
+import queue
+import re
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+
+# File name pattern of the periodic checkpoints
+_EPOCH_PATTERN = re.compile(r"^epoch_(\d+)\.pth$")
+
+
+def snapshot_state(state: Any) -> Any:
+    """Copy all tensors of a (nested) state dict to CPU, so training can continue to modify the originals.
+
+    :param state: State dict or nested container of tensors and plain values
+    :return: Deep copy with all tensors detached, on CPU and owning their memory
+    """
+    if isinstance(state, torch.Tensor):
+        return state.detach().to("cpu", copy=True)
+    if isinstance(state, dict):
+        return {key: snapshot_state(value) for key, value in state.items()}
+    if isinstance(state, (list, tuple)):
+        return type(state)(snapshot_state(value) for value in state)
+    return state
+
+
+def checkpoint_epoch(path: Union[str, Path]) -> Optional[int]:
+    """Return the epoch of a periodic checkpoint file name, or None for other files."""
+    match = _EPOCH_PATTERN.match(Path(path).name)
+    return int(match.group(1)) if match else None
+
+
+def list_checkpoints(directory: Union[str, Path]) -> List[Path]:
+    """Return the periodic checkpoints of a directory, sorted by epoch."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    paths = [path for path in directory.iterdir() if checkpoint_epoch(path) is not None]
+    return sorted(paths, key=checkpoint_epoch)
+
+
+def latest_checkpoint(directory: Union[str, Path]) -> Optional[Path]:
+    """Return the periodic checkpoint with the highest epoch, or None if there is none."""
+    checkpoints = list_checkpoints(directory)
+    return checkpoints[-1] if checkpoints else None
+
+
+def atomic_save(state: Dict[str, Any], path: Union[str, Path]) -> None:
+    """Serialize a state to a temporary file in the target directory and atomically rename it.
+
+    :param state: State to save with torch.save
+    :param path: Final path of the checkpoint
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as file:
+            torch.save(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class AsyncCheckpointWriter:
+    """Writes checkpoints on a background thread and keeps only the last N periodic checkpoints."""
+
+    def __init__(self, directory: Union[str, Path], keep_last: int = 3, max_pending: int = 2):
+        """Initialize the writer and start its background thread.
+
+        :param directory: Directory of the periodic checkpoints (epoch_<n>.pth)
+        :param keep_last: Number of periodic checkpoints to keep; 0 keeps all of them (default: 3)
+        :param max_pending: Number of snapshots that may wait for serialization before submit blocks (default: 2)
+        """
+        self.directory = Path(directory)
+        self.keep_last = keep_last
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=max_pending)
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name="checkpoint-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                state, path = item
+                atomic_save(state, path)
+                if checkpoint_epoch(path) is not None and Path(path).parent == self.directory:
+                    self.prune()
+            except BaseException as error:
+                self._error = error
+            finally:
+                self._queue.task_done()
+
+    def _raise_pending_error(self) -> None:
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise RuntimeError("Writing a checkpoint failed") from error
+
+    def submit(self, state: Dict[str, Any], path: Union[str, Path, None] = None, epoch: Optional[int] = None) -> Path:
+        """Snapshot a state on the calling thread and queue it for writing.
+
+        :param state: State dict to save, e.g. with model and optimizer state
+        :param path: Target path; defaults to the periodic checkpoint of the given epoch
+        :param epoch: Epoch of a periodic checkpoint (used if path is omitted)
+        :return: Path the checkpoint will be written to
+        """
+        self._raise_pending_error()
+        if path is None:
+            if epoch is None:
+                raise ValueError("Either a path or an epoch is required")
+            path = self.directory / f"epoch_{epoch}.pth"
+
+        self._queue.put((snapshot_state(state), Path(path)))
+        return Path(path)
+
+    def prune(self) -> List[Path]:
+        """Delete all but the last keep_last periodic checkpoints.
+
+        :return: List of deleted checkpoints
+        """
+        if self.keep_last <= 0:
+            return []
+
+        stale = list_checkpoints(self.directory)[: -self.keep_last]
+        for path in stale:
+            path.unlink(missing_ok=True)
+        return stale
+
+    def flush(self) -> None:
+        """Block until all queued checkpoints are written."""
+        self._queue.join()
+        self._raise_pending_error()
+
+    def close(self) -> None:
+        """Write all queued checkpoints and stop the background thread."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_pending_error()
@@ -7,8 +7,69 @@
 # trains the image recognition model.
 ######################################################################
 
+import math
+from typing import Any, Dict, List, Optional
 
-from torch.utils.data import Dataset
+import numpy as np
+import torch
+from torch.utils.data import Dataset, IterableDataset, Subset, get_worker_info, random_split
+
+from data.synthetic_data import generate_synthetic_sample
+
+# Constants of the SplitMix64 finalizer used to assign samples to the train or validation split
+_GOLDEN_GAMMA = 0x9E3779B97F4A7C15
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_MASK_64 = (1 << 64) - 1
+
+
+def split_hash(indices: np.ndarray, seed: int) -> np.ndarray:
+    """Map sample indices to reproducible, uniformly distributed numbers in [0, 1).
+
+    :param indices: Global sample indices
+    :param seed: Seed that selects the mapping
+    :return: Array of floats in [0, 1) with the same shape as indices
+    """
+    z = indices.astype(np.uint64) + np.uint64((seed * _GOLDEN_GAMMA) & _MASK_64)
+    z = (z ^ (z >> np.uint64(30))) * _MIX_1
+    z = (z ^ (z >> np.uint64(27))) * _MIX_2
+    z ^= z >> np.uint64(31)
+    return (z >> np.uint64(11)).astype(np.float64) / float(1 << 53)
+
+
+def train_val_split(dataset: Dataset, val_fraction: float, seed: int) -> List[Subset]:
+    """Randomly split a map-style dataset into a train and a validation subset, reproducibly for a seed.
+
+    :param dataset: Dataset to split
+    :param val_fraction: Fraction of the samples in the validation subset
+    :param seed: Seed of the permutation, so other scripts can rebuild the same validation split
+    :return: List [train_subset, val_subset]
+    """
+    train_size = int((1 - val_fraction) * len(dataset))
+    generator = torch.Generator().manual_seed(seed)
+    return random_split(dataset, [train_size, len(dataset) - train_size], generator=generator)
+
+
+class BlockArray:
+    """Read-only view that indexes a sequence of per-product arrays (e.g. memory maps) as one array."""
+
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+        self.offsets = np.cumsum([0] + [len(block) for block in self.blocks])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Index {index} is out of range for {len(self)} images")
+
+        block = int(np.searchsorted(self.offsets, index, side="right")) - 1
+
+        # Copy only the requested image out of the (possibly memory-mapped) block
+        return np.array(self.blocks[block][index - self.offsets[block]])
 
 
 class CustomDataset(Dataset):
@@ -19,6 +80,19 @@ class CustomDataset(Dataset):
         self.targets = targets
         self.transform = transform
 
+    @classmethod
+    def from_products(cls, synthetic_data: Dict[int, np.ndarray], transform=None) -> "CustomDataset":
+        """Create a dataset that indexes directly into the per-product arrays without concatenating them.
+
+        :param synthetic_data: Dictionary mapping product IDs to their synthetic data
+        :param transform: Transformation applied to each image (default: None)
+        :return: Dataset labelling each image with its product ID
+        """
+        data = BlockArray(synthetic_data.values())
+        counts = [len(block) for block in synthetic_data.values()]
+        targets = np.repeat(np.fromiter(synthetic_data.keys(), dtype=np.int64), counts)
+        return cls(data, targets, transform=transform)
+
     def __len__(self):
         return len(self.data)
 
@@ -30,3 +104,106 @@ class CustomDataset(Dataset):
             image = self.transform(image)
 
         return image, target
+
+
+class SyntheticStreamDataset(IterableDataset):
+    """Streaming dataset that synthesizes the images lazily inside the DataLoader workers.
+
+    Sample ``g`` is image ``g % n_images`` of product ``product_ids[g // n_images]`` and is generated from its
+    own seeded stream, so no image is ever materialized before it is requested. The train/validation split
+    is decided per sample by a hash of its index, and shuffling uses an affine permutation of the sample
+    indices, hence neither needs an index list in memory.
+    """
+
+    def __init__(  # noqa
+        self,
+        product_ids: List[int],
+        params: Dict[str, Any],
+        split: Optional[str] = None,
+        val_fraction: float = 0.2,
+        shuffle: bool = False,
+        transform=None,
+        chunk_size: int = 1024,
+    ):
+        if split not in {None, "train", "val"}:
+            raise ValueError(f"Unknown split '{split}', expected 'train', 'val' or None")
+
+        self.product_ids = list(dict.fromkeys(product_ids))
+        self.dim = (params["height"], params["width"], params["channels"])
+        self.n_images = params["n_images"]
+        self.dtype = params["dtype"]
+        self.seed = params.get("seed", 42)
+        self.split = split
+        self.val_fraction = val_fraction
+        self.shuffle = shuffle
+        self.transform = transform
+        self.chunk_size = chunk_size
+        self.epoch = 0
+        self._length: Optional[int] = None
+
+    @property
+    def targets(self) -> np.ndarray:
+        """Return the distinct labels of the dataset."""
+        return np.asarray(self.product_ids)
+
+    @property
+    def total(self) -> int:
+        """Return the number of samples of all splits combined."""
+        return len(self.product_ids) * self.n_images
+
+    def set_epoch(self, epoch: int) -> None:
+        """Set the epoch, which selects the shuffling permutation.
+
+        :param epoch: Current training epoch
+        """
+        self.epoch = epoch
+
+    def _in_split(self, indices: np.ndarray) -> np.ndarray:
+        """Return the mask of the indices that belong to this dataset's split."""
+        if self.split is None:
+            return np.ones(len(indices), dtype=bool)
+
+        is_val = split_hash(indices, self.seed) < self.val_fraction
+        return is_val if self.split == "val" else ~is_val
+
+    def _permutation(self):
+        """Return the coefficients (a, b) of the epoch's permutation g = (a * position + b) % total."""
+        if not self.shuffle or self.total <= 1:
+            return 1, 0
+
+        rng = np.random.default_rng([self.seed, self.epoch])
+        a = int(rng.integers(1, self.total))
+        while math.gcd(a, self.total) != 1:
+            a = a % (self.total - 1) + 1
+        return a, int(rng.integers(0, self.total))
+
+    def __len__(self):
+        if self._length is None:
+            step = max(self.chunk_size, 1 << 20)
+            self._length = sum(
+                int(self._in_split(np.arange(lo, min(lo + step, self.total))).sum())
+                for lo in range(0, self.total, step)
+            )
+        return self._length
+
+    def __iter__(self):
+        worker_info = get_worker_info()
+        worker_id = worker_info.id if worker_info else 0
+        n_workers = worker_info.num_workers if worker_info else 1
+        a, b = self._permutation()
+
+        for lo in range(0, self.total, self.chunk_size):
+            # Positions of this chunk that are assigned to this worker
+            hi = min(lo + self.chunk_size, self.total)
+            positions = np.arange(lo + (worker_id - lo) % n_workers, hi, n_workers, dtype=np.int64)
+            indices = (a * positions + b) % self.total
+            indices = indices[self._in_split(indices)]
+
+            for index in indices.tolist():
+                product_id = self.product_ids[index // self.n_images]
+                image = generate_synthetic_sample(product_id, index % self.n_images, self.dim, self.dtype, self.seed)
+
+                if self.transform:
+                    image = self.transform(image)
+
+                yield image, product_id
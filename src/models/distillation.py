@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the building blocks of the
+# distillation training mode: the compact student architectures, the
+# frozen ResNet-18 teacher and the soft-target loss that trains the
+# student on the temperature-softened predictions of the teacher.
+######################################################################
+
+from pathlib import Path
+from typing import Callable, Dict, Union
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+from torchvision.models import ResNet, mobilenet_v3_large, mobilenet_v3_small, resnet18
+from torchvision.models.resnet import BasicBlock
+
+
+def resnet10(num_classes: int = 1000) -> ResNet:
+    """Build a ResNet with one basic block per stage, i.e. half the depth of ResNet-18.
+
+    torchvision's basic blocks only support the standard width, so the ResNet is reduced in depth instead.
+    """
+    return ResNet(BasicBlock, [1, 1, 1, 1], num_classes=num_classes)
+
+
+# Model builders by architecture name; every builder takes the number of classes
+ARCHITECTURES: Dict[str, Callable[..., nn.Module]] = {
+    "resnet18": resnet18,
+    "resnet10": resnet10,
+    "mobilenet_v3_small": mobilenet_v3_small,
+    "mobilenet_v3_large": mobilenet_v3_large,
+}
+
+
+def build_model(arch: str, num_classes: int) -> nn.Module:
+    """Build a randomly initialized classifier.
+
+    :param arch: One of ARCHITECTURES
+    :param num_classes: Number of output classes
+    :return: Model in training mode
+    """
+    if arch not in ARCHITECTURES:
+        raise ValueError(f"Unknown architecture '{arch}', expected one of {list(ARCHITECTURES)}")
+    if arch == "resnet10":
+        return resnet10(num_classes=num_classes)
+    return ARCHITECTURES[arch](weights=None, num_classes=num_classes)
+
+
+def infer_num_classes(state_dict: Dict[str, torch.Tensor]) -> int:
+    """Read the number of classes from the weight of the last linear layer of a state dict."""
+    weights = [tensor for name, tensor in state_dict.items() if name.endswith("weight") and tensor.ndim == 2]
+    if not weights:
+        raise ValueError("The state dict contains no linear layer")
+    return weights[-1].shape[0]
+
+
+def load_teacher(checkpoint_path: Union[str, Path], num_classes: int, device: torch.device) -> nn.Module:
+    """Load the trained classifier that teaches the student.
+
+    :param checkpoint_path: Path of a checkpoint written by image_recognition_train.py
+    :param num_classes: Number of classes of the student, which the teacher must match
+    :param device: Device the teacher runs on
+    :return: Frozen teacher in evaluation mode
+    """
+    checkpoint = torch.load(checkpoint_path, map_location="cpu")
+    state_dict = checkpoint.get("model_state_dict", checkpoint)
+    if infer_num_classes(state_dict) != num_classes:
+        raise ValueError(
+            f"The teacher predicts {infer_num_classes(state_dict)} classes, but the student {num_classes}; "
+            "both have to be trained on the same products"
+        )
+
+    teacher = build_model(checkpoint.get("arch", "resnet18"), num_classes)
+    teacher.load_state_dict(state_dict)
+    for parameter in teacher.parameters():
+        parameter.requires_grad_(False)
+    return teacher.to(device).eval()
+
+
+class DistillationLoss(nn.Module):
+    """Weighted sum of the soft-target loss against the teacher and the cross entropy against the labels.
+
+    The soft-target term is the KL divergence between the teacher and student distributions at the given
+    temperature, scaled by the squared temperature so its gradients keep their magnitude.
+    """
+
+    def __init__(self, temperature: float = 4.0, alpha: float = 0.7):
+        """Initialize the loss.
+
+        :param temperature: Softmax temperature of both distributions (default: 4.0)
+        :param alpha: Weight of the soft-target term; the cross entropy gets 1 - alpha (default: 0.7)
+        """
+        super().__init__()
+        self.temperature = temperature
+        self.alpha = alpha
+
+    def forward(self, student_logits: torch.Tensor, teacher_logits: torch.Tensor, labels: torch.Tensor):
+        """Compute the loss of a batch.
+
+        :param student_logits: Logits of the student of shape (N, C)
+        :param teacher_logits: Logits of the teacher of shape (N, C)
+        :param labels: Class labels of shape (N,)
+        :return: Scalar loss
+        """
+        # The loss is computed in float32, also when the logits come from a bfloat16 autocast region
+        student_logits, teacher_logits = student_logits.float(), teacher_logits.float()
+        soft_loss = F.kl_div(
+            F.log_softmax(student_logits / self.temperature, dim=1),
+            F.log_softmax(teacher_logits / self.temperature, dim=1),
+            reduction="batchmean",
+            log_target=True,
+        )
+        hard_loss = F.cross_entropy(student_logits, labels)
+        return self.alpha * self.temperature**2 * soft_loss + (1 - self.alpha) * hard_loss
@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script turns the trained fp32 ResNet-18
+# checkpoint into deployable CPU inference artifacts. Variants with
+# fused conv-bn layers, channels_last memory format and dynamic or
+# static int8 quantization (calibrated on the synthetic data) are
+# exported as TorchScript or torch.export programs, and a comparison
+# reports their latency, throughput and top-1 accuracy against the
+# fp32 model on the validation split. A distilled student is compared
+# against its ResNet-18 teacher in the same way.
+#
+# Usage (from the src folder):
+#   python -m models.export_model export --variant static_int8
+#   python -m models.export_model compare --output ../reports/export_comparison.json
+#   python -m models.export_model student --output ../reports/student_comparison.json
+######################################################################
+
+import argparse
+import statistics
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Union
+
+import torch
+from omegaconf import DictConfig, OmegaConf
+from torch import nn
+from torch.ao import quantization
+from torch.utils.data import DataLoader
+
+from data.synthetic_cache import SyntheticDataCache
+from data.synthetic_data import generate_synthetic_data_for_products
+from models.augmentation import BatchAugmentation
+from models.custom_dataset import CustomDataset, train_val_split
+from models.inference import load_classifier
+from models.profiling import write_json
+
+# Default location of the config file, relative to the src folder
+CONFIG_PATH = Path("..") / "config" / "config.yaml"
+
+# fp32: eager model as trained; fp32_fused: conv-bn fused; dynamic_int8: int8 linear layers with dynamically
+# quantized activations; static_int8: fused, int8 weights and activations calibrated on synthetic data
+VARIANTS = ("fp32", "fp32_fused", "dynamic_int8", "static_int8")
+
+# Artifact formats and their file suffixes
+FORMATS = {"torchscript": ".pt", "export": ".pt2"}
+
+
+def calibrate(model: nn.Module, batches: Iterable[torch.Tensor], n_batches: int) -> None:
+    """Run normalized uint8 batches through a model that has observers attached.
+
+    :param model: Model prepared with torch.ao.quantization.prepare
+    :param batches: Iterable of collated uint8 image batches, e.g. a DataLoader
+    :param n_batches: Maximum number of calibration batches
+    """
+    normalize = BatchAugmentation().eval()
+    with torch.inference_mode():
+        for i, batch in enumerate(batches):
+            if i == n_batches:
+                break
+            images = batch[0] if isinstance(batch, (list, tuple)) else batch
+            model(normalize(images))
+
+
+def build_variant(  # noqa
+    checkpoint_path: Optional[Union[str, Path]],
+    variant: str,
+    calibration_batches: Optional[Iterable[torch.Tensor]] = None,
+    n_calibration_batches: int = 8,
+    backend: str = "x86",
+    channels_last: bool = True,
+    num_classes: Optional[int] = None,
+) -> nn.Module:
+    """Build an eager CPU inference variant of the trained ResNet-18.
+
+    Dynamic quantization only applies to the final linear layer of ResNet-18, because PyTorch quantizes
+    convolutions dynamically not at all; static quantization covers the whole network.
+
+    :param checkpoint_path: Path of the fp32 checkpoint (default: None, i.e. randomly initialized weights)
+    :param variant: One of VARIANTS
+    :param calibration_batches: Uint8 image batches for static quantization, e.g. a DataLoader of the train split
+    :param n_calibration_batches: Number of calibration batches (default: 8)
+    :param backend: Quantized engine, e.g. 'x86', 'fbgemm' or 'qnnpack' (default: 'x86')
+    :param channels_last: Flag to convert the model to the channels_last memory format (default: True)
+    :param num_classes: Number of classes of the checkpoint; inferred from the checkpoint if omitted
+    :return: Model in evaluation mode on CPU
+    """
+    if variant not in VARIANTS:
+        raise ValueError(f"Unknown variant '{variant}', expected one of {VARIANTS}")
+
+    if variant in ("fp32", "dynamic_int8"):
+        model = load_classifier(checkpoint_path, num_classes=num_classes)
+        if variant == "dynamic_int8":
+            model = quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+    else:
+        # The quantizable ResNet-18 shares the weights of the trained model and knows how to fuse itself
+        model = load_classifier(checkpoint_path, num_classes=num_classes, quantizable=True)
+        model.fuse_model(is_qat=False)
+
+        if variant == "static_int8":
+            if calibration_batches is None:
+                raise ValueError("Static quantization requires calibration batches")
+            torch.backends.quantized.engine = backend
+            model.qconfig = quantization.get_default_qconfig(backend)
+            quantization.prepare(model, inplace=True)
+            calibrate(model, calibration_batches, n_calibration_batches)
+            quantization.convert(model, inplace=True)
+
+    if channels_last:
+        model = model.to(memory_format=torch.channels_last)
+    return model.eval()
+
+
+def example_inputs(batch_size: int, height: int, width: int, channels: int = 3, channels_last: bool = True):
+    """Create a normalized dummy batch for tracing and exporting."""
+    images = torch.randn(batch_size, channels, height, width)
+    return images.contiguous(memory_format=torch.channels_last if channels_last else torch.contiguous_format)
+
+
+def to_torchscript(model: nn.Module, inputs: torch.Tensor) -> torch.jit.ScriptModule:
+    """Trace a model and freeze it, which folds parameters and attributes into constants."""
+    with torch.inference_mode():
+        traced = torch.jit.trace(model, inputs)
+    return torch.jit.freeze(traced)
+
+
+def export_variant(
+    model: nn.Module, path: Union[str, Path], inputs: torch.Tensor, fmt: str = "torchscript", variant: str = "fp32"
+) -> Path:
+    """Serialize a model variant as TorchScript or as torch.export program.
+
+    :param model: Eager model returned by build_variant
+    :param path: Path of the artifact
+    :param inputs: Example input batch
+    :param fmt: 'torchscript' or 'export' (default: 'torchscript')
+    :param variant: Name of the variant, used to reject unsupported combinations (default: 'fp32')
+    :return: Path of the artifact
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if fmt == "torchscript":
+        to_torchscript(model, inputs).save(str(path))
+    elif fmt == "export":
+        if variant.endswith("int8"):
+            raise ValueError("torch.export does not support eager-mode quantized models, use 'torchscript'")
+        # The batch dimension stays dynamic, so the line can send any number of crops
+        batch = torch.export.Dim("batch", min=1)
+        program = torch.export.export(model, (inputs,), dynamic_shapes=({0: batch},))
+        torch.export.save(program, str(path))
+    else:
+        raise ValueError(f"Unknown format '{fmt}', expected one of {list(FORMATS)}")
+
+    print(f"[INFO] Exported {variant} model to {path}")
+    return path
+
+
+def load_exported(path: Union[str, Path]) -> nn.Module:
+    """Load an artifact written by export_variant."""
+    path = Path(path)
+    if path.suffix == FORMATS["export"]:
+        return torch.export.load(str(path)).module()
+    return torch.jit.load(str(path))
+
+
+def evaluate(
+    model: nn.Module,
+    loader: DataLoader,
+    channels_last: bool = True,
+    latency_runs: int = 50,
+    warmup: int = 3,
+) -> Dict[str, float]:
+    """Measure the top-1 accuracy, the throughput at the loader's batch size and the single-image latency.
+
+    :param model: Model to evaluate
+    :param loader: DataLoader of the validation split that yields uint8 images and product IDs
+    :param channels_last: Flag to feed channels_last inputs (default: True)
+    :param latency_runs: Number of timed single-image forward passes (default: 50)
+    :param warmup: Number of untimed forward passes before each measurement (default: 3)
+    :return: Dictionary with accuracy, throughput in images per second and median and p90 latency in milliseconds
+    """
+    normalize = BatchAugmentation().eval()
+    memory_format = torch.channels_last if channels_last else torch.contiguous_format
+    batches = [(normalize(images).contiguous(memory_format=memory_format), labels) for images, labels in loader]
+    if not batches:
+        raise ValueError("The validation loader is empty")
+
+    correct, total, seconds = 0, 0, 0.0
+    with torch.inference_mode():
+        for _ in range(warmup):
+            model(batches[0][0])
+
+        for images, labels in batches:
+            start = time.perf_counter()
+            outputs = model(images)
+            seconds += time.perf_counter() - start
+            correct += (outputs.argmax(dim=1) == labels).sum().item()
+            total += len(labels)
+
+        single = batches[0][0][:1]
+        for _ in range(warmup):
+            model(single)
+        latencies = []
+        for _ in range(latency_runs):
+            start = time.perf_counter()
+            model(single)
+            latencies.append(1000 * (time.perf_counter() - start))
+
+    return {
+        "accuracy": correct / total,
+        "throughput_img_s": total / seconds,
+        "latency_ms": statistics.median(latencies),
+        "latency_p90_ms": statistics.quantiles(latencies, n=10)[-1] if len(latencies) > 1 else latencies[0],
+    }
+
+
+def build_loaders(config: DictConfig, product_ids: Sequence[int]) -> Dict[str, DataLoader]:
+    """Rebuild the training script's train and validation split as uint8 loaders without augmentation."""
+    params = {
+        "height": config.HEIGHT,
+        "width": config.WIDTH,
+        "channels": config.CHANNELS,
+        "n_images": config.N_IMAGES,
+        "dtype": config.DTYPE,
+        "seed": config.SEED,
+    }
+    cache = None
+    if config.CACHE_DIR:
+        cache = SyntheticDataCache(config.CACHE_DIR, max_bytes=int(config.CACHE_MAX_GB * 1024**3))
+    synthetic_data = generate_synthetic_data_for_products(
+        list(product_ids), params, n_workers=config.N_GEN_WORKERS, cache=cache
+    )
+
+    dataset = CustomDataset.from_products(synthetic_data)
+    train_dataset, val_dataset = train_val_split(dataset, config.VAL_FRACTION, config.SEED)
+    return {
+        "train": DataLoader(train_dataset, shuffle=True, batch_size=config.BATCH_SIZE, num_workers=config.N_WORKERS),
+        "val": DataLoader(val_dataset, shuffle=False, batch_size=config.BATCH_SIZE, num_workers=config.N_WORKERS),
+    }
+
+
+def compare_variants(
+    config: DictConfig,
+    checkpoint_path: Optional[Union[str, Path]],
+    variants: Sequence[str] = VARIANTS,
+    product_ids: Sequence[int] = (1, 2, 3),
+) -> Dict[str, Any]:
+    """Evaluate the frozen TorchScript module of each variant against the fp32 eager model.
+
+    :param config: Config with the data and export settings
+    :param checkpoint_path: Path of the fp32 checkpoint
+    :param variants: Variants to compare (default: all)
+    :param product_ids: Product IDs the checkpoint was trained on (default: the dummy products 1, 2 and 3)
+    :return: Dictionary with one result per variant (including the fp32 reference), the accuracy tolerance and
+        the fastest variant whose accuracy stays within the tolerance of fp32
+    """
+    loaders = build_loaders(config, product_ids)
+    inputs = example_inputs(1, config.HEIGHT, config.WIDTH, config.CHANNELS, config.CHANNELS_LAST)
+
+    results: Dict[str, Dict[str, float]] = {}
+    reference = build_variant(checkpoint_path, "fp32", channels_last=False)
+    results["fp32_eager"] = evaluate(reference, loaders["val"], channels_last=False)
+
+    for variant in variants:
+        model = build_variant(
+            checkpoint_path,
+            variant,
+            calibration_batches=loaders["train"],
+            n_calibration_batches=config.CALIBRATION_BATCHES,
+            backend=config.QUANT_BACKEND,
+            channels_last=config.CHANNELS_LAST,
+        )
+        results[variant] = evaluate(to_torchscript(model, inputs), loaders["val"], channels_last=config.CHANNELS_LAST)
+
+    baseline = results["fp32_eager"]["accuracy"]
+    eligible = [name for name, result in results.items() if baseline - result["accuracy"] <= config.ACCURACY_TOLERANCE]
+    recommended = max(eligible, key=lambda name: results[name]["throughput_img_s"])
+
+    return {"results": results, "tolerance": config.ACCURACY_TOLERANCE, "recommended": recommended}
+
+
+def compare_student(
+    config: DictConfig,
+    teacher_path: Optional[Union[str, Path]],
+    student_path: Union[str, Path],
+    product_ids: Sequence[int] = (1, 2, 3),
+) -> Dict[str, Any]:
+    """Evaluate the frozen TorchScript modules of a distilled student and its teacher on CPU.
+
+    :param config: Config with the data and export settings
+    :param teacher_path: Path of the fp32 ResNet-18 checkpoint
+    :param student_path: Path of the student checkpoint written in distillation mode
+    :param product_ids: Product IDs both models were trained on (default: the dummy products 1, 2 and 3)
+    :return: Dictionary with the results of both models, the accuracy tolerance and the flag whether the student's
+        accuracy stays within the tolerance of the teacher
+    """
+    loaders = build_loaders(config, product_ids)
+    inputs = example_inputs(1, config.HEIGHT, config.WIDTH, config.CHANNELS, config.CHANNELS_LAST)
+    memory_format = torch.channels_last if config.CHANNELS_LAST else torch.contiguous_format
+
+    results: Dict[str, Dict[str, float]] = {}
+    for name, path in (("teacher", teacher_path), ("student", student_path)):
+        model = load_classifier(path).to(memory_format=memory_format)
+        results[name] = evaluate(to_torchscript(model, inputs), loaders["val"], channels_last=config.CHANNELS_LAST)
+
+    accuracy_delta = results["student"]["accuracy"] - results["teacher"]["accuracy"]
+    return {
+        "results": results,
+        "tolerance": config.ACCURACY_TOLERANCE,
+        "speedup": results["teacher"]["latency_ms"] / results["student"]["latency_ms"],
+        "meets_budget": -accuracy_delta <= config.ACCURACY_TOLERANCE,
+    }
+
+
+def print_comparison(comparison: Dict[str, Any]) -> None:
+    """Print the comparison as a table."""
+    results = comparison["results"]
+    reference = results["fp32_eager"] if "fp32_eager" in results else results["teacher"]
+    print(f"{'variant':<14}{'top-1':>8}{'delta':>9}{'img/s':>10}{'speedup':>9}{'p50 ms':>9}{'p90 ms':>9}")
+    for name, result in results.items():
+        print(
+            f"{name:<14}{result['accuracy']:>8.2%}{result['accuracy'] - reference['accuracy']:>+9.2%}"
+            f"{result['throughput_img_s']:>10.1f}{result['throughput_img_s'] / reference['throughput_img_s']:>8.2f}x"
+            f"{result['latency_ms']:>9.2f}{result['latency_p90_ms']:>9.2f}"
+        )
+    if "recommended" in comparison:
+        print(f"[INFO] Fastest variant within {comparison['tolerance']:.2%} top-1 of fp32: {comparison['recommended']}")
+    else:
+        verdict = "meets" if comparison["meets_budget"] else "misses"
+        print(
+            f"[INFO] Student is {comparison['speedup']:.2f}x faster per image and {verdict} the accuracy budget of "
+            f"{comparison['tolerance']:.2%} top-1"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Export and compare CPU inference variants of the trained model.")
+    parser.add_argument(
+        "command",
+        choices=["export", "compare", "student"],
+        help="Export variants, compare the variants or compare a distilled student with its teacher",
+    )
+    parser.add_argument("--config", default=str(CONFIG_PATH), help="Path of the config file")
+    parser.add_argument("--checkpoint", help="Path of the fp32 checkpoint (default: BEST_MODEL_PATH)")
+    parser.add_argument("--student", help="Path of the student checkpoint (default: STUDENT_MODEL_PATH)")
+    parser.add_argument("--variant", choices=VARIANTS, nargs="+", help="Variants to export or compare (default: all)")
+    parser.add_argument("--format", choices=list(FORMATS), help="Artifact format (default: EXPORT_FORMAT)")
+    parser.add_argument("--output", help="Export directory or JSON path of the comparison")
+    parser.add_argument("--set", nargs="+", default=[], metavar="KEY=VALUE", help="Override config values")
+    args = parser.parse_args(argv)
+
+    config = OmegaConf.merge(OmegaConf.load(args.config), OmegaConf.from_dotlist(args.set))
+    checkpoint_path = args.checkpoint or config.BEST_MODEL_PATH
+    variants = args.variant or list(VARIANTS)
+
+    if args.command in ("compare", "student"):
+        if args.command == "compare":
+            comparison = compare_variants(config, checkpoint_path, variants)
+        else:
+            comparison = compare_student(config, checkpoint_path, args.student or config.STUDENT_MODEL_PATH)
+        print_comparison(comparison)
+        if args.output:
+            write_json(args.output, comparison)
+        return
+
+    fmt = args.format or config.EXPORT_FORMAT
+    if fmt == "export" and not args.variant:
+        # torch.export only handles the fp32 variants
+        variants = [variant for variant in variants if not variant.endswith("int8")]
+    # torch.export specializes dimensions of size 1, so the example batch holds two images
+    inputs = example_inputs(2, config.HEIGHT, config.WIDTH, config.CHANNELS, config.CHANNELS_LAST)
+    calibration = build_loaders(config, (1, 2, 3))["train"] if "static_int8" in variants else None
+    for variant in variants:
+        model = build_variant(
+            checkpoint_path,
+            variant,
+            calibration_batches=calibration,
+            n_calibration_batches=config.CALIBRATION_BATCHES,
+            backend=config.QUANT_BACKEND,
+            channels_last=config.CHANNELS_LAST,
+        )
+        path = Path(args.output or config.EXPORT_PATH) / f"resnet18_{variant}{FORMATS[fmt]}"
+        export_variant(model, path, inputs, fmt=fmt, variant=variant)
+
+
+if __name__ == "__main__":
+    main()
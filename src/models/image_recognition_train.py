@@ -3,209 +3,438 @@
 # Author: David Anthony Parham
 #
 # Module Description: This script is used to train an image recognition
-# model designed to detect certain LEGO bricks.
+# model designed to detect certain LEGO bricks. The Trainer reads the
+# OmegaConf config and offers an opt-in fast mode for CPU-only boxes
+# and a distillation mode that trains a compact student model.
 ######################################################################
 
 
+import contextlib
 import os
 import time
 from pathlib import Path
+from typing import Any, Dict, List, Optional
 
 import numpy as np
 import torch
 import wandb
-from custom_dataset import CustomDataset
-from omegaconf import OmegaConf
+from augmentation import build_augmentation
+from checkpointing import AsyncCheckpointWriter, latest_checkpoint
+from custom_dataset import CustomDataset, SyntheticStreamDataset, train_val_split
+from distillation import DistillationLoss, build_model, load_teacher
+from omegaconf import DictConfig, OmegaConf
+from profiling import StageTimer, chrome_trace_profiler, write_json
 from torch import nn, optim
-from torch.utils.data import DataLoader, random_split
-from torchvision import transforms
-from torchvision.models import resnet18
+from torch.utils.data import DataLoader
 from tqdm import tqdm
 
+from data.synthetic_cache import SyntheticDataCache
 from data.synthetic_data import generate_synthetic_data_for_products
 
-# Load config file
-config_path = Path("..") / "config" / "config.yaml"
-config = OmegaConf.load(config_path)
-
-# Initialize logging with wandb and track conf settings
-WANDB_API = os.getenv("WANDB_API")
-wandb.login(key=WANDB_API)
-wandb.init(project="lego-image-recognition", config=dict(config))
-
-# Set seeds for reproducibility using numpy's Generator
-rng = np.random.default_rng(seed=1)
-
-# Constants from config for model training
-EPOCHS = config.EPOCHS
-BATCH_SIZE = config.BATCH_SIZE
-LEARNING_RATE = config.LEARNING_RATE
-N_WORKERS = config.N_WORKERS
-
-# Dynamic variable from config
-best_val = config.BEST_VAL
-
-# Constant from config for synthetic data generation
-HEIGHT = config.HEIGHT
-WIDTH = config.WIDTH
-CHANNELS = config.CHANNELS
-N_IMAGES = config.N_IMAGES
-DTYPE = config.DTYPE
-
-
-# Determine device
-device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-print("[INFO] Using device:", device)
-
-# Replace with actual product IDs sources from the dummy database
-product_ids = [1, 2, 3]
-
-# Generate synthetic data
-params = {"height": HEIGHT, "width": WIDTH, "channels": CHANNELS, "n_images": N_IMAGES, "dtype": DTYPE}
-synthetic_data = generate_synthetic_data_for_products(product_ids, params)
-
-# Extract images and labels from synthetic data
-images_train = []
-labels_train = []
-for key, data in synthetic_data.items():
-    for image in data:
-        images_train.append(image)
-        labels_train.append(key)
-
-images_train = np.array(images_train)
-labels_train = np.array(labels_train)
-
-# Prepare transformations for the dataset
-transform = transforms.Compose(
-    [
-        transforms.ToPILImage(),
-        transforms.RandomAffine(degrees=20, translate=(0.2, 0.2), scale=(0.8, 1.2), shear=0.2),
-        transforms.RandomHorizontalFlip(p=0.5),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]),
-    ]
-)
-
-# Create dataset and split into train and test sets
-dataset = CustomDataset(images_train, labels_train, transform=transform)
-train_size = int(0.8 * len(dataset))
-test_size = len(dataset) - train_size
-train_dataset, test_dataset = random_split(dataset, [train_size, test_size])
-
-# Create dataloaders
-train_loader = DataLoader(train_dataset, shuffle=True, num_workers=N_WORKERS, batch_size=BATCH_SIZE)
-test_loader = DataLoader(test_dataset, shuffle=False, num_workers=N_WORKERS, batch_size=BATCH_SIZE)
-
-# Build ResNet-18 model
-model = resnet18(pretrained=False, num_classes=len(np.unique(labels_train)) + 1).to(device)
-
-# Define loss function and optimizer
-criterion = nn.CrossEntropyLoss()
-optimizer = optim.Adam(model.parameters(), lr=LEARNING_RATE)
-
-# Training loop
-print("[INFO] Started training the model...\n")
-start_time = time.time()
-
-for epoch in tqdm(range(EPOCHS), desc="Training Epochs"):
-    # Training
-    model.train()
-    train_losses = []
-    correct = 0
-    total = 0
-
-    for images, labels in train_loader:
-        optimizer.zero_grad()
-        images, labels = images.to(device), labels.to(device)  # noqa
-
-        # Forward pass
-        outputs = model(images)
-
-        # Compute loss
-        loss = criterion(outputs, labels)
-
-        # Backward pass and optimization
-        loss.backward()
-        optimizer.step()
-
-        train_losses.append(loss.item())
-
-        # Calculate accuracy
-        _, predicted = torch.max(outputs.data, 1)
-        total += labels.size(0)
-        correct += (predicted == labels).sum().item()
-
-    train_loss = np.mean(train_losses)
-    train_acc = 100 * correct / total
-
-    # Log train metrics
-    wandb.log({"train_loss": train_loss, "train_acc": train_acc})
-
-    # Validation
-    model.eval()
-    val_losses = []
-    correct = 0
-    total = 0
-
-    with torch.no_grad():
-        for images, labels in test_loader:
-            images, labels = images.to(device), labels.to(device)  # noqa
+# Default location of the config file, relative to the src folder
+CONFIG_PATH = Path("..") / "config" / "config.yaml"
+
+
+class Trainer:
+    """Trains the ResNet-18 image recognition model on synthetic data of the given products.
+
+    With ``DISTILL`` enabled, a compact ``STUDENT_ARCH`` model is trained instead. The trained ResNet-18 at
+    ``TEACHER_PATH`` runs frozen next to it, and the training loss blends the soft targets of the teacher at
+    ``DISTILL_TEMPERATURE`` with the cross entropy against the labels (weighted by ``DISTILL_ALPHA``). The
+    validation loss stays the plain cross entropy. The best student is saved to ``STUDENT_MODEL_PATH`` and its
+    periodic checkpoints to a subfolder of ``CHECKPOINT_PATH`` named after the architecture, so the teacher's
+    checkpoints are never overwritten.
+
+    With ``FAST_MODE`` enabled, the forward and backward passes run under bfloat16 autocast, the model and its
+    inputs use the ``channels_last`` memory format and the model is optionally compiled with ``torch.compile``.
+    Gradient accumulation (``GRAD_ACCUM_STEPS``) and the intra-op thread count (``NUM_THREADS``) apply to both
+    modes. Losses and accuracies are accumulated on the device and synchronized only once per epoch.
+
+    Every epoch records the wall time per stage (data wait, host-to-device copy, augmentation, forward,
+    backward, optimizer step, evaluation, checkpoint); the data wait, copy and augmentation of the validation
+    batches are recorded under their own eval/ stages. ``PROFILE_STEPS`` additionally wraps the first steps of
+    training in ``torch.profiler`` and writes a Chrome trace.
+    """
+
+    def __init__(self, config: DictConfig, product_ids: Optional[List[int]] = None):
+        """Initialize the trainer.
+
+        :param config: Config with the training, data generation and fast mode settings
+        :param product_ids: Product IDs to train on (default: None, i.e. the dummy products 1, 2 and 3)
+        """
+        self.config = config
+        # Replace with actual product IDs sources from the dummy database
+        self.product_ids = list(product_ids or [1, 2, 3])
+        self.best_val = config.BEST_VAL
+
+        # Determine device
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        print("[INFO] Using device:", self.device)
+
+        if config.NUM_THREADS:
+            torch.set_num_threads(config.NUM_THREADS)
+
+        self.fast_mode = config.FAST_MODE
+        self.use_bf16 = self.fast_mode and config.AUTOCAST_BF16
+        self.memory_format = torch.channels_last if self.fast_mode and config.CHANNELS_LAST else torch.contiguous_format
+        self.accum_steps = max(1, config.GRAD_ACCUM_STEPS)
+
+        # Parameters for the synthetic data generation
+        self.params = {
+            "height": config.HEIGHT,
+            "width": config.WIDTH,
+            "channels": config.CHANNELS,
+            "n_images": config.N_IMAGES,
+            "dtype": config.DTYPE,
+            "seed": config.SEED,
+        }
+
+        self.transform, self.augment = self.build_augmentation()
+        self.train_dataset, self.test_dataset, class_labels = self.build_datasets()
+        self.train_loader = self.build_dataloader(self.train_dataset, shuffle=True)
+        self.test_loader = self.build_dataloader(self.test_dataset, shuffle=False)
+
+        # Build the ResNet-18 model, or the student model in distillation mode
+        num_classes = len(np.unique(class_labels)) + 1
+        self.distill = config.DISTILL
+        self.arch = config.STUDENT_ARCH if self.distill else "resnet18"
+        self.model = build_model(self.arch, num_classes)
+        self.model = self.model.to(self.device, memory_format=self.memory_format)
+        self.forward = torch.compile(self.model) if self.fast_mode and config.COMPILE else self.model
+
+        self.teacher: Optional[nn.Module] = None
+        if self.distill:
+            self.teacher = load_teacher(config.TEACHER_PATH, num_classes, self.device)
+            self.teacher = self.teacher.to(memory_format=self.memory_format)
+
+        # Define loss function and optimizer
+        self.criterion = nn.CrossEntropyLoss()
+        self.distill_criterion = DistillationLoss(config.DISTILL_TEMPERATURE, config.DISTILL_ALPHA)
+        self.optimizer = optim.Adam(self.model.parameters(), lr=config.LEARNING_RATE)
+
+        # Per-stage timing; exact timings on asynchronous devices require a synchronization per stage
+        synchronize = torch.cuda.synchronize if self.device.type == "cuda" and config.PROFILE_SYNC else None
+        self.timer = StageTimer(synchronize=synchronize)
+        self.profile_records: List[Dict[str, Any]] = []
+        self.profiler: Optional[torch.profiler.profile] = None
+
+        # Checkpoints are serialized on a background thread; only the last KEEP_CHECKPOINTS periodic ones are kept
+        self.best_model_path = config.STUDENT_MODEL_PATH if self.distill else config.BEST_MODEL_PATH
+        self.checkpoint_dir = Path(config.CHECKPOINT_PATH) / self.arch if self.distill else config.CHECKPOINT_PATH
+        self.checkpoints = AsyncCheckpointWriter(self.checkpoint_dir, keep_last=config.KEEP_CHECKPOINTS)
+        self.start_epoch = self.resume() if config.RESUME else 0
+
+        self.use_wandb = config.USE_WANDB
+        if self.use_wandb:
+            # Initialize logging with wandb and track conf settings
+            wandb.login(key=os.getenv("WANDB_API"))
+            wandb.init(project="lego-image-recognition", config=OmegaConf.to_container(config))
+
+    def build_augmentation(self):
+        """Build the per-sample transform and the batched augmentation stage selected by AUGMENTATION."""
+        transform, augment = build_augmentation(self.config.AUGMENTATION)
+        return transform, None if augment is None else augment.to(self.device)
+
+    def build_datasets(self):
+        """Build the train and validation datasets and return them with the class labels."""
+        val_fraction = self.config.VAL_FRACTION
+
+        if self.config.STREAMING:
+            # Synthesize the images on the fly inside the dataloader workers; the split is decided per sample
+            train_dataset = SyntheticStreamDataset(
+                self.product_ids, self.params, "train", val_fraction, shuffle=True, transform=self.transform
+            )
+            test_dataset = SyntheticStreamDataset(
+                self.product_ids, self.params, "val", val_fraction, transform=self.transform
+            )
+            return train_dataset, test_dataset, train_dataset.targets
+
+        # Generate synthetic data, reusing the memory-mapped reference images of earlier runs
+        cache = None
+        if self.config.CACHE_DIR:
+            cache = SyntheticDataCache(self.config.CACHE_DIR, max_bytes=int(self.config.CACHE_MAX_GB * 1024**3))
+        synthetic_data = generate_synthetic_data_for_products(
+            self.product_ids, self.params, n_workers=self.config.N_GEN_WORKERS, cache=cache
+        )
 
-            # Forward pass
-            outputs = model(images)
+        # Create dataset and split into train and test sets
+        dataset = CustomDataset.from_products(synthetic_data, transform=self.transform)
+        train_dataset, test_dataset = train_val_split(dataset, val_fraction, self.config.SEED)
+        return train_dataset, test_dataset, dataset.targets
+
+    def build_dataloader(self, dataset, shuffle: bool) -> DataLoader:
+        """Create a dataloader; iterable datasets shuffle themselves."""
+        return DataLoader(
+            dataset,
+            shuffle=shuffle and not self.config.STREAMING,
+            num_workers=self.config.N_WORKERS,
+            batch_size=self.config.BATCH_SIZE,
+            pin_memory=self.device.type == "cuda",
+        )
 
-            # Compute loss
-            loss = criterion(outputs, labels)
-            val_losses.append(loss.item())
+    def autocast(self):
+        """Return the autocast context of the forward pass (bfloat16 in fast mode)."""
+        if not self.use_bf16:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type=self.device.type, dtype=torch.bfloat16)
+
+    def prepare_batch(self, images: torch.Tensor, labels: torch.Tensor, train: bool):
+        """Move a batch to the device, apply the batched augmentation and the memory format.
+
+        Validation batches are timed in the separate eval/h2d_copy and eval/augment stages.
+        """
+        prefix = "" if train else "eval/"
+        with self.timer.stage(f"{prefix}h2d_copy"):
+            images = images.to(self.device, non_blocking=True)
+            labels = labels.to(self.device, non_blocking=True)
+
+        if self.augment is not None:
+            with self.timer.stage(f"{prefix}augment"):
+                images = self.augment(images) if train else self.augment.normalize(images)
+
+        return images.contiguous(memory_format=self.memory_format), labels
+
+    def batches(self, loader: DataLoader, stage: str = "data_wait"):
+        """Iterate over a dataloader while timing how long the loop waits for each batch.
+
+        :param loader: Dataloader to iterate over
+        :param stage: Name of the stage the waiting time is added to (default: data_wait)
+        """
+        iterator = iter(loader)
+        while True:
+            with self.timer.stage(stage):
+                batch = next(iterator, None)
+            if batch is None:
+                return
+            yield batch
+
+    def train_epoch(self) -> Dict[str, float]:
+        """Train the model for one epoch.
+
+        :return: Train loss, accuracy and throughput of the epoch
+        """
+        self.model.train()
+        loss_sum = torch.zeros((), device=self.device)
+        correct = torch.zeros((), dtype=torch.long, device=self.device)
+        total = 0
+        start = time.perf_counter()
+
+        self.optimizer.zero_grad(set_to_none=True)
+        step = 0
+
+        for step, (images, labels) in enumerate(self.batches(self.train_loader), start=1):
+            images, labels = self.prepare_batch(images, labels, train=True)  # noqa
 
-            # Calculate accuracy
-            _, predicted = torch.max(outputs.data, 1)
+            # Forward pass
+            with self.timer.stage("forward"), self.autocast():
+                outputs = self.forward(images)
+                loss = self.compute_loss(images, outputs, labels)
+
+            # Backward pass; the optimizer steps once every accum_steps batches
+            with self.timer.stage("backward"):
+                (loss / self.accum_steps).backward()
+            if step % self.accum_steps == 0:
+                with self.timer.stage("optimizer_step"):
+                    self.optimizer.step()
+                    self.optimizer.zero_grad(set_to_none=True)
+
+            if self.profiler is not None:
+                self.profiler.step()
+
+            # Accumulate metrics on the device to avoid a synchronization per step
+            loss_sum += loss.detach() * labels.size(0)
+            correct += (outputs.argmax(dim=1) == labels).sum()
             total += labels.size(0)
-            correct += (predicted == labels).sum().item()
-
-    val_loss = np.mean(val_losses)
-    val_acc = 100 * correct / total
-
-    # Log validation metrics
-    wandb.log({"val_loss": val_loss, "val_acc": val_acc})
-
-    print(
-        f"Epoch {epoch + 1}/{EPOCHS} - "
-        f"Train Loss: {train_loss:.4f} - Train Acc: {train_acc:.2f}% - "
-        f"Val Loss: {val_loss:.4f} - Val Acc: {val_acc:.2f}%"
-    )
-
-    # Save best model
-    if val_loss < best_val:
-        best_val = val_loss
-        print("\n[INFO] Saving new best_model...\n")
-        os.makedirs(os.path.dirname(config.BEST_MODEL_PATH), exist_ok=True)
-        torch.save(
-            {
-                "epoch": epoch + 1,
-                "model_state_dict": model.state_dict(),
-                "optimizer_state_dict": optimizer.state_dict(),
-            },
-            config.BEST_MODEL_PATH,
-        )
 
-    # Save model checkpoint based on save_after frequency
-    if (epoch + 1) % 5 == 0:
-        print(f"\n[INFO] Saving model as checkpoint -> epoch_{epoch + 1}.pth\n")
-        checkpoint_path = os.path.join(config.CHECKPOINT_PATH, f"epoch_{epoch + 1}.pth")
-        torch.save(
-            {
-                "epoch": epoch + 1,
-                "model_state_dict": model.state_dict(),
-                "optimizer_state_dict": optimizer.state_dict(),
-            },
-            checkpoint_path,
-        )
-
-end_time = time.time()
-run_time = (end_time - start_time) / 60  # in minutes
+        # Apply the gradients of a last incomplete accumulation window, also for loaders without len()
+        if step % self.accum_steps != 0:
+            with self.timer.stage("optimizer_step"):
+                self.optimizer.step()
+                self.optimizer.zero_grad(set_to_none=True)
+
+        elapsed = time.perf_counter() - start
+        return {
+            "train_loss": loss_sum.item() / max(total, 1),
+            "train_acc": 100 * correct.item() / max(total, 1),
+            "train_images_per_s": total / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def compute_loss(self, images: torch.Tensor, outputs: torch.Tensor, labels: torch.Tensor) -> torch.Tensor:
+        """Return the training loss, which includes the soft targets of the teacher in distillation mode."""
+        if self.teacher is None:
+            return self.criterion(outputs, labels)
+
+        with torch.no_grad():
+            teacher_outputs = self.teacher(images)
+        return self.distill_criterion(outputs, teacher_outputs, labels)
+
+    @torch.no_grad()
+    def evaluate(self, model: Optional[nn.Module] = None) -> Dict[str, float]:
+        """Evaluate the model on the validation split.
+
+        :param model: Model to evaluate (default: None, i.e. the trained model)
+        :return: Validation loss, accuracy and throughput
+        """
+        forward = model if model is not None else self.forward
+        self.model.eval()
+        loss_sum = torch.zeros((), device=self.device)
+        correct = torch.zeros((), dtype=torch.long, device=self.device)
+        total = 0
+        start = time.perf_counter()
+
+        for images, labels in self.batches(self.test_loader, stage="eval/data_wait"):
+            images, labels = self.prepare_batch(images, labels, train=False)  # noqa
+
+            with self.autocast():
+                outputs = forward(images)
+                loss = self.criterion(outputs, labels)
+
+            loss_sum += loss * labels.size(0)
+            correct += (outputs.argmax(dim=1) == labels).sum()
+            total += labels.size(0)
 
-# Optionally save checkpoint folder for each experiment
-# wandb.save(config.CHECKPOINT_PATH)
+        elapsed = time.perf_counter() - start
+        return {
+            "val_loss": loss_sum.item() / max(total, 1),
+            "val_acc": 100 * correct.item() / max(total, 1),
+            "val_images_per_s": total / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def save_checkpoint(self, epoch: int, path: Optional[str] = None) -> None:
+        """Snapshot model and optimizer state and hand it to the background checkpoint writer.
+
+        :param epoch: Number of completed epochs
+        :param path: Path of the checkpoint file (default: None, i.e. the periodic checkpoint of the epoch)
+        """
+        state = {
+            "epoch": epoch,
+            "arch": self.arch,
+            "best_val": self.best_val,
+            "model_state_dict": self.model.state_dict(),
+            "optimizer_state_dict": self.optimizer.state_dict(),
+        }
+        with self.timer.stage("checkpoint"):
+            self.checkpoints.submit(state, path=path, epoch=epoch)
+
+    def resume(self) -> int:
+        """Restore model, optimizer, epoch and best validation loss from the latest periodic checkpoint.
+
+        :return: Epoch to continue with (0 if there is no checkpoint)
+        """
+        path = latest_checkpoint(self.checkpoint_dir)
+        if path is None:
+            print("[INFO] No checkpoint found, starting from scratch")
+            return 0
+
+        checkpoint = torch.load(path, map_location=self.device)
+        self.model.load_state_dict(checkpoint["model_state_dict"])
+        self.optimizer.load_state_dict(checkpoint["optimizer_state_dict"])
+        self.best_val = checkpoint.get("best_val", self.best_val)
+
+        print(f"[INFO] Resumed from {path} (epoch {checkpoint['epoch']})")
+        return checkpoint["epoch"]
+
+    def profile(self, enabled: bool):
+        """Return the context that wraps the first PROFILE_STEPS training steps in torch.profiler."""
+        if not enabled or not self.config.PROFILE_STEPS:
+            return contextlib.nullcontext()
+
+        self.profiler = chrome_trace_profiler(
+            self.config.PROFILE_TRACE, self.config.PROFILE_STEPS, cuda=self.device.type == "cuda"
+        )
 
-print(f"[INFO] Successfully completed training session. Running time: {run_time:.2f} min")
+        @contextlib.contextmanager
+        def profiling():
+            try:
+                with self.profiler:
+                    yield
+            finally:
+                self.profiler = None
+
+        return profiling()
+
+    def record_profile(self, epoch: int) -> None:
+        """Store the stage timings of an epoch and send them to wandb if it is enabled."""
+        self.profile_records.append({"epoch": epoch, "stages": self.timer.summary()})
+        self.log(self.timer.flat())
+
+    def log(self, metrics: Dict[str, Any]) -> None:
+        """Log metrics to wandb if it is enabled."""
+        if self.use_wandb:
+            wandb.log(metrics)
+
+    def fit(self) -> Dict[str, float]:
+        """Run the training loop.
+
+        :return: Metrics of the last epoch, extended by the best validation loss and the running time
+        """
+        epochs = self.config.EPOCHS
+        metrics: Dict[str, float] = {}
+
+        teacher_metrics: Dict[str, float] = {}
+        if self.teacher is not None:
+            # The teacher's accuracy is the reference the student is measured against
+            teacher_metrics = {f"teacher_{name}": value for name, value in self.evaluate(self.teacher).items()}
+            print(f"[INFO] Distilling {self.arch} from teacher with val acc {teacher_metrics['teacher_val_acc']:.2f}%")
+            self.log(teacher_metrics)
+
+        print("[INFO] Started training the model...\n")
+        start_time = time.time()
+
+        for epoch in tqdm(range(self.start_epoch, epochs), desc="Training Epochs"):
+            if self.config.STREAMING:
+                self.train_dataset.set_epoch(epoch)
+
+            self.timer.reset()
+            with self.profile(epoch == self.start_epoch):
+                train_metrics = self.train_epoch()
+            self.log(train_metrics)
+
+            with self.timer.stage("eval"):
+                val_metrics = self.evaluate()
+            self.log(val_metrics)
+
+            metrics = {**train_metrics, **val_metrics}
+            print(
+                f"Epoch {epoch + 1}/{epochs} - "
+                f"Train Loss: {metrics['train_loss']:.4f} - Train Acc: {metrics['train_acc']:.2f}% - "
+                f"Val Loss: {metrics['val_loss']:.4f} - Val Acc: {metrics['val_acc']:.2f}% - "
+                f"Train Throughput: {metrics['train_images_per_s']:.1f} img/s"
+            )
+
+            # Save best model
+            if metrics["val_loss"] < self.best_val:
+                self.best_val = metrics["val_loss"]
+                print("\n[INFO] Saving new best_model...\n")
+                self.save_checkpoint(epoch + 1, path=self.best_model_path)
+
+            # Save model checkpoint based on save_after frequency
+            if (epoch + 1) % self.config.CHECKPOINT_EVERY == 0:
+                print(f"\n[INFO] Saving model as checkpoint -> epoch_{epoch + 1}.pth\n")
+                self.save_checkpoint(epoch + 1)
+
+            self.record_profile(epoch + 1)
+
+        # Wait for the checkpoints that are still being written
+        self.checkpoints.close()
+        run_time = (time.time() - start_time) / 60  # in minutes
+
+        # Optionally save checkpoint folder for each experiment
+        # wandb.save(config.CHECKPOINT_PATH)
+
+        if not self.use_wandb and self.profile_records:
+            write_json(self.config.PROFILE_JSON, self.profile_records)
+            print(f"[INFO] Wrote per-stage timings to {self.config.PROFILE_JSON}")
+
+        print(f"[INFO] Successfully completed training session. Running time: {run_time:.2f} min")
+        return {**teacher_metrics, **metrics, "best_val": self.best_val, "run_time_min": run_time}
+
+
+def main(config_path: Path = CONFIG_PATH) -> None:
+    """Load the config file and train the model."""
+    config = OmegaConf.load(config_path)
+    Trainer(config).fit()
+
+
+if __name__ == "__main__":
+    main()
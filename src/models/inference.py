@@ -2,8 +2,371 @@
 ######################################################################
 # Author: David Anthony Parham
 #
-# Module Description: This script is not functional and is meant to
-# showcase model inference.
+# Module Description: This script contains the support-set embedding
+# index used during inference. Detected bricks are embedded with the
+# penultimate layer of the trained ResNet-18 and matched against the
+# embeddings of the synthetic reference images (support set).
 ######################################################################
 
-NotImplemented
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+from torch import nn
+from torchvision.models.quantization import resnet18 as quantizable_resnet18
+
+from models.augmentation import BatchAugmentation
+from models.distillation import build_model, infer_num_classes
+
+# Label assigned to detected bricks that do not match any product of the order
+REDUNDANT_BRICK = "Redundant Brick"
+
+
+def load_classifier(
+    checkpoint_path: Optional[Union[str, Path]] = None,
+    num_classes: Optional[int] = None,
+    device: str = "cpu",
+    quantizable: bool = False,
+) -> nn.Module:
+    """Load the trained classifier, i.e. the ResNet-18 or a distilled student, including its classification head.
+
+    :param checkpoint_path: Path of a checkpoint written by image_recognition_train.py (default: None, i.e.
+        randomly initialized weights)
+    :param num_classes: Number of classes of the checkpoint; inferred from the checkpoint if omitted
+    :param device: Device the model is moved to (default: "cpu")
+    :param quantizable: Flag to build torchvision's quantizable ResNet-18, which has the same weights but
+        supports conv-bn fusion and eager-mode static quantization (default: False)
+    :return: Model in evaluation mode
+    """
+    state_dict, arch = None, "resnet18"
+    if checkpoint_path is not None:
+        checkpoint = torch.load(checkpoint_path, map_location="cpu")
+        state_dict = checkpoint.get("model_state_dict", checkpoint)
+        # Checkpoints of distilled students record their architecture; older checkpoints are ResNet-18s
+        arch = checkpoint.get("arch", arch)
+        num_classes = num_classes or infer_num_classes(state_dict)
+
+    if quantizable and arch != "resnet18":
+        raise ValueError(f"Only ResNet-18 checkpoints can be quantized, got '{arch}'")
+    if quantizable:
+        model = quantizable_resnet18(weights=None, num_classes=num_classes or 1000)
+    else:
+        model = build_model(arch, num_classes or 1000)
+    if state_dict is not None:
+        model.load_state_dict(state_dict)
+
+    return model.to(device).eval()
+
+
+def load_backbone(
+    checkpoint_path: Optional[Union[str, Path]] = None, num_classes: Optional[int] = None, device: str = "cpu"
+) -> nn.Module:
+    """Load the trained classifier and strip its classification head.
+
+    :param checkpoint_path: Path of a checkpoint written by image_recognition_train.py (default: None, i.e.
+        randomly initialized weights)
+    :param num_classes: Number of classes of the checkpoint; inferred from the checkpoint if omitted
+    :param device: Device the backbone is moved to (default: "cpu")
+    :return: Backbone in evaluation mode that maps images to embeddings (512-dimensional for the ResNets, 576 or
+        960-dimensional for the MobileNetV3 students)
+    """
+    model = load_classifier(checkpoint_path, num_classes=num_classes, device=device)
+
+    # The penultimate layer (global average pooling) provides the embedding
+    if hasattr(model, "fc"):
+        model.fc = nn.Identity()
+    else:
+        model.classifier = nn.Identity()
+
+    return model
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale vectors to unit L2 norm.
+
+    :param vectors: Array of shape (N, D)
+    :return: Contiguous float32 array of unit-length rows
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(vectors / np.maximum(norms, np.finfo(np.float32).tiny))
+
+
+@torch.no_grad()
+def embed_images(
+    backbone: nn.Module, images: Iterable[np.ndarray], batch_size: int = 64, device: str = "cpu"
+) -> np.ndarray:
+    """Embed uint8 images with the backbone.
+
+    :param backbone: Backbone returned by load_backbone
+    :param images: Array or sequence of images in (H, W, C) layout
+    :param batch_size: Number of images embedded per forward pass (default: 64)
+    :param device: Device the forward passes run on (default: "cpu")
+    :return: L2-normalized float32 embeddings of shape (N, D)
+    """
+    normalize = BatchAugmentation().to(device).eval()
+    embeddings = []
+    batch: List[np.ndarray] = []
+
+    def flush() -> None:
+        inputs = normalize(torch.from_numpy(np.stack(batch)).to(device))
+        embeddings.append(backbone(inputs).float().cpu().numpy())
+        batch.clear()
+
+    for image in images:
+        batch.append(np.asarray(image))
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+
+    if not embeddings:
+        return np.empty((0, 0), dtype=np.float32)
+
+    return l2_normalize(np.concatenate(embeddings))
+
+
+class EmbeddingIndex:
+    """Index of L2-normalized support-set embeddings with batched top-k cosine search.
+
+    All embeddings are kept in one contiguous float32 matrix, so a batch of queries is matched with a single
+    matrix multiplication. The optional int8 variant stores symmetric per-vector quantized codes, which
+    reduces the memory footprint by 4x and is dequantized chunk by chunk during the search.
+    """
+
+    def __init__(self, embeddings: np.ndarray, labels: np.ndarray, quantize: bool = False, max_distance: float = 0.5):
+        """Initialize the index.
+
+        :param embeddings: Support-set embeddings of shape (N, D)
+        :param labels: Product ID of every embedding
+        :param quantize: Flag to store the embeddings as int8 codes (default: False)
+        :param max_distance: Cosine distance above which a query is labelled as redundant brick (default: 0.5)
+        """
+        embeddings = l2_normalize(embeddings)
+        self.labels = np.ascontiguousarray(labels, dtype=np.int64)
+        self.max_distance = max_distance
+        self.quantized = quantize
+
+        if len(self.labels) != len(embeddings):
+            raise ValueError(f"Got {len(embeddings)} embeddings but {len(self.labels)} labels")
+
+        if quantize:
+            scales = np.abs(embeddings).max(axis=1) / 127.0
+            self.scales = np.maximum(scales, np.finfo(np.float32).tiny).astype(np.float32)
+            self.vectors = np.round(embeddings / self.scales[:, None]).astype(np.int8)
+        else:
+            self.scales = None
+            self.vectors = embeddings
+
+    @classmethod
+    def build(  # noqa
+        cls,
+        backbone: nn.Module,
+        synthetic_data: Dict[int, np.ndarray],
+        batch_size: int = 64,
+        device: str = "cpu",
+        quantize: bool = False,
+        prototypes: bool = False,
+        max_distance: float = 0.5,
+    ) -> "EmbeddingIndex":
+        """Embed the support set of all products and build the index.
+
+        :param backbone: Backbone returned by load_backbone
+        :param synthetic_data: Dictionary mapping product IDs to their reference images
+        :param batch_size: Number of images embedded per forward pass (default: 64)
+        :param device: Device the forward passes run on (default: "cpu")
+        :param quantize: Flag to store the embeddings as int8 codes (default: False)
+        :param prototypes: Flag to keep only one mean embedding per product (default: False)
+        :param max_distance: Cosine distance above which a query is labelled as redundant brick (default: 0.5)
+        :return: Embedding index of the support set
+        """
+        embeddings = {
+            product_id: embed_images(backbone, images, batch_size, device)
+            for product_id, images in synthetic_data.items()
+        }
+        return cls.from_embeddings(embeddings, quantize=quantize, prototypes=prototypes, max_distance=max_distance)
+
+    @classmethod
+    def from_embeddings(
+        cls,
+        embeddings: Dict[int, np.ndarray],
+        quantize: bool = False,
+        prototypes: bool = False,
+        max_distance: float = 0.5,
+    ) -> "EmbeddingIndex":
+        """Build the index from support-set embeddings that were computed earlier.
+
+        :param embeddings: Dictionary mapping product IDs to their embeddings of shape (N, D)
+        :param quantize: Flag to store the embeddings as int8 codes (default: False)
+        :param prototypes: Flag to keep only one mean embedding per product (default: False)
+        :param max_distance: Cosine distance above which a query is labelled as redundant brick (default: 0.5)
+        :return: Embedding index of the support set
+        """
+        labels = [np.full(len(vectors), product_id, dtype=np.int64) for product_id, vectors in embeddings.items()]
+        index = cls(np.concatenate(list(embeddings.values())), np.concatenate(labels), max_distance=max_distance)
+        if prototypes:
+            index = index.to_prototypes()
+
+        return index.quantize() if quantize else index
+
+    def __len__(self):
+        return len(self.labels)
+
+    def dense(self) -> np.ndarray:
+        """Return the (dequantized) float32 embedding matrix."""
+        if self.scales is None:
+            return self.vectors
+        return self.vectors.astype(np.float32) * self.scales[:, None]
+
+    def quantize(self) -> "EmbeddingIndex":
+        """Return an int8-quantized copy of the index."""
+        return EmbeddingIndex(self.dense(), self.labels, quantize=True, max_distance=self.max_distance)
+
+    def to_prototypes(self) -> "EmbeddingIndex":
+        """Return an index with one prototype (mean embedding) per product, so matching costs O(products).
+
+        :return: Prototype index with the same quantization setting
+        """
+        products, inverse = np.unique(self.labels, return_inverse=True)
+        sums = np.zeros((len(products), self.vectors.shape[1]), dtype=np.float32)
+        np.add.at(sums, inverse, self.dense())
+
+        return EmbeddingIndex(sums, products, quantize=self.quantized, max_distance=self.max_distance)
+
+    def merge(self, other: "EmbeddingIndex") -> "EmbeddingIndex":
+        """Return an index with the embeddings of both indexes, e.g. to add the products that became ready.
+
+        The stored vectors are concatenated as they are, so neither index is normalized, quantized or reduced to
+        prototypes again.
+
+        :param other: Index built with the same quantization setting and embedding size
+        :return: Merged index with the max_distance of this index
+        """
+        if other.quantized != self.quantized:
+            raise ValueError("Cannot merge a quantized and a float32 embedding index")
+        if len(self) and len(other) and other.vectors.shape[1] != self.vectors.shape[1]:
+            raise ValueError(f"Cannot merge {self.vectors.shape[1]}- and {other.vectors.shape[1]}-dimensional indexes")
+
+        index = EmbeddingIndex.__new__(EmbeddingIndex)
+        index.labels = np.concatenate([self.labels, other.labels])
+        index.max_distance = self.max_distance
+        index.quantized = self.quantized
+        index.vectors = np.concatenate([self.vectors, other.vectors])
+        index.scales = np.concatenate([self.scales, other.scales]) if self.quantized else None
+        return index
+
+    def similarities(self, queries: np.ndarray, chunk_size: int = 65536) -> np.ndarray:
+        """Compute the cosine similarities between queries and all indexed embeddings.
+
+        :param queries: Query embeddings of shape (Q, D)
+        :param chunk_size: Number of int8 codes dequantized at once (default: 65536)
+        :return: Similarity matrix of shape (Q, N)
+        """
+        queries = l2_normalize(queries)
+        if self.scales is None:
+            return queries @ self.vectors.T
+
+        similarities = np.empty((len(queries), len(self)), dtype=np.float32)
+        for start in range(0, len(self), chunk_size):
+            stop = start + chunk_size
+            codes = self.vectors[start:stop].astype(np.float32)
+            similarities[:, start:stop] = (queries @ codes.T) * self.scales[start:stop]
+
+        return similarities
+
+    def search(self, queries: np.ndarray, k: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the k most similar support-set embeddings for a batch of queries.
+
+        :param queries: Query embeddings of shape (Q, D)
+        :param k: Number of neighbours per query (default: 1)
+        :return: Tuple of (similarities, labels), both of shape (Q, k) and sorted by descending similarity
+        """
+        if len(self) == 0:
+            raise ValueError("Cannot search an empty embedding index")
+        if k < 1:
+            raise ValueError(f"Number of neighbours must be at least 1, got {k}")
+
+        similarities = self.similarities(queries)
+        k = min(k, len(self))
+
+        # Partial selection of the top-k candidates followed by sorting only those
+        top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        top_similarities = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_similarities, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+
+        return np.take_along_axis(top_similarities, order, axis=1), self.labels[top]
+
+    def classify(
+        self, queries: np.ndarray, max_distance: Optional[float] = None
+    ) -> Tuple[List[Union[int, str]], np.ndarray]:
+        """Label each query like match and rate how certain the label is.
+
+        The confidence of a product label is the cosine similarity to the nearest neighbour; the confidence of
+        a redundant brick is the cosine distance to it.
+
+        :param queries: Query embeddings of shape (Q, D)
+        :param max_distance: Cosine distance threshold overriding the index default (default: None)
+        :return: Tuple of (labels, confidences), with a product ID or REDUNDANT_BRICK per query
+        """
+        max_distance = self.max_distance if max_distance is None else max_distance
+        similarities, labels = self.search(queries, k=1)
+        similarities, labels = similarities[:, 0], labels[:, 0]
+
+        known = 1.0 - similarities <= max_distance
+        confidences = np.where(known, similarities, 1.0 - similarities).astype(np.float32)
+        return [int(label) if ok else REDUNDANT_BRICK for label, ok in zip(labels, known, strict=True)], confidences
+
+    def match(self, queries: np.ndarray, max_distance: Optional[float] = None) -> List[Union[int, str]]:
+        """Label each query with the product ID of its nearest neighbour or as redundant brick.
+
+        :param queries: Query embeddings of shape (Q, D)
+        :param max_distance: Cosine distance threshold overriding the index default (default: None)
+        :return: Product ID per query, or REDUNDANT_BRICK if the nearest neighbour is too far away
+        """
+        return self.classify(queries, max_distance)[0]
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Save the index to disk.
+
+        :param path: Path of the .npz file
+        """
+        arrays = {"vectors": self.vectors, "labels": self.labels, "max_distance": np.float32(self.max_distance)}
+        if self.scales is not None:
+            arrays["scales"] = self.scales
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "EmbeddingIndex":
+        """Load an index saved with save.
+
+        :param path: Path of the .npz file
+        :return: Loaded embedding index
+        """
+        with np.load(path) as arrays:
+            index = cls.__new__(cls)
+            index.vectors = arrays["vectors"]
+            index.labels = arrays["labels"]
+            index.max_distance = float(arrays["max_distance"])
+            index.scales = arrays["scales"] if "scales" in arrays else None
+            index.quantized = index.scales is not None
+
+        return index
+
+
+if __name__ == "__main__":
+    from data.synthetic_data import generate_synthetic_data_for_products
+
+    # Example usage with an untrained backbone; pass the best checkpoint path in production
+    params = {"height": 64, "width": 64, "channels": 3, "n_images": 16, "dtype": np.uint8}
+    support_set = generate_synthetic_data_for_products([1, 2, 3], params)
+
+    backbone = load_backbone()
+    index = EmbeddingIndex.build(backbone, support_set, prototypes=True)
+    queries = embed_images(backbone, support_set[2][:4])
+
+    print(f"[INFO] Indexed {len(index)} prototypes")
+    print(f"[INFO] Matches: {index.match(queries)}")
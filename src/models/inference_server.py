@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains a local inference server
+# that owns a single embedding model for all cameras of a station.
+# Stream runners hand their crops over shared memory; the server forms
+# dynamic batches across streams, bounded by a maximum batch size and
+# a maximum wait latency, and routes the embeddings back to the
+# stream that sent the crops.
+######################################################################
+
+import multiprocessing as mp
+import queue
+import threading
+import time
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+
+from models.inference import embed_images, load_backbone
+
+
+class _Channel:
+    """Shared-memory slots of one stream: uint8 crops towards the server and embeddings back."""
+
+    def __init__(
+        self,
+        request_name: str,
+        result_name: str,
+        n_slots: int,
+        crop_shape: Tuple[int, int, int],
+        embedding_dim: int,
+    ):
+        self.request_name = request_name
+        self.result_name = result_name
+        self.n_slots = n_slots
+        self.crop_shape = crop_shape
+        self.embedding_dim = embedding_dim
+        self._segments: List[SharedMemory] = []
+
+    @classmethod
+    def create(cls, n_slots: int, crop_shape: Tuple[int, int, int], embedding_dim: int) -> "_Channel":
+        request = SharedMemory(create=True, size=n_slots * int(np.prod(crop_shape)))
+        result = SharedMemory(create=True, size=n_slots * embedding_dim * np.dtype(np.float32).itemsize)
+        channel = cls(request.name, result.name, n_slots, crop_shape, embedding_dim)
+        channel._segments = [request, result]
+        return channel
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Other processes attach to the segments by name
+        return {**self.__dict__, "_segments": []}
+
+    def arrays(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Return the crop and embedding slots as arrays backed by the shared memory."""
+        if not self._segments:
+            # Processes spawned from the creator share its resource tracker, so attaching does not leak segments
+            self._segments = [SharedMemory(name=self.request_name), SharedMemory(name=self.result_name)]
+        request, result = self._segments
+        crops = np.ndarray((self.n_slots, *self.crop_shape), dtype=np.uint8, buffer=request.buf)
+        embeddings = np.ndarray((self.n_slots, self.embedding_dim), dtype=np.float32, buffer=result.buf)
+        return crops, embeddings
+
+    def close(self, unlink: bool = False) -> None:
+        """Detach from the segments and remove them if this process created them."""
+        for segment in self._segments:
+            segment.close()
+            if unlink:
+                segment.unlink()
+        self._segments = []
+
+
+def _collect(requests: "mp.Queue", max_batch: int, max_wait: float) -> Optional[List[Tuple[int, int, int]]]:
+    """Wait for the first request, then for more until the batch is full or max_wait has passed.
+
+    :return: List of (stream_id, slot, sequence) requests, empty on an idle timeout, None once the server is stopped
+    """
+    try:
+        first = requests.get(timeout=0.1)
+    except queue.Empty:
+        return []
+    if first is None:
+        return None
+
+    batch = [first]
+    deadline = time.perf_counter() + max_wait
+    while len(batch) < max_batch:
+        remaining = deadline - time.perf_counter()
+        try:
+            item = requests.get(timeout=remaining) if remaining > 0 else requests.get_nowait()
+        except queue.Empty:
+            break
+        if item is None:
+            # Serve what is collected, then stop
+            requests.put(None)
+            break
+        batch.append(item)
+
+    return batch
+
+
+def _serve_batches(  # noqa
+    backbone: torch.nn.Module,
+    slots: List[Tuple[np.ndarray, np.ndarray]],
+    requests: "mp.Queue",
+    responses: List["mp.Queue"],
+    max_batch: int,
+    max_wait: float,
+    device: str,
+) -> Dict[str, Any]:
+    batch_sizes: Dict[int, int] = {}
+    busy = 0.0
+
+    while (batch := _collect(requests, max_batch, max_wait)) is not None:
+        if not batch:
+            continue
+
+        start = time.perf_counter()
+        crops = [slots[stream_id][0][slot] for stream_id, slot, _ in batch]
+        embeddings = embed_images(backbone, crops, batch_size=len(crops), device=device)
+        for (stream_id, slot, sequence), embedding in zip(batch, embeddings, strict=True):
+            slots[stream_id][1][slot] = embedding
+            responses[stream_id].put((slot, sequence))
+        busy += time.perf_counter() - start
+        batch_sizes[len(batch)] = batch_sizes.get(len(batch), 0) + 1
+
+    return {"batch_sizes": batch_sizes, "busy_s": busy}
+
+
+def _serve(  # noqa
+    checkpoint_path: Optional[str],
+    crop_shape: Tuple[int, int, int],
+    requests: "mp.Queue",
+    responses: List["mp.Queue"],
+    stats: "mp.Queue",
+    max_batch: int,
+    max_wait: float,
+    device: str,
+    num_threads: int,
+) -> None:
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    backbone = load_backbone(checkpoint_path, device=device)
+
+    # The embedding dimension sizes the result slots, which the parent allocates and sends as the first request
+    stats.put(int(embed_images(backbone, [np.zeros(crop_shape, dtype=np.uint8)], 1, device).shape[1]))
+    channels: Optional[List[_Channel]] = requests.get()
+    if channels is None:
+        return
+
+    slots = [channel.arrays() for channel in channels]
+    try:
+        stats.put(_serve_batches(backbone, slots, requests, responses, max_batch, max_wait, device))
+    finally:
+        # The segments can only be closed once no array references their buffers anymore
+        del slots
+        for channel in channels:
+            channel.close()
+
+
+class InferenceClient:
+    """Handle of one stream; embeds crops through the shared server and receives only its own results."""
+
+    def __init__(self, stream_id: int, channel: _Channel, requests: "mp.Queue", responses: "mp.Queue", timeout: float):
+        self.stream_id = stream_id
+        self.channel = channel
+        self.requests = requests
+        self.responses = responses
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._arrays: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        # Number of the current call, which tells its results apart from late results of a call that timed out
+        self._sequence = 0
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Clients can be passed to stream runners in other processes; they attach to the slots on first use
+        return {**self.__dict__, "_lock": None, "_arrays": None}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def embed(self, crops: Sequence[np.ndarray]) -> np.ndarray:
+        """Embed crops on the server.
+
+        :param crops: Uint8 crops in (H, W, C) layout with the server's crop size
+        :return: L2-normalized float32 embeddings of shape (N, D), with the embedding dimension D of the backbone
+        :raises ValueError: If a crop does not have the server's crop size; no crop of the call is sent then
+        :raises RuntimeError: If the server does not answer within the timeout
+        """
+        for crop in crops:
+            if crop.shape != self.channel.crop_shape:
+                raise ValueError(f"Expected crops of shape {self.channel.crop_shape}, got {crop.shape}")
+
+        with self._lock:
+            if self._arrays is None:
+                self._arrays = self.channel.arrays()
+            inputs, outputs = self._arrays
+            embeddings = np.empty((len(crops), self.channel.embedding_dim), dtype=np.float32)
+            self._sequence += 1
+
+            # At most n_slots crops of a stream are in flight; larger calls are sent in rounds
+            for start in range(0, len(crops), self.channel.n_slots):
+                chunk = crops[start : start + self.channel.n_slots]
+                for slot, crop in enumerate(chunk):
+                    inputs[slot] = crop
+                    self.requests.put((self.stream_id, slot, self._sequence))
+
+                pending = len(chunk)
+                deadline = time.perf_counter() + self.timeout
+                while pending:
+                    try:
+                        slot, sequence = self.responses.get(timeout=max(0.0, deadline - time.perf_counter()))
+                    except queue.Empty:
+                        raise RuntimeError(f"Inference server did not answer within {self.timeout} s") from None
+                    # Late results of an earlier call that timed out are discarded
+                    if sequence != self._sequence:
+                        continue
+                    embeddings[start + slot] = outputs[slot]
+                    pending -= 1
+
+        return embeddings
+
+    __call__ = embed
+
+
+class InferenceServer:
+    """Process that owns the embedding model and serves dynamic batches to several stream runners."""
+
+    def __init__(  # noqa
+        self,
+        n_streams: int,
+        checkpoint_path: Optional[Union[str, Path]] = None,
+        crop_size: Tuple[int, int] = (224, 224),
+        max_batch: int = 64,
+        max_wait: float = 0.005,
+        slots_per_stream: int = 32,
+        device: str = "cpu",
+        num_threads: int = 0,
+        timeout: float = 30.0,
+    ):
+        """Initialize the server; the shared-memory slots of all streams are allocated when it is started.
+
+        :param n_streams: Number of streams (cameras) that connect to the server
+        :param checkpoint_path: Path of the checkpoint the backbone is loaded from (default: None, i.e. random
+            weights)
+        :param crop_size: Input size (height, width) of the embedding model (default: (224, 224))
+        :param max_batch: Maximum number of crops per forward pass (default: 64)
+        :param max_wait: Time to wait for further crops once the first one arrived in seconds (default: 0.005)
+        :param slots_per_stream: Number of crops a stream can have in flight (default: 32)
+        :param device: Device the model runs on (default: "cpu")
+        :param num_threads: Number of intra-op threads of the server process (default: 0, i.e. torch default)
+        :param timeout: Time a client waits for a result before it gives up in seconds (default: 30.0)
+        """
+        self.checkpoint_path = None if checkpoint_path is None else str(checkpoint_path)
+        self.n_streams = n_streams
+        self.crop_shape = (*crop_size, 3)
+        self.slots_per_stream = slots_per_stream
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.device = device
+        self.num_threads = num_threads
+        self.timeout = timeout
+        # Reported by the server process once it loaded the backbone
+        self.embedding_dim: Optional[int] = None
+
+        # Spawned rather than forked, so the server does not inherit the intra-op thread pools of the parent
+        self._context = mp.get_context("spawn")
+        self._requests = self._context.Queue()
+        self._responses = [self._context.Queue() for _ in range(n_streams)]
+        self._stats = self._context.Queue()
+        self._channels: List[_Channel] = []
+        self._process: Optional[mp.process.BaseProcess] = None
+        self.stats: Dict[str, Any] = {}
+
+    def __enter__(self) -> "InferenceServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.stop()
+
+    def client(self, stream_id: int) -> InferenceClient:
+        """Return the client of a stream; every stream must use its own client.
+
+        :param stream_id: Stream ID in [0, n_streams)
+        """
+        if not self._channels:
+            raise RuntimeError("The inference server must be started before its clients are created")
+        return InferenceClient(
+            stream_id, self._channels[stream_id], self._requests, self._responses[stream_id], self.timeout
+        )
+
+    def start(self, timeout: float = 120.0) -> None:
+        """Start the server process and allocate the shared-memory slots once it loaded the backbone.
+
+        :param timeout: Maximum time to wait for the server to load the backbone in seconds (default: 120.0)
+        """
+        self._process = self._context.Process(
+            target=_serve,
+            args=(
+                self.checkpoint_path,
+                self.crop_shape,
+                self._requests,
+                self._responses,
+                self._stats,
+                self.max_batch,
+                self.max_wait,
+                self.device,
+                self.num_threads,
+            ),
+            name="inference-server",
+            daemon=True,
+        )
+        self._process.start()
+
+        # Only the server loads the backbone; it reports the embedding dimension, e.g. 512 for the ResNets or 576
+        # for MobileNetV3-Small, so the result slots match the checkpoint
+        deadline = time.perf_counter() + timeout
+        while self.embedding_dim is None:
+            try:
+                self.embedding_dim = self._stats.get(timeout=0.1)
+            except queue.Empty:
+                if self._process.is_alive() and time.perf_counter() < deadline:
+                    continue
+                self._process.terminate()
+                self._process.join()
+                self._process = None
+                raise RuntimeError("Inference server did not load the backbone") from None
+
+        self._channels = [
+            _Channel.create(self.slots_per_stream, self.crop_shape, self.embedding_dim) for _ in range(self.n_streams)
+        ]
+        self._requests.put(self._channels)
+
+    def stop(self, timeout: float = 10.0) -> Dict[str, Any]:
+        """Stop the server after the queued crops are served and release the shared memory.
+
+        :param timeout: Maximum time to wait for the server process (default: 10.0)
+        :return: Number of forward passes per batch size and the busy time of the server
+        """
+        if self._process is not None:
+            self._requests.put(None)
+            try:
+                self.stats = self._stats.get(timeout=timeout)
+            except queue.Empty:
+                self.stats = {}
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+            self._process = None
+
+        for channel in self._channels:
+            channel.close(unlink=True)
+        self._channels = []
+        return self.stats
+
+
+if __name__ == "__main__":
+    from models.inference import EmbeddingIndex
+    from models.video_stream_run import SyntheticFrameSource, VideoStreamRunner
+
+    # Example usage: three stand-in cameras share one untrained model
+    product_ids = [1, 2, 3]
+    crop_size = (128, 128)
+
+    with InferenceServer(n_streams=4, crop_size=crop_size, max_batch=32, max_wait=0.005) as server:
+        # The support set is embedded by the same model through a dedicated client
+        support_set = [
+            SyntheticFrameSource([product_id], dim=(*crop_size, 3), n_frames=8, fps=None) for product_id in product_ids
+        ]
+        support_client = server.client(3)
+        embeddings = {
+            product_id: support_client.embed(list(source))
+            for product_id, source in zip(product_ids, support_set, strict=True)
+        }
+        index = EmbeddingIndex.from_embeddings(embeddings, prototypes=True)
+
+        runners = [
+            VideoStreamRunner(
+                SyntheticFrameSource(product_ids, dim=(*crop_size, 3), n_frames=90, fps=30.0, seed=stream_id),
+                None,
+                index,
+                crop_size=crop_size,
+                embedder=server.client(stream_id),
+            )
+            for stream_id in range(3)
+        ]
+        for runner in runners:
+            runner.start()
+        reports = []
+        for runner in runners:
+            runner.stop(drain=True)
+            reports.append(runner.report())
+
+    for stream_id, report in enumerate(reports):
+        print(f"[INFO] Stream {stream_id}: {report['recognitions']} recognitions, latency {report['latency_ms']}")
+    print(f"[INFO] Server batch sizes: {dict(sorted(server.stats.get('batch_sizes', {}).items()))}")
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the missing-brick counter
+# that tracks, per order, how many LEGO bricks of each piece ID are
+# still expected. Counts of all orders live in one int32 matrix, and
+# recognitions from several pipeline threads decrement it under
+# striped locks.
+######################################################################
+
+import threading
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+# Record layout of snapshots and missing-brick reports
+REPORT_DTYPE = np.dtype([("piece_id", np.int64), ("expected", np.int32), ("remaining", np.int32)])
+
+
+class MissingBrickCounter:
+    """Array-backed, thread-safe counter of the bricks that are still missing per order.
+
+    Piece IDs are mapped to dense column slots once and shared by all orders, and every order occupies one
+    row of an int32 matrix. A recognition is a single element decrement that only holds the lock stripe of
+    its order, so pipeline threads working on different orders do not contend. Reports copy one row and are
+    evaluated with vectorized NumPy operations outside of the lock.
+    """
+
+    def __init__(self, n_stripes: int = 16, initial_orders: int = 8, initial_pieces: int = 256):
+        """Initialize the counter.
+
+        :param n_stripes: Number of locks the order rows are distributed over (default: 16)
+        :param initial_orders: Initial row capacity of the count matrices (default: 8)
+        :param initial_pieces: Initial column capacity of the count matrices (default: 256)
+        """
+        self._stripes = [threading.Lock() for _ in range(n_stripes)]
+        self._layout = threading.Lock()
+
+        self._slots: Dict[int, int] = {}
+        self._piece_ids = np.zeros(initial_pieces, dtype=np.int64)
+        self._rows: Dict[int, int] = {}
+        self._free_rows: List[int] = []
+        self._expected = np.zeros((initial_orders, initial_pieces), dtype=np.int32)
+        self._remaining = np.zeros((initial_orders, initial_pieces), dtype=np.int32)
+
+    @property
+    def n_pieces(self) -> int:
+        """Return the number of distinct piece IDs known to the counter."""
+        return len(self._slots)
+
+    def _lock_for(self, row: int) -> threading.Lock:
+        return self._stripes[row % len(self._stripes)]
+
+    def _grow(self, rows: int, columns: int) -> None:
+        """Enlarge the matrices; must be called with the layout lock and all stripe locks held."""
+        new_rows = max(rows, self._expected.shape[0])
+        new_columns = max(columns, self._expected.shape[1])
+        if (new_rows, new_columns) == self._expected.shape:
+            return
+
+        for name in ("_expected", "_remaining"):
+            old = getattr(self, name)
+            new = np.zeros((new_rows, new_columns), dtype=np.int32)
+            new[: old.shape[0], : old.shape[1]] = old
+            setattr(self, name, new)
+
+        piece_ids = np.zeros(new_columns, dtype=np.int64)
+        piece_ids[: len(self._piece_ids)] = self._piece_ids
+        self._piece_ids = piece_ids
+
+    def register_order(self, order_id: int, totals: Mapping[int, int]) -> None:
+        """Register an order with its expected number of bricks per piece ID.
+
+        :param order_id: Order ID, e.g. the scanned order identifier
+        :param totals: Mapping of piece IDs to the total quantity of the order
+        """
+        piece_ids = np.fromiter(totals.keys(), dtype=np.int64, count=len(totals))
+        quantities = np.fromiter(totals.values(), dtype=np.int32, count=len(totals))
+
+        with self._layout:
+            new_pieces = [int(piece_id) for piece_id in piece_ids if int(piece_id) not in self._slots]
+            rows, columns = self._expected.shape
+            needs_rows = order_id not in self._rows and not self._free_rows and len(self._rows) >= rows
+            needs_columns = self.n_pieces + len(new_pieces) > columns
+
+            # Resizing replaces the matrices, so it has to exclude all concurrent decrements
+            if needs_rows or needs_columns:
+                for lock in self._stripes:
+                    lock.acquire()
+                try:
+                    self._grow(
+                        2 * rows if needs_rows else rows,
+                        2 * (self.n_pieces + len(new_pieces)) if needs_columns else columns,
+                    )
+                finally:
+                    for lock in self._stripes:
+                        lock.release()
+
+            for piece_id in new_pieces:
+                self._piece_ids[self.n_pieces] = piece_id
+                self._slots[piece_id] = self.n_pieces
+
+            row = self._rows.get(order_id)
+            if row is None:
+                row = self._free_rows.pop() if self._free_rows else len(self._rows)
+                self._rows[order_id] = row
+
+            slots = np.fromiter((self._slots[int(piece_id)] for piece_id in piece_ids), dtype=np.int64)
+            with self._lock_for(row):
+                self._expected[row] = 0
+                self._expected[row, slots] = quantities
+                self._remaining[row] = self._expected[row]
+
+    def close_order(self, order_id: int) -> None:
+        """Release the row of a finished order so it can be reused.
+
+        :param order_id: Order ID to remove
+        """
+        with self._layout:
+            row = self._rows.pop(order_id)
+            with self._lock_for(row):
+                self._expected[row] = 0
+                self._remaining[row] = 0
+            self._free_rows.append(row)
+
+    def recognize(self, order_id: int, piece_id: int, count: int = 1) -> Optional[int]:
+        """Decrement the count of a recognized brick.
+
+        :param order_id: Order the brick belongs to
+        :param piece_id: Recognized piece ID
+        :param count: Number of recognized bricks (default: 1)
+        :return: Remaining count of the piece, negative for surplus bricks, or None if the piece ID is unknown
+        """
+        row = self._rows[order_id]
+        slot = self._slots.get(piece_id)
+        if slot is None:
+            return None
+
+        with self._lock_for(row):
+            self._remaining[row, slot] -= count
+            return int(self._remaining[row, slot])
+
+    def recognize_many(self, order_id: int, piece_ids: Sequence[int]) -> int:
+        """Decrement the counts of a batch of recognized bricks in one vectorized update.
+
+        :param order_id: Order the bricks belong to
+        :param piece_ids: Recognized piece IDs, duplicates are counted individually
+        :return: Number of piece IDs that were unknown and therefore ignored
+        """
+        row = self._rows[order_id]
+        slots = np.fromiter((self._slots.get(int(piece_id), -1) for piece_id in piece_ids), dtype=np.int64)
+        known = slots[slots >= 0]
+
+        with self._lock_for(row):
+            np.subtract.at(self._remaining[row], known, 1)
+
+        return len(slots) - len(known)
+
+    def _row_copy(self, order_id: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        row = self._rows[order_id]
+        n_pieces = self.n_pieces
+        with self._lock_for(row):
+            expected = self._expected[row, :n_pieces].copy()
+            remaining = self._remaining[row, :n_pieces].copy()
+        return self._piece_ids[:n_pieces].copy(), expected, remaining
+
+    def snapshot(self, order_id: int) -> np.ndarray:
+        """Return the expected and remaining counts of every piece of an order.
+
+        :param order_id: Order ID to report
+        :return: Structured array with the fields piece_id, expected and remaining
+        """
+        piece_ids, expected, remaining = self._row_copy(order_id)
+        mask = (expected != 0) | (remaining != 0)
+
+        report = np.empty(int(mask.sum()), dtype=REPORT_DTYPE)
+        report["piece_id"] = piece_ids[mask]
+        report["expected"] = expected[mask]
+        report["remaining"] = remaining[mask]
+        return report
+
+    def missing(self, order_id: int) -> np.ndarray:
+        """Return the pieces of an order that have not been recognized often enough yet.
+
+        :param order_id: Order ID to report
+        :return: Structured array of the pieces with a positive remaining count
+        """
+        report = self.snapshot(order_id)
+        return report[report["remaining"] > 0]
+
+    def surplus(self, order_id: int) -> np.ndarray:
+        """Return the pieces of an order that were recognized more often than expected.
+
+        :param order_id: Order ID to report
+        :return: Structured array of the pieces with a negative remaining count
+        """
+        report = self.snapshot(order_id)
+        return report[report["remaining"] < 0]
+
+    def is_complete(self, order_id: int) -> bool:
+        """Return whether all expected bricks of an order have been recognized."""
+        _, _, remaining = self._row_copy(order_id)
+        return not (remaining > 0).any()
+
+    def orders(self) -> Iterable[int]:
+        """Return the IDs of all registered orders."""
+        return list(self._rows)
+
+
+if __name__ == "__main__":
+    # Example usage with the piece totals of two concurrent orders
+    counter = MissingBrickCounter()
+    counter.register_order(1, {3001: 4, 3002: 2, 3003: 1})
+    counter.register_order(2, {3001: 1, 3010: 6})
+
+    for piece_id in (3001, 3001, 3002, 3003, 3003):
+        counter.recognize(1, piece_id)
+    counter.recognize_many(2, [3010] * 6)
+
+    for order_id in counter.orders():
+        print(f"[INFO] Order {order_id} missing: {counter.missing(order_id).tolist()}")
+        print(f"[INFO] Order {order_id} surplus: {counter.surplus(order_id).tolist()}")
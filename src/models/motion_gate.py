@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the motion gate in front of
+# the detector. Frames are block-averaged to a small grayscale image
+# and compared against a running background model of the empty belt;
+# only frames with enough changed pixels are passed on, together with
+# the bounding box of the changed region as a crop hint.
+######################################################################
+
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Bounding box in pixel coordinates (x1, y1, x2, y2)
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class GateStats:
+    """Counters of the motion gate."""
+
+    frames: int = 0
+    skipped: int = 0
+    active_area: float = 0.0
+
+    def summary(self) -> Dict[str, float]:
+        """Return the counters and the share of skipped frames."""
+        active = self.frames - self.skipped
+        return {
+            "frames": self.frames,
+            "skipped": self.skipped,
+            "active": active,
+            "skip_ratio": self.skipped / self.frames if self.frames else 0.0,
+            "mean_active_area": self.active_area / active if active else 0.0,
+        }
+
+
+class MotionGate:
+    """Skips frames of the empty conveyor belt by differencing against a running background model.
+
+    Frames are reduced to grayscale blocks of ``scale`` x ``scale`` pixels. A block counts as changed when it
+    differs from the background by more than ``pixel_threshold`` gray levels, and a frame is active when the
+    changed blocks cover at least ``min_area`` of the frame. The background is a running average with
+    ``learning_rate`` that only learns blocks which are static with respect to the previous frame: passing
+    bricks never fade into the background, while ghosts of bricks that were present when the background was
+    initialized disappear after a few frames. The first frame initializes the background and is skipped.
+    """
+
+    def __init__(
+        self,
+        scale: int = 8,
+        pixel_threshold: float = 25.0,
+        min_area: float = 0.002,
+        learning_rate: float = 0.05,
+        margin: int = 1,
+    ):
+        """Initialize the gate.
+
+        :param scale: Edge length of the averaged pixel blocks (default: 8)
+        :param pixel_threshold: Gray-level difference above which a block counts as changed (default: 25.0)
+        :param min_area: Fraction of changed blocks above which a frame is active (default: 0.002)
+        :param learning_rate: Weight of a new frame in the running background average (default: 0.05)
+        :param margin: Number of blocks the crop hint is grown by on each side (default: 1)
+        """
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.min_area = min_area
+        self.learning_rate = learning_rate
+        self.margin = margin
+        self.background: Optional[np.ndarray] = None
+        self.previous: Optional[np.ndarray] = None
+        self.stats = GateStats()
+
+    def downsample(self, image: np.ndarray) -> np.ndarray:
+        """Reduce a frame to the grayscale block means used for differencing.
+
+        :param image: Frame in (H, W) or (H, W, C) layout
+        :return: Float32 array of shape (H // scale, W // scale)
+        """
+        if image.ndim == 2:
+            image = image[..., None]
+        scale, channels = self.scale, image.shape[2]
+        height, width = image.shape[0] // scale, image.shape[1] // scale
+
+        # Sum the rows of each block first, over contiguous memory and in a narrow integer type, then the
+        # columns and channels; this is several times faster than one mean over a 5-D view
+        rows = image[: height * scale, : width * scale].reshape(height, scale, width * scale * channels)
+        rows = rows.sum(axis=1, dtype=np.uint16 if scale * 255 <= np.iinfo(np.uint16).max else np.uint32)
+        blocks = rows.reshape(height, width, scale * channels).sum(axis=2, dtype=np.uint32)
+        return blocks.astype(np.float32) / np.float32(scale * scale * channels)
+
+    def update(self, image: np.ndarray) -> Optional[Box]:
+        """Update the background with a frame and decide whether the frame reaches the detector.
+
+        :param image: Frame in (H, W) or (H, W, C) layout
+        :return: Crop hint (x1, y1, x2, y2) covering the changed region in frame pixels, or None to skip the frame
+        """
+        small = self.downsample(image)
+        self.stats.frames += 1
+
+        if self.background is None or self.background.shape != small.shape:
+            self.background, self.previous = small, small
+            self.stats.skipped += 1
+            return None
+
+        changed = np.abs(small - self.background) > self.pixel_threshold
+
+        # Selective running average: blocks that moved since the previous frame are not learned
+        static = np.abs(small - self.previous) <= self.pixel_threshold
+        self.background += np.where(static, self.learning_rate * (small - self.background), 0.0).astype(np.float32)
+        self.previous = small
+
+        area = float(changed.mean())
+        if area < self.min_area:
+            self.stats.skipped += 1
+            return None
+
+        self.stats.active_area += area
+        rows = np.flatnonzero(changed.any(axis=1))
+        cols = np.flatnonzero(changed.any(axis=0))
+        y1 = max(int(rows[0]) - self.margin, 0) * self.scale
+        x1 = max(int(cols[0]) - self.margin, 0) * self.scale
+        y2 = min((int(rows[-1]) + 1 + self.margin) * self.scale, image.shape[0])
+        x2 = min((int(cols[-1]) + 1 + self.margin) * self.scale, image.shape[1])
+
+        # The blocks cut off at the right and bottom edge belong to the last changed block row or column
+        if rows[-1] == changed.shape[0] - 1:
+            y2 = image.shape[0]
+        if cols[-1] == changed.shape[1] - 1:
+            x2 = image.shape[1]
+
+        return x1, y1, x2, y2
+
+    def reset(self) -> None:
+        """Forget the background model and the counters, e.g. after the camera was moved."""
+        self.background = None
+        self.previous = None
+        self.stats = GateStats()
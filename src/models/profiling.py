@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains low-overhead instruments
+# for the training loop: a wall-time accumulator per training stage
+# and a helper that wraps a number of steps in torch.profiler and
+# writes a Chrome trace.
+######################################################################
+
+import contextlib
+import json
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Union
+
+import torch
+
+
+class StageTimer:
+    """Accumulates the wall time spent in named stages (data wait, forward, backward, ...).
+
+    Each measurement costs two ``perf_counter`` calls and a dictionary update. On asynchronous devices, the
+    optional synchronize callback is invoked before every reading, which makes the timings exact at the cost of
+    a synchronization per stage.
+    """
+
+    def __init__(self, synchronize: Optional[Callable[[], None]] = None, enabled: bool = True):
+        """Initialize the timer.
+
+        :param synchronize: Callback that waits for pending device work, e.g. torch.cuda.synchronize
+        :param enabled: Flag to record measurements; a disabled timer only yields (default: True)
+        """
+        self.synchronize = synchronize
+        self.enabled = enabled
+        self._totals: Dict[str, List[float]] = {}
+
+    @contextlib.contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Measure the wall time of the enclosed block.
+
+        :param name: Name of the stage
+        """
+        if not self.enabled:
+            yield
+            return
+
+        if self.synchronize is not None:
+            self.synchronize()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.synchronize is not None:
+                self.synchronize()
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add a measurement to a stage.
+
+        :param name: Name of the stage
+        :param seconds: Measured wall time
+        """
+        totals = self._totals.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Return total seconds, number of measurements and mean milliseconds per stage."""
+        return {
+            name: {"total_s": total, "count": count, "mean_ms": 1000 * total / count if count else 0.0}
+            for name, (total, count) in self._totals.items()
+        }
+
+    def flat(self, prefix: str = "time") -> Dict[str, float]:
+        """Return the total seconds per stage as flat metrics, e.g. for wandb.log."""
+        return {f"{prefix}/{name}_s": total for name, (total, _) in self._totals.items()}
+
+    def reset(self) -> None:
+        """Discard all measurements."""
+        self._totals.clear()
+
+
+def chrome_trace_profiler(
+    trace_path: Union[str, Path], active_steps: int, warmup_steps: int = 1, cuda: bool = False
+) -> torch.profiler.profile:
+    """Create a torch profiler that records active_steps steps and writes them as Chrome trace.
+
+    The returned profiler has to be entered as context manager and stepped with ``step()`` once per training
+    step. Steps after the active window are not recorded.
+
+    :param trace_path: Path of the Chrome trace JSON file
+    :param active_steps: Number of recorded steps
+    :param warmup_steps: Number of steps that are run with the profiler but discarded (default: 1)
+    :param cuda: Flag to record CUDA activity as well (default: False)
+    :return: Configured profiler
+    """
+    trace_path = Path(trace_path)
+    trace_path.parent.mkdir(parents=True, exist_ok=True)
+
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if cuda:
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+
+    def export(profiler: torch.profiler.profile) -> None:
+        profiler.export_chrome_trace(str(trace_path))
+        print(f"[INFO] Wrote Chrome trace of {active_steps} steps to {trace_path}")
+
+    return torch.profiler.profile(
+        activities=activities,
+        schedule=torch.profiler.schedule(wait=0, warmup=warmup_steps, active=active_steps, repeat=1),
+        on_trace_ready=export,
+        record_shapes=True,
+    )
+
+
+def write_json(path: Union[str, Path], records: Any) -> None:
+    """Write profiling aggregates to a JSON file.
+
+    :param path: Path of the JSON file
+    :param records: JSON-serializable aggregates
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as file:
+        json.dump(records, file, indent=2)
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains the incremental support-set
+# store. Reference images and their embeddings are persisted per
+# product and keyed by the hash of the model checkpoint that produced
+# them, so an order changeover only generates and embeds the products
+# that have not been seen before with the current model.
+######################################################################
+
+import hashlib
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+import numpy as np
+from torch import nn
+
+from data.synthetic_cache import SyntheticDataCache
+from models.inference import EmbeddingIndex, embed_images, load_backbone
+
+
+def checkpoint_hash(checkpoint_path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """Hash the contents of a model checkpoint.
+
+    :param checkpoint_path: Path of the checkpoint file
+    :param chunk_size: Number of bytes read at once (default: 1 MiB)
+    :return: Hex digest identifying the checkpoint
+    """
+    digest = hashlib.sha256()
+    with open(checkpoint_path, "rb") as file:
+        while chunk := file.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()[:24]
+
+
+class SupportSetStore:
+    """Persistent per-product support-set embeddings that are reused across orders.
+
+    The reference images are held by a SyntheticDataCache. The embeddings live in one directory per checkpoint
+    hash, as ``product-<id>-<data key>.npy``, where the data key identifies the generation parameters. Products
+    with an embedding file for the current checkpoint and parameters are reused; only the others are
+    generated and embedded. Opening the store with a new checkpoint removes the embeddings of all other
+    checkpoints, because they are incompatible with the new model. A checkpoint file that is replaced while the
+    store is open, e.g. by a retraining run, is detected by its modification time and size and handled the
+    same way the next time embeddings are requested.
+    """
+
+    def __init__(  # noqa
+        self,
+        root: Union[str, Path],
+        checkpoint_path: Union[str, Path],
+        params: Dict[str, Any],
+        data_cache: Optional[SyntheticDataCache] = None,
+        backbone: Optional[nn.Module] = None,
+        batch_size: int = 64,
+        device: str = "cpu",
+        n_workers: int = 1,
+    ):
+        """Initialize the store and drop the embeddings of other checkpoints.
+
+        :param root: Directory of the embeddings (and the reference images if no data cache is given)
+        :param checkpoint_path: Path of the checkpoint the backbone is loaded from
+        :param params: Dictionary containing the generation parameters of the reference images
+        :param data_cache: Cache of the reference images (default: None, i.e. a cache in root/images)
+        :param backbone: Backbone loaded from checkpoint_path; loaded lazily when first needed if omitted, and
+            reloaded from the new checkpoint once the checkpoint file changed
+        :param batch_size: Number of images embedded per forward pass (default: 64)
+        :param device: Device the forward passes run on (default: "cpu")
+        :param n_workers: Number of worker processes generating missing reference images (default: 1)
+        """
+        self.root = Path(root)
+        self.checkpoint_path = Path(checkpoint_path)
+        self.params = params
+        self.data_cache = data_cache or SyntheticDataCache(self.root / "images")
+        self.batch_size = batch_size
+        self.device = device
+        self.n_workers = n_workers
+        self._backbone = backbone
+        # Reentrant, because loading the backbone first makes sure that the checkpoint hash is up to date
+        self._checkpoint_lock = threading.RLock()
+
+        self._checkpoint_stat = self._stat_checkpoint()
+        self.checkpoint = checkpoint_hash(self.checkpoint_path)
+        self.directory = self.root / "embeddings" / self.checkpoint
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.invalidate_stale()
+
+        self._embeddings: Dict[int, np.ndarray] = {}
+        self.last_changeover: Dict[str, Any] = {}
+
+    def _stat_checkpoint(self) -> Tuple[int, int]:
+        stat = self.checkpoint_path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    def refresh_checkpoint(self) -> bool:
+        """Switch to the new contents of the checkpoint file if it changed since it was hashed.
+
+        The embeddings of the previous checkpoint are removed, and the backbone is reloaded when it is needed next.
+
+        :return: True if the checkpoint contents changed
+        """
+        with self._checkpoint_lock:
+            # The file is only hashed again if its modification time or size changed
+            stat = self._stat_checkpoint()
+            if stat == self._checkpoint_stat:
+                return False
+            self._checkpoint_stat = stat
+
+            checkpoint = checkpoint_hash(self.checkpoint_path)
+            if checkpoint == self.checkpoint:
+                return False
+
+            print(f"[INFO] Checkpoint {self.checkpoint_path} changed, switching embeddings to {checkpoint}")
+            self.checkpoint = checkpoint
+            self.directory = self.root / "embeddings" / self.checkpoint
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self._embeddings.clear()
+            self._backbone = None
+            self.invalidate_stale()
+        return True
+
+    @property
+    def backbone(self) -> nn.Module:
+        """Backbone of the current checkpoint, loaded on first use."""
+        # Products of one order may be embedded from several threads, which must share one backbone
+        with self._checkpoint_lock:
+            if self._backbone is None:
+                # The loaded weights must be the ones the embeddings directory is keyed by
+                self.refresh_checkpoint()
+                self._backbone = load_backbone(self.checkpoint_path, device=self.device)
+        return self._backbone
+
+    def path_for(self, product_id: int) -> Path:
+        """Return the embedding file of a product for the current checkpoint and generation parameters."""
+        return self.directory / f"product-{product_id}-{SyntheticDataCache.cache_key(product_id, self.params)}.npy"
+
+    def status(self, product_ids: Iterable[int]) -> Dict[int, Dict[str, bool]]:
+        """Report which products already have reference images and embeddings.
+
+        :param product_ids: Product IDs to check
+        :return: Dictionary mapping each product ID to the flags 'images' and 'embeddings'
+        """
+        return {
+            product_id: {
+                "images": self.data_cache.path_for(product_id, self.params).exists(),
+                "embeddings": product_id in self._embeddings or self.path_for(product_id).exists(),
+            }
+            for product_id in product_ids
+        }
+
+    def _load(self, product_id: int) -> Optional[np.ndarray]:
+        if product_id in self._embeddings:
+            return self._embeddings[product_id]
+        try:
+            embeddings = np.load(self.path_for(product_id))
+        except (FileNotFoundError, ValueError):
+            return None
+        self._embeddings[product_id] = embeddings
+        return embeddings
+
+    def _store(self, product_id: int, embeddings: np.ndarray) -> None:
+        # Write into a temporary file first, so concurrent readers never see a partial entry
+        tmp_path = self.directory / f".tmp-{uuid.uuid4().hex}.npy"
+        try:
+            np.save(tmp_path, embeddings)
+            os.replace(tmp_path, self.path_for(product_id))
+        finally:
+            tmp_path.unlink(missing_ok=True)
+        self._embeddings[product_id] = embeddings
+
+    def embeddings_for(self, product_ids: Iterable[int], show_progress: bool = False) -> Dict[int, np.ndarray]:
+        """Return the support-set embeddings of all products, computing only the missing ones.
+
+        :param product_ids: Product IDs of the order
+        :param show_progress: Flag to show the progress bar of the image generation (default: False)
+        :return: Dictionary mapping product IDs to L2-normalized float32 embeddings of shape (n_images, D)
+        """
+        start = time.perf_counter()
+        product_ids = list(dict.fromkeys(int(product_id) for product_id in product_ids))
+        self.refresh_checkpoint()
+
+        embeddings = {product_id: self._load(product_id) for product_id in product_ids}
+        missing = [product_id for product_id, vectors in embeddings.items() if vectors is None]
+
+        if missing:
+            # The data cache itself only generates the images of products it has not seen before
+            images = self.data_cache.load_or_generate(missing, self.params, show_progress, self.n_workers)
+            for product_id in missing:
+                vectors = embed_images(self.backbone, images[product_id], self.batch_size, self.device)
+                self._store(product_id, vectors)
+                embeddings[product_id] = vectors
+
+        self.last_changeover = {
+            "products": len(product_ids),
+            "reused": len(product_ids) - len(missing),
+            "embedded": len(missing),
+            "seconds": time.perf_counter() - start,
+        }
+        return embeddings
+
+    def build_index(
+        self, product_ids: Iterable[int], quantize: bool = False, prototypes: bool = False, max_distance: float = 0.5
+    ) -> EmbeddingIndex:
+        """Build the embedding index of an order, reusing the stored embeddings of known products.
+
+        :param product_ids: Product IDs of the order
+        :param quantize: Flag to store the embeddings as int8 codes (default: False)
+        :param prototypes: Flag to keep only one mean embedding per product (default: False)
+        :param max_distance: Cosine distance above which a query is labelled as redundant brick (default: 0.5)
+        :return: Embedding index of the order's support set
+        """
+        embeddings = self.embeddings_for(product_ids)
+        return EmbeddingIndex.from_embeddings(
+            embeddings, quantize=quantize, prototypes=prototypes, max_distance=max_distance
+        )
+
+    def invalidate_stale(self) -> List[Path]:
+        """Delete the embeddings of all checkpoints other than the current one.
+
+        :return: List of removed checkpoint directories
+        """
+        stale = [path for path in self.directory.parent.iterdir() if path.is_dir() and path != self.directory]
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
+        return stale
+
+    def invalidate(self, product_id: Optional[int] = None) -> int:
+        """Delete the embeddings of one product or of all products for the current checkpoint.
+
+        :param product_id: Product ID whose embeddings are removed (default: None, i.e. all products)
+        :return: Number of removed entries
+        """
+        pattern = f"product-{product_id}-*.npy" if product_id is not None else "product-*.npy"
+        removed = 0
+        for path in self.directory.glob(pattern):
+            path.unlink(missing_ok=True)
+            removed += 1
+
+        if product_id is None:
+            self._embeddings.clear()
+        else:
+            self._embeddings.pop(product_id, None)
+        return removed
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    import torch
+
+    from models.inference import load_classifier
+
+    # Example usage with an untrained checkpoint; pass the best checkpoint path in production
+    params = {"height": 64, "width": 64, "channels": 3, "n_images": 16, "dtype": np.uint8, "seed": 42}
+
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_path = Path(directory) / "model.pth"
+        torch.save({"model_state_dict": load_classifier(num_classes=4).state_dict()}, checkpoint_path)
+
+        store = SupportSetStore(Path(directory) / "support_set", checkpoint_path, params)
+        for order in ([1, 2, 3], [2, 3, 4], [1, 4]):
+            index = store.build_index(order, prototypes=True)
+            print(f"[INFO] Order {order}: {store.last_changeover}")
@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+######################################################################
+# Author: David Anthony Parham
+#
+# Module Description: This script contains a lightweight IoU tracker
+# that sits between detection and the support-set matching. Boxes are
+# associated across frames with a vectorized IoU matrix, every track
+# caches its label and confidence, crops are only re-classified when
+# the confidence is low or the appearance changed, and every track
+# emits exactly one recognition event, an unresolved one if none of
+# its classifications ever arrived.
+######################################################################
+
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from models.inference import REDUNDANT_BRICK
+from models.motion_gate import Box
+
+# Label codes of the track arrays; product IDs are stored as they are
+_UNKNOWN = -2
+_REDUNDANT = -1
+
+
+def iou_matrix(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Compute the intersection over union of all pairs of boxes.
+
+    :param boxes_a: Boxes (x1, y1, x2, y2) of shape (N, 4)
+    :param boxes_b: Boxes (x1, y1, x2, y2) of shape (M, 4)
+    :return: IoU matrix of shape (N, M)
+    """
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(1, -1, 4)
+
+    width = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    height = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = width * height
+
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, np.finfo(np.float32).tiny)
+
+
+def appearance(image: np.ndarray, box: Box, grid: int = 6) -> np.ndarray:
+    """Describe the content of a box by a coarse grid of sampled pixels.
+
+    :param image: Frame in (H, W, C) layout
+    :param box: Bounding box (x1, y1, x2, y2)
+    :param grid: Number of sampled rows and columns (default: 6)
+    :return: Float32 vector of grid * grid * C values in [0, 1]
+    """
+    x1, y1, x2, y2 = box
+    rows = np.linspace(y1, max(y1, y2 - 1), grid).astype(np.intp)
+    cols = np.linspace(x1, max(x1, x2 - 1), grid).astype(np.intp)
+    return image[np.ix_(rows, cols)].reshape(-1).astype(np.float32) / 255.0
+
+
+@dataclass
+class TrackEvent:
+    """The single recognition of a track; the label is None if the track was never classified."""
+
+    track_id: int
+    label: Optional[Union[int, str]]
+    confidence: float
+    frame_index: int
+    captured_at: float
+    box: Box
+
+
+class TrackUpdate(NamedTuple):
+    """Result of associating the detections of one frame."""
+
+    track_ids: np.ndarray
+    classify: np.ndarray
+    events: List[TrackEvent]
+
+
+class IouTracker:
+    """Associates detections across frames and caches one classification per track.
+
+    All track state lives in parallel NumPy arrays of the active tracks, so associating dozens of tracks
+    costs one IoU matrix and a few vectorized updates per frame. Detections are matched greedily in order of
+    descending IoU. A detection is sent to classification when its track is new, when the cached confidence
+    is below ``min_confidence`` or when its appearance moved further than ``appearance_threshold`` from the
+    appearance of the last classification, and only while no classification of the track is in flight.
+
+    The confidence of a product label is the cosine similarity to its nearest support-set embedding; the
+    confidence of a redundant brick is the cosine distance to the nearest product. A track emits its event as
+    soon as its confidence reaches ``min_confidence``, or with its best label when it ends without ever
+    getting there, so each physical brick is counted exactly once.
+
+    A classification that never arrives, e.g. because a full queue dropped the crop, must not block its track.
+    The pipeline reports dropped crops with release, and any request older than ``max_pending_frames`` frames
+    expires, so the next detection of the track is classified again. A track that ends without any label emits
+    an unresolved event (label None, confidence 0) once its last request was released or expired, or when the
+    tracker is flushed. The tracker is thread-safe, so detection and matching can run in different pipeline
+    stages.
+    """
+
+    __slots__ = (
+        "_awaiting",
+        "_lock",
+        "_next_id",
+        "appearance_threshold",
+        "boxes",
+        "captured_at",
+        "confidences",
+        "emitted",
+        "frame_indices",
+        "ids",
+        "iou_threshold",
+        "labels",
+        "max_awaiting",
+        "max_missed",
+        "max_pending_frames",
+        "min_confidence",
+        "missed",
+        "pending",
+        "requested",
+        "signatures",
+        "stats",
+    )
+
+    def __init__(  # noqa
+        self,
+        iou_threshold: float = 0.3,
+        max_missed: int = 5,
+        min_confidence: float = 0.8,
+        appearance_threshold: float = 0.15,
+        max_awaiting: int = 1024,
+        max_pending_frames: int = 30,
+    ):
+        """Initialize the tracker.
+
+        :param iou_threshold: Minimum IoU of a detection with the last box of a track to continue it (default: 0.3)
+        :param max_missed: Number of consecutive frames a track may go undetected before it ends (default: 5)
+        :param min_confidence: Confidence at which a label is settled and emitted (default: 0.8)
+        :param appearance_threshold: Mean absolute change of the appearance that triggers a re-classification
+            (default: 0.15)
+        :param max_awaiting: Maximum number of ended tracks that wait for an in-flight classification; the
+            oldest ones are emitted as unresolved beyond it (default: 1024)
+        :param max_pending_frames: Number of frames after which an unanswered classification request expires
+            (default: 30)
+        """
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.min_confidence = min_confidence
+        self.appearance_threshold = appearance_threshold
+        self.max_awaiting = max_awaiting
+        self.max_pending_frames = max_pending_frames
+
+        self.ids = np.empty(0, dtype=np.int64)
+        self.boxes = np.empty((0, 4), dtype=np.float32)
+        self.signatures = np.empty((0, 0), dtype=np.float32)
+        self.labels = np.empty(0, dtype=np.int64)
+        self.confidences = np.empty(0, dtype=np.float32)
+        self.missed = np.empty(0, dtype=np.int32)
+        self.pending = np.empty(0, dtype=bool)
+        self.requested = np.empty(0, dtype=np.int64)
+        self.emitted = np.empty(0, dtype=bool)
+        self.frame_indices = np.empty(0, dtype=np.int64)
+        self.captured_at = np.empty(0, dtype=np.float64)
+
+        self._next_id = 0
+        # Ended tracks whose first classification is in flight: track ID -> (frame index, capture time, box,
+        # frame index of the request)
+        self._awaiting: "OrderedDict[int, Tuple[int, float, Box, int]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"tracks": 0, "detections": 0, "classified": 0, "events": 0, "released": 0, "unresolved": 0}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _event(self, row: int) -> TrackEvent:
+        label = int(self.labels[row])
+        self.emitted[row] = True
+        if label == _UNKNOWN:
+            return self._unresolved(int(self.ids[row]), *self._last_seen(row))
+
+        self.stats["events"] += 1
+        return TrackEvent(
+            int(self.ids[row]),
+            REDUNDANT_BRICK if label == _REDUNDANT else label,
+            float(self.confidences[row]),
+            int(self.frame_indices[row]),
+            float(self.captured_at[row]),
+            tuple(int(value) for value in self.boxes[row]),
+        )
+
+    def _last_seen(self, row: int) -> Tuple[int, float, Box]:
+        return (
+            int(self.frame_indices[row]),
+            float(self.captured_at[row]),
+            tuple(int(value) for value in self.boxes[row]),
+        )
+
+    def _unresolved(self, track_id: int, frame_index: int, captured_at: float, box: Box, *_: int) -> TrackEvent:
+        self.stats["events"] += 1
+        self.stats["unresolved"] += 1
+        return TrackEvent(track_id, None, 0.0, frame_index, captured_at, box)
+
+    def _associate(self, boxes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Greedily match detections to tracks in order of descending IoU; returns (detection, track) rows."""
+        if not len(boxes) or not len(self.ids):
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+
+        iou = iou_matrix(boxes, self.boxes)
+        detections, tracks = np.nonzero(iou >= self.iou_threshold)
+        order = np.argsort(-iou[detections, tracks], kind="stable")
+
+        used_detections = np.zeros(len(boxes), dtype=bool)
+        used_tracks = np.zeros(len(self.ids), dtype=bool)
+        matched = []
+        for detection, track in zip(detections[order], tracks[order], strict=True):
+            if not used_detections[detection] and not used_tracks[track]:
+                used_detections[detection] = used_tracks[track] = True
+                matched.append((detection, track))
+
+        if not matched:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        pairs = np.asarray(matched, dtype=np.intp)
+        return pairs[:, 0], pairs[:, 1]
+
+    def update(self, boxes: Sequence[Box], signatures: np.ndarray, frame_index: int, captured_at: float) -> TrackUpdate:
+        """Associate the detections of a frame with the active tracks.
+
+        :param boxes: Detected boxes (x1, y1, x2, y2) of the frame
+        :param signatures: Appearance vectors of the detections, e.g. from appearance(), of shape (N, D)
+        :param frame_index: Index of the frame
+        :param captured_at: Capture time of the frame
+        :return: Track ID and classification flag of every detection, plus the events of tracks that ended
+        """
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        signatures = np.asarray(signatures, dtype=np.float32).reshape(len(boxes), -1 if len(boxes) else 0)
+
+        with self._lock:
+            if not len(self.ids):
+                # The signature length is taken from the detections whenever no track is active
+                self.signatures = np.empty((0, signatures.shape[1]), dtype=np.float32)
+            self.stats["detections"] += len(boxes)
+
+            detection_rows, track_rows = self._associate(boxes)
+            track_ids = np.empty(len(boxes), dtype=np.int64)
+            classify = np.zeros(len(boxes), dtype=bool)
+
+            # Requests without an answer for max_pending_frames frames are considered lost
+            self.pending &= frame_index - self.requested <= self.max_pending_frames
+            events = self._expire_awaiting(frame_index)
+
+            # Continued tracks: decide whether the cached label is still trusted
+            if len(track_rows):
+                changed = np.abs(signatures[detection_rows] - self.signatures[track_rows]).mean(axis=1)
+                unsure = (self.confidences[track_rows] < self.min_confidence) | (changed > self.appearance_threshold)
+                reclassify = unsure & ~self.pending[track_rows]
+
+                track_ids[detection_rows] = self.ids[track_rows]
+                classify[detection_rows] = reclassify
+                self.boxes[track_rows] = boxes[detection_rows]
+                self.signatures[track_rows[reclassify]] = signatures[detection_rows[reclassify]]
+                self.pending[track_rows[reclassify]] = True
+                self.requested[track_rows[reclassify]] = frame_index
+                self.missed[track_rows] = 0
+                self.frame_indices[track_rows] = frame_index
+                self.captured_at[track_rows] = captured_at
+
+            # Unmatched tracks age and end after max_missed frames
+            seen = np.zeros(len(self.ids), dtype=bool)
+            seen[track_rows] = True
+            self.missed[~seen] += 1
+            events += self._retire(self.missed > self.max_missed)
+
+            # Unmatched detections start new tracks, which are always classified
+            new = np.ones(len(boxes), dtype=bool)
+            new[detection_rows] = False
+            n_new = int(new.sum())
+            if n_new:
+                new_ids = np.arange(self._next_id, self._next_id + n_new, dtype=np.int64)
+                self._next_id += n_new
+                self.stats["tracks"] += n_new
+                track_ids[new] = new_ids
+                classify[new] = True
+                self._append(new_ids, boxes[new], signatures[new], frame_index, captured_at)
+
+            self.stats["classified"] += int(classify.sum())
+            return TrackUpdate(track_ids, classify, events)
+
+    def _append(
+        self, ids: np.ndarray, boxes: np.ndarray, signatures: np.ndarray, frame_index: int, captured_at: float
+    ) -> None:
+        n = len(ids)
+        self.ids = np.concatenate([self.ids, ids])
+        self.boxes = np.concatenate([self.boxes, boxes])
+        self.signatures = np.concatenate([self.signatures, signatures])
+        self.labels = np.concatenate([self.labels, np.full(n, _UNKNOWN, dtype=np.int64)])
+        self.confidences = np.concatenate([self.confidences, np.zeros(n, dtype=np.float32)])
+        self.missed = np.concatenate([self.missed, np.zeros(n, dtype=np.int32)])
+        self.pending = np.concatenate([self.pending, np.ones(n, dtype=bool)])
+        self.requested = np.concatenate([self.requested, np.full(n, frame_index, dtype=np.int64)])
+        self.emitted = np.concatenate([self.emitted, np.zeros(n, dtype=bool)])
+        self.frame_indices = np.concatenate([self.frame_indices, np.full(n, frame_index, dtype=np.int64)])
+        self.captured_at = np.concatenate([self.captured_at, np.full(n, captured_at, dtype=np.float64)])
+
+    def _retire(self, ended: np.ndarray) -> List[TrackEvent]:
+        """Remove ended tracks and emit the event of those that never settled their label."""
+        events = []
+        for row in np.flatnonzero(ended & ~self.emitted):
+            if self.labels[row] != _UNKNOWN or not self.pending[row]:
+                events.append(self._event(row))
+            else:
+                # The first classification is still in flight; observe emits the event when it arrives
+                self._awaiting[int(self.ids[row])] = (*self._last_seen(row), int(self.requested[row]))
+                while len(self._awaiting) > self.max_awaiting:
+                    track_id, awaiting = self._awaiting.popitem(last=False)
+                    events.append(self._unresolved(track_id, *awaiting))
+
+        if ended.any():
+            keep = ~ended
+            for name in ("ids", "boxes", "signatures", "labels", "confidences", "missed", "pending", "requested"):
+                setattr(self, name, getattr(self, name)[keep])
+            self.emitted = self.emitted[keep]
+            self.frame_indices = self.frame_indices[keep]
+            self.captured_at = self.captured_at[keep]
+        return events
+
+    def _expire_awaiting(self, frame_index: int) -> List[TrackEvent]:
+        """Emit the ended tracks whose classification request expired as unresolved."""
+        expired = [
+            track_id
+            for track_id, (*_, requested) in self._awaiting.items()
+            if frame_index - requested > self.max_pending_frames
+        ]
+        return [self._unresolved(track_id, *self._awaiting.pop(track_id)) for track_id in expired]
+
+    def release(self, track_ids: Sequence[int]) -> List[TrackEvent]:
+        """Give up the in-flight classifications of tracks, e.g. because their crops were dropped.
+
+        Active tracks are classified again at their next detection; ended tracks without a label are emitted as
+        unresolved.
+
+        :param track_ids: Track IDs of the dropped crops
+        :return: Unresolved events of ended tracks
+        """
+        events = []
+        with self._lock:
+            rows = {int(track_id): row for row, track_id in enumerate(self.ids)}
+            for track_id in track_ids:
+                self.stats["released"] += 1
+                if (row := rows.get(int(track_id))) is not None:
+                    self.pending[row] = False
+                elif (awaiting := self._awaiting.pop(int(track_id), None)) is not None:
+                    events.append(self._unresolved(int(track_id), *awaiting))
+        return events
+
+    def observe(
+        self, track_ids: Sequence[int], labels: Sequence[Union[int, str]], confidences: Sequence[float]
+    ) -> List[TrackEvent]:
+        """Cache the classification results of tracks.
+
+        A track keeps its label if it is observed again; a different label replaces it only with a higher
+        confidence.
+
+        :param track_ids: Track IDs of the classified detections
+        :param labels: Product ID or REDUNDANT_BRICK per detection
+        :param confidences: Confidence per detection
+        :return: Events of the tracks whose label settled with this observation
+        """
+        events = []
+        with self._lock:
+            rows = {int(track_id): row for row, track_id in enumerate(self.ids)}
+            for track_id, label, confidence in zip(track_ids, labels, confidences, strict=True):
+                code = _REDUNDANT if label == REDUNDANT_BRICK else int(label)
+                row = rows.get(int(track_id))
+
+                if row is None:
+                    # The track ended while its first classification was in flight
+                    if (awaiting := self._awaiting.pop(int(track_id), None)) is not None:
+                        frame_index, captured_at, box, _ = awaiting
+                        self.stats["events"] += 1
+                        events.append(
+                            TrackEvent(int(track_id), label, float(confidence), frame_index, captured_at, box)
+                        )
+                    continue
+
+                self.pending[row] = False
+                if code == self.labels[row]:
+                    self.confidences[row] = max(self.confidences[row], confidence)
+                elif self.labels[row] == _UNKNOWN or confidence > self.confidences[row]:
+                    self.labels[row] = code
+                    self.confidences[row] = confidence
+
+                if not self.emitted[row] and self.confidences[row] >= self.min_confidence:
+                    events.append(self._event(row))
+        return events
+
+    def flush(self) -> List[TrackEvent]:
+        """End all tracks, e.g. at the end of a stream, and return the events that were not emitted yet.
+
+        Tracks whose classification is still in flight are emitted as unresolved, so results that arrive
+        afterwards are ignored.
+        """
+        with self._lock:
+            events = self._retire(np.ones(len(self.ids), dtype=bool))
+            while self._awaiting:
+                track_id, awaiting = self._awaiting.popitem(last=False)
+                events.append(self._unresolved(track_id, *awaiting))
+        return events
+
+    def summary(self) -> Dict[str, float]:
+        """Return the counters and the share of detections that skipped classification."""
+        with self._lock:
+            detections = self.stats["detections"]
+            return {
+                **self.stats,
+                "active": len(self.ids),
+                "skip_ratio": 1.0 - self.stats["classified"] / detections if detections else 0.0,
+            }
@@ -2,8 +2,561 @@
 ######################################################################
 # Author: David Anthony Parham
 #
-# Module Description: This script is not functional. It is intended to
-# initialize a video stream and perform real-time image recognition.
+# Module Description: This script initializes a video stream and
+# performs real-time image recognition. Capture, detection, embedding
+# and matching run as concurrent stages that are linked by bounded
+# drop-oldest queues, so capture never blocks and latency stays bounded.
+# A directory of images or the synthetic data generator act as stand-in
+# frame sources until the conveyor cameras are connected.
 ######################################################################
 
-NotImplemented
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from PIL import Image
+from torch import nn
+
+from data.synthetic_data import generate_synthetic_sample
+from models.inference import EmbeddingIndex, embed_images
+from models.motion_gate import Box, MotionGate
+from models.tracker import IouTracker, TrackEvent, appearance
+
+
+@dataclass
+class Frame:
+    """Single frame of a video stream."""
+
+    index: int
+    captured_at: float
+    image: np.ndarray
+
+
+@dataclass
+class Crop:
+    """Detected object cut out of a frame and resized to the embedding input size."""
+
+    frame_index: int
+    captured_at: float
+    box: Box
+    image: np.ndarray
+    embedding: Optional[np.ndarray] = None
+    track_id: Optional[int] = None
+
+
+@dataclass
+class Recognition:
+    """Result of matching a detected object against the support set; the label is None for an unresolved track."""
+
+    frame_index: int
+    box: Box
+    label: Optional[Union[int, str]]
+    latency: float
+    track_id: Optional[int] = None
+    confidence: Optional[float] = None
+
+
+class DropOldestQueue:
+    """Bounded queue whose put never blocks; when full, the oldest item is dropped instead."""
+
+    def __init__(self, maxsize: int, on_drop: Optional[Callable[[Any], None]] = None):
+        """Initialize the queue.
+
+        :param maxsize: Maximum number of items
+        :param on_drop: Callback invoked with every dropped item, outside the lock of the queue (default: None)
+        """
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.dropped = 0
+        self._items: Deque[Any] = deque()
+        self._not_empty = threading.Condition()
+
+    def __len__(self):
+        with self._not_empty:
+            return len(self._items)
+
+    def put(self, item: Any) -> None:
+        """Append an item, dropping the oldest one if the queue is full."""
+        dropped = None
+        with self._not_empty:
+            if len(self._items) >= self.maxsize:
+                dropped = self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._not_empty.notify()
+
+        if dropped is not None and self.on_drop is not None:
+            self.on_drop(dropped)
+
+    def get_batch(self, max_items: int, timeout: float, max_wait: float = 0.0) -> List[Any]:
+        """Take up to max_items items.
+
+        :param max_items: Maximum number of items returned
+        :param timeout: Maximum time to wait for the first item
+        :param max_wait: Additional time to wait for more items once the first one arrived (default: 0.0)
+        :return: List of items, empty if nothing arrived within the timeout
+        """
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._items, timeout=timeout):
+                return []
+
+            # Micro-batching: give items of consecutive frames a short window to arrive
+            deadline = time.perf_counter() + max_wait
+            while len(self._items) < max_items and (remaining := deadline - time.perf_counter()) > 0:
+                self._not_empty.wait(remaining)
+
+            return [self._items.popleft() for _ in range(min(max_items, len(self._items)))]
+
+
+@dataclass
+class StageStats:
+    """Throughput counters of a pipeline stage."""
+
+    name: str
+    items: int = 0
+    batches: int = 0
+    busy: float = 0.0
+
+    def record(self, n_items: int, seconds: float) -> None:
+        """Record a processed batch."""
+        self.items += n_items
+        self.batches += 1
+        self.busy += seconds
+
+    def summary(self, elapsed: float) -> Dict[str, float]:
+        """Return throughput and utilization of the stage over the elapsed run time."""
+        return {
+            "items": self.items,
+            "items_per_s": self.items / elapsed if elapsed > 0 else 0.0,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "utilization": self.busy / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class SyntheticFrameSource:
+    """Stand-in frame source that renders synthetic frames of the given products."""
+
+    def __init__(
+        self,
+        product_ids: Sequence[int],
+        dim: Tuple[int, int, int] = (256, 256, 3),
+        n_frames: Optional[int] = None,
+        fps: Optional[float] = 30.0,
+        seed: int = 42,
+    ):
+        self.product_ids = list(product_ids)
+        self.dim = dim
+        self.n_frames = n_frames
+        self.fps = fps
+        self.seed = seed
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        index = 0
+        while self.n_frames is None or index < self.n_frames:
+            product_id = self.product_ids[index % len(self.product_ids)]
+            yield generate_synthetic_sample(product_id, index, self.dim, np.uint8, self.seed)
+            index += 1
+
+
+class ConveyorFrameSource:
+    """Stand-in frame source of a conveyor belt that is empty most of the time.
+
+    Every ``period`` frames, a synthetic brick of the next product enters on the left and crosses the belt
+    within ``travel`` frames; all other frames show the empty belt with sensor noise.
+    """
+
+    def __init__(  # noqa
+        self,
+        product_ids: Sequence[int],
+        dim: Tuple[int, int, int] = (256, 256, 3),
+        n_frames: Optional[int] = None,
+        fps: Optional[float] = 30.0,
+        period: int = 60,
+        travel: int = 15,
+        brick_size: int = 64,
+        seed: int = 42,
+    ):
+        self.product_ids = list(product_ids)
+        self.dim = dim
+        self.n_frames = n_frames
+        self.fps = fps
+        self.period = period
+        self.travel = travel
+        self.brick_size = brick_size
+        self.seed = seed
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        rng = np.random.default_rng(self.seed)
+        height, width, _ = self.dim
+        size = self.brick_size
+        step = max(1, (width - size) // max(1, self.travel - 1))
+        top = (height - size) // 2
+
+        index = 0
+        while self.n_frames is None or index < self.n_frames:
+            belt = np.full(self.dim, 90, dtype=np.int16) + rng.integers(-3, 4, size=self.dim, dtype=np.int16)
+            frame = belt.astype(np.uint8)
+
+            slot, position = divmod(index, self.period)
+            if position < self.travel:
+                product_id = self.product_ids[slot % len(self.product_ids)]
+                brick = generate_synthetic_sample(product_id, slot, (size, size, self.dim[2]), np.uint8, self.seed)
+                left = min(position * step, width - size)
+                frame[top : top + size, left : left + size] = brick
+
+            yield frame
+            index += 1
+
+
+class DirectoryFrameSource:
+    """Stand-in frame source that replays the images of a directory in file name order."""
+
+    def __init__(self, directory: Union[str, Path], fps: Optional[float] = 30.0, loop: bool = False):
+        self.paths = sorted(
+            path for path in Path(directory).iterdir() if path.suffix.lower() in {".png", ".jpg", ".jpeg", ".bmp"}
+        )
+        self.fps = fps
+        self.loop = loop
+
+        if not self.paths:
+            raise FileNotFoundError(f"No images found in {directory}")
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        while True:
+            for path in self.paths:
+                with Image.open(path) as image:
+                    yield np.asarray(image.convert("RGB"))
+            if not self.loop:
+                return
+
+
+def full_frame_detector(frames: List[np.ndarray]) -> List[List[Box]]:
+    """Stand-in detector that reports the whole frame as one object.
+
+    It is replaced by YOLO/RT-DETR in production; any callable that maps a batch of frames to a list of
+    boxes per frame can be used.
+
+    :param frames: Batch of frames in (H, W, C) layout
+    :return: One box per frame covering the full frame
+    """
+    return [[(0, 0, frame.shape[1], frame.shape[0])] for frame in frames]
+
+
+def resize_crop(image: np.ndarray, box: Box, size: Tuple[int, int]) -> np.ndarray:
+    """Cut a box out of a frame and resize it to the embedding input size.
+
+    :param image: Frame in (H, W, C) layout
+    :param box: Bounding box (x1, y1, x2, y2)
+    :param size: Output size (height, width)
+    :return: Resized uint8 crop in (H, W, C) layout
+    """
+    x1, y1, x2, y2 = box
+    crop = torch.from_numpy(np.ascontiguousarray(image[y1:y2, x1:x2])).permute(2, 0, 1)[None].float()
+    if tuple(crop.shape[-2:]) != tuple(size):
+        crop = F.interpolate(crop, size=size, mode="bilinear", align_corners=False)
+    return crop[0].permute(1, 2, 0).round().clamp(0, 255).to(torch.uint8).numpy()
+
+
+class VideoStreamRunner:
+    """Concurrent capture -> detection -> embedding -> matching pipeline."""
+
+    def __init__(  # noqa
+        self,
+        source: Any,
+        backbone: Optional[nn.Module],
+        index: EmbeddingIndex,
+        detector: Callable[[List[np.ndarray]], List[List[Box]]] = full_frame_detector,
+        crop_size: Tuple[int, int] = (224, 224),
+        queue_size: int = 8,
+        max_batch: int = 32,
+        max_wait: float = 0.01,
+        on_result: Optional[Callable[[Recognition], None]] = None,
+        device: str = "cpu",
+        embedder: Optional[Callable[[List[np.ndarray]], np.ndarray]] = None,
+        gate: Optional[MotionGate] = None,
+        tracker: Optional[IouTracker] = None,
+    ):
+        """Initialize the runner.
+
+        :param source: Iterable of frames; its optional fps attribute paces the capture
+        :param backbone: Backbone returned by load_backbone; may be None if an embedder is given
+        :param index: Embedding index of the support set
+        :param detector: Callable mapping a batch of frames to the boxes of each frame
+        :param crop_size: Input size (height, width) of the embedding model (default: (224, 224))
+        :param queue_size: Capacity of each inter-stage queue (default: 8)
+        :param max_batch: Maximum number of frames or crops per model batch (default: 32)
+        :param max_wait: Time to wait for further items of a micro-batch in seconds (default: 0.01)
+        :param on_result: Callback invoked with every recognition (default: None)
+        :param device: Device the embedding model runs on (default: "cpu")
+        :param embedder: Callable mapping a list of crops to L2-normalized embeddings, e.g. the client of a
+            shared InferenceServer; replaces the local backbone (default: None)
+        :param gate: Motion gate that skips frames without change and limits detection to the changed region
+            (default: None, i.e. every frame reaches the detector)
+        :param tracker: Tracker that associates detections across frames; only crops whose track needs a
+            (re-)classification are embedded and every track yields a single recognition (default: None, i.e.
+            every detection is embedded and reported)
+        """
+        if backbone is None and embedder is None:
+            raise ValueError("Either a backbone or an embedder is required")
+
+        self.source = source
+        self.backbone = backbone
+        self.index = index
+        self.detector = detector
+        self.crop_size = crop_size
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.on_result = on_result
+        self.device = device
+        self.embedder = embedder or (lambda crops: embed_images(self.backbone, crops, len(crops), self.device))
+        self.gate = gate
+        self.tracker = tracker
+
+        self.frames = DropOldestQueue(queue_size)
+        # Dropped crops release their tracks, which are classified again at their next detection
+        self.crops = DropOldestQueue(queue_size * max_batch, on_drop=lambda crop: self._release([crop]))
+        self.embedded = DropOldestQueue(queue_size * max_batch, on_drop=self._release)
+
+        self.stats = {name: StageStats(name) for name in ("capture", "detect", "embed", "match")}
+        self.latencies: Deque[float] = deque(maxlen=10000)
+        self.recognitions = 0
+        self._results_lock = threading.Lock()
+
+        self._stop = threading.Event()
+        self._capture_done = threading.Event()
+        self._threads: List[threading.Thread] = []
+        # First error raised by a stage, which stops the whole pipeline
+        self.error: Optional[RuntimeError] = None
+        self._started_at = 0.0
+        self._stopped_at = 0.0
+
+    def _capture(self) -> None:
+        fps = getattr(self.source, "fps", None)
+        interval = 1.0 / fps if fps else 0.0
+        next_at = time.perf_counter()
+
+        for frame_index, image in enumerate(self.source):
+            if self._stop.is_set():
+                break
+
+            start = time.perf_counter()
+            self.frames.put(Frame(frame_index, start, image))
+            self.stats["capture"].record(1, time.perf_counter() - start)
+
+            # Pace the stand-in sources like a camera would
+            if interval:
+                next_at += interval
+                time.sleep(max(0.0, next_at - time.perf_counter()))
+
+    def _run_stage(self, stage: Callable[..., None], done: Optional[threading.Event], *args: Any) -> None:
+        # A failing stage stops the pipeline, and every stage signals completion even when it fails, so the
+        # downstream stages and stop() never wait for a stage that is gone
+        try:
+            stage(*args)
+        except Exception as error:
+            with self._results_lock:
+                if self.error is None:
+                    self.error = RuntimeError(f"The {threading.current_thread().name} stage failed: {error!r}")
+                    self.error.__cause__ = error
+            self._stop.set()
+        finally:
+            if done is not None:
+                done.set()
+
+    def _drained(self, queue: DropOldestQueue, upstream: threading.Event) -> bool:
+        return self._stop.is_set() or (upstream.is_set() and not len(queue))
+
+    def _detect(self) -> None:
+        while not self._drained(self.frames, self._capture_done):
+            frames = self.frames.get_batch(self.max_batch, timeout=0.1)
+            if not frames:
+                continue
+
+            start = time.perf_counter()
+            self._detect_regions(frames)
+            self.stats["detect"].record(len(frames), time.perf_counter() - start)
+
+    def _detect_regions(self, frames: List[Frame]) -> None:
+        # Without a gate, every frame is searched as a whole
+        hints: List[Optional[Box]] = [None] * len(frames)
+        if self.gate is not None:
+            hints = [self.gate.update(frame.image) for frame in frames]
+
+        active = [(frame, hint) for frame, hint in zip(frames, hints, strict=True) if self.gate is None or hint]
+        regions = [
+            frame.image if hint is None else frame.image[hint[1] : hint[3], hint[0] : hint[2]] for frame, hint in active
+        ]
+        boxes_per_frame = iter(self.detector(regions) if regions else [])
+
+        for frame, hint in zip(frames, hints, strict=True):
+            # Frames skipped by the gate have no detections, which lets the tracks of departed bricks end
+            boxes = next(boxes_per_frame) if self.gate is None or hint else []
+            dx, dy = (hint[0], hint[1]) if hint is not None else (0, 0)
+            boxes = [(x1 + dx, y1 + dy, x2 + dx, y2 + dy) for x1, y1, x2, y2 in boxes]
+
+            if self.tracker is None:
+                for box in boxes:
+                    self.crops.put(
+                        Crop(frame.index, frame.captured_at, box, resize_crop(frame.image, box, self.crop_size))
+                    )
+                continue
+
+            signatures = np.stack([appearance(frame.image, box) for box in boxes]) if boxes else np.empty((0, 0))
+            update = self.tracker.update(boxes, signatures, frame.index, frame.captured_at)
+            for event in update.events:
+                self._emit_event(event)
+            for box, track_id, classify in zip(boxes, update.track_ids, update.classify, strict=True):
+                if classify:
+                    crop = resize_crop(frame.image, box, self.crop_size)
+                    self.crops.put(Crop(frame.index, frame.captured_at, box, crop, track_id=int(track_id)))
+
+    def _embed(self, upstream: threading.Event) -> None:
+        while not self._drained(self.crops, upstream):
+            crops = self.crops.get_batch(self.max_batch, timeout=0.1, max_wait=self.max_wait)
+            if not crops:
+                continue
+
+            start = time.perf_counter()
+            embeddings = self.embedder([crop.image for crop in crops])
+            for crop, embedding in zip(crops, embeddings, strict=True):
+                crop.embedding = embedding
+            self.embedded.put(crops)
+            self.stats["embed"].record(len(crops), time.perf_counter() - start)
+
+    def _match(self, upstream: threading.Event) -> None:
+        while not self._drained(self.embedded, upstream):
+            batches = self.embedded.get_batch(self.max_batch, timeout=0.1)
+            crops = [crop for batch in batches for crop in batch]
+            if not crops:
+                continue
+
+            start = time.perf_counter()
+            labels, confidences = self.index.classify(np.stack([crop.embedding for crop in crops]))
+            if self.tracker is None:
+                for crop, label, confidence in zip(crops, labels, confidences, strict=True):
+                    latency = time.perf_counter() - crop.captured_at
+                    self._emit(Recognition(crop.frame_index, crop.box, label, latency, confidence=float(confidence)))
+            else:
+                for event in self.tracker.observe([crop.track_id for crop in crops], labels, confidences):
+                    self._emit_event(event)
+            self.stats["match"].record(len(crops), time.perf_counter() - start)
+
+    def _release(self, crops: List[Crop]) -> None:
+        if self.tracker is None:
+            return
+        for event in self.tracker.release([crop.track_id for crop in crops]):
+            self._emit_event(event)
+
+    def _emit(self, recognition: Recognition) -> None:
+        # Recognitions of ended and released tracks come from the detection and embedding stages, all others
+        # from the matching stage
+        with self._results_lock:
+            self.latencies.append(recognition.latency)
+            self.recognitions += 1
+        if self.on_result is not None:
+            self.on_result(recognition)
+
+    def _emit_event(self, event: TrackEvent) -> None:
+        latency = time.perf_counter() - event.captured_at
+        self._emit(Recognition(event.frame_index, event.box, event.label, latency, event.track_id, event.confidence))
+
+    def start(self) -> None:
+        """Start all pipeline stages in background threads."""
+        detected, embedded = threading.Event(), threading.Event()
+        self._started_at = time.perf_counter()
+        self._threads = [
+            threading.Thread(
+                target=self._run_stage, args=(self._capture, self._capture_done), name="capture", daemon=True
+            ),
+            threading.Thread(target=self._run_stage, args=(self._detect, detected), name="detect", daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._embed, embedded, detected), name="embed", daemon=True),
+            threading.Thread(target=self._run_stage, args=(self._match, None, embedded), name="match", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, drain: bool = True, timeout: Optional[float] = None) -> None:
+        """Stop the pipeline.
+
+        :param drain: Flag to process all queued items before stopping; only meaningful for finite sources
+        :param timeout: Maximum time to wait for the stages to finish (default: None)
+        :raises RuntimeError: If a stage failed; the error is chained to the exception raised by the stage
+        """
+        if not drain:
+            self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._stop.set()
+        if self.tracker is not None:
+            for event in self.tracker.flush():
+                self._emit_event(event)
+        self._stopped_at = time.perf_counter()
+
+        if self.error is not None:
+            raise self.error
+
+    def run(self, duration: Optional[float] = None) -> Dict[str, Any]:
+        """Run the pipeline until the source is exhausted or the duration has passed.
+
+        :param duration: Maximum run time in seconds (default: None, i.e. until the source is exhausted)
+        :return: Report of the run, see report
+        """
+        self.start()
+        if duration is not None:
+            self._capture_done.wait(duration)
+            self.stop(drain=self._capture_done.is_set())
+        else:
+            self.stop(drain=True)
+
+        return self.report()
+
+    def report(self) -> Dict[str, Any]:
+        """Return per-stage throughput, dropped items and end-to-end latency percentiles."""
+        elapsed = (self._stopped_at or time.perf_counter()) - self._started_at
+        latencies = np.asarray(self.latencies)
+
+        return {
+            "elapsed_s": elapsed,
+            "error": str(self.error) if self.error is not None else None,
+            "recognitions": self.recognitions,
+            "stages": {name: stats.summary(elapsed) for name, stats in self.stats.items()},
+            "dropped": {"frames": self.frames.dropped, "crops": self.crops.dropped, "embedded": self.embedded.dropped},
+            "gate": self.gate.stats.summary() if self.gate is not None else None,
+            "tracker": self.tracker.summary() if self.tracker is not None else None,
+            "latency_ms": {
+                f"p{q}": float(np.percentile(latencies, q) * 1000) if len(latencies) else 0.0 for q in (50, 90, 99)
+            },
+        }
+
+
+if __name__ == "__main__":
+    from data.synthetic_data import generate_synthetic_data_for_products
+    from models.inference import load_backbone
+
+    # Example usage with a stand-in conveyor belt, a motion gate, a tracker and an untrained backbone
+    product_ids = [1, 2, 3]
+    params = {"height": 128, "width": 128, "channels": 3, "n_images": 8, "dtype": np.uint8}
+    support_set = generate_synthetic_data_for_products(product_ids, params, show_progress=False)
+
+    backbone = load_backbone()
+    index = EmbeddingIndex.build(backbone, support_set, prototypes=True)
+
+    source = ConveyorFrameSource(product_ids, dim=(256, 256, 3), n_frames=240, fps=30.0)
+    runner = VideoStreamRunner(
+        source, backbone, index, crop_size=(128, 128), gate=MotionGate(), tracker=IouTracker(min_confidence=0.9)
+    )
+    report = runner.run()
+
+    print(f"[INFO] Recognized {report['recognitions']} objects in {report['elapsed_s']:.2f} s")
+    for name, summary in report["stages"].items():
+        print(f"[INFO] {name:>7}: {summary['items_per_s']:.1f} items/s, utilization {summary['utilization']:.0%}")
+    print(f"[INFO] Dropped: {report['dropped']}")
+    print(f"[INFO] Motion gate: {report['gate']}")
+    print(f"[INFO] Tracker: {report['tracker']}")
+    print(f"[INFO] End-to-end latency: {report['latency_ms']}")
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script contains the shared fixtures of the
+# unit tests. Importing it puts the src folder on the import path.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+# The src folder takes precedence over this folder, whose database.py would shadow the database package
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from mockup.fake_db_data_generation import create_tables, populate_tables
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+
+class SQLiteTestCase(unittest.TestCase):
+    """Base class of tests that run against a freshly populated in-memory SQLite database per test."""
+
+    # Number of generated orders, sets and pieces
+    num_records = 4
+
+    def setUp(self):
+        """Create and populate an in-memory database that all threads share."""
+        self.engine = create_engine("sqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False})
+        create_tables(self.engine)
+        populate_tables(self.engine, num_records=self.num_records)
+
+    def tearDown(self):
+        """Dispose of the database."""
+        self.engine.dispose()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the statement count and the
+# eager loading of the read-only catalog access layer.
+######################################################################
+
+import unittest
+
+from helpers import SQLiteTestCase
+
+from database.catalog import CatalogReader, orders_statement
+from database.config import get_session
+from database.queries import fetch_order_bom
+from sqlalchemy.exc import InvalidRequestError
+
+
+class TestCatalogReader(SQLiteTestCase):
+    """Tests of CatalogReader against an in-memory SQLite database."""
+
+    num_records = 5
+
+    def setUp(self):
+        """Create and populate an in-memory database and a reader."""
+        super().setUp()
+        self.reader = CatalogReader(self.engine)
+
+    def test_orders_query_count(self):
+        """The graph of any number of orders is loaded with three statements."""
+        orders = self.reader.orders([1, 2, 3, 4, 5])
+        self.assertEqual(sorted(orders), [1, 2, 3, 4, 5])
+        self.assertEqual(self.reader.last_query_count, 3)
+
+        self.reader.order(1)
+        self.assertEqual(self.reader.last_query_count, 3)
+        self.assertEqual(self.reader.query_count, 6)
+
+    def test_orders_graph(self):
+        """The loaded graph matches the materialized piece totals and shares sets between orders."""
+        orders = self.reader.orders([1, 2, 99])
+        self.assertNotIn(99, orders)
+
+        for order_id, order in orders.items():
+            bom = fetch_order_bom(self.engine, order_id)
+            self.assertEqual(order.piece_totals(), dict(bom.tolist()))
+        self.assertIs(orders[1].sets[0].set, orders[2].sets[0].set)
+
+    def test_empty_request(self):
+        """An empty request issues no statement."""
+        self.assertEqual(self.reader.orders([]), {})
+        self.assertEqual(self.reader.last_query_count, 0)
+
+    def test_raiseload(self):
+        """Relationships outside the eager-loaded graph raise instead of lazy loading."""
+        with get_session(self.engine) as session:
+            order = session.scalars(orders_statement([1])).one()
+            set_ = order.order_sets[0].set
+            self.assertTrue(set_.set_pieces[0].piece.name)
+
+            with self.assertRaises(InvalidRequestError):
+                _ = set_.order_sets
+            with self.assertRaises(InvalidRequestError):
+                _ = set_.set_pieces[0].piece.set_pieces
+            with self.assertRaises(InvalidRequestError):
+                _ = order.order_sets[0].order
+
+    def test_order_arrays(self):
+        """The flat relationship arrays are loaded with two statements."""
+        arrays = self.reader.order_arrays([1, 2])
+        self.assertEqual(self.reader.last_query_count, 2)
+        self.assertEqual(set(arrays["order_sets"]["order_id"].tolist()), {1, 2})
+        self.assertEqual(len(arrays["set_pieces"]), 25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the failure handling and the
+# incremental index updates of the order-changeover orchestrator.
+######################################################################
+
+import asyncio
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.changeover import ChangeoverOrchestrator
+from models.inference import EmbeddingIndex
+
+
+def bom(product_ids):
+    """Build a bill of materials with one brick of every product."""
+    return np.array(
+        [(product_id, 1) for product_id in product_ids], dtype=[("piece_id", np.int64), ("total_quantity", np.int64)]
+    )
+
+
+class StubStore:
+    """Support-set store that embeds every product as one random vector and can fail for chosen products."""
+
+    def __init__(self, failing=(), delay=0.0):
+        self.failing = set(failing)
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embeddings_for(self, product_ids):
+        """Return two embeddings per product, or raise for failing products."""
+        with self._lock:
+            self.calls += 1
+        threading.Event().wait(self.delay)
+        if self.failing.intersection(product_ids):
+            raise OSError("disk full")
+        return {product_id: np.random.default_rng(product_id).normal(size=(2, 8)) for product_id in product_ids}
+
+
+class TestChangeoverOrchestrator(unittest.IsolatedAsyncioTestCase):
+    """Tests of ChangeoverOrchestrator with a stand-in store."""
+
+    async def asyncSetUp(self):
+        """Collect the published indexes."""
+        self.published = []
+
+    def orchestrator(self, store, fetch_bom=lambda order_id: bom(range(1, 7)), **kwargs):
+        """Create an orchestrator that records the published indexes."""
+        orchestrator = ChangeoverOrchestrator(
+            fetch_bom, store, on_index=lambda changeover, index: self.published.append(index), **kwargs
+        )
+        self.addCleanup(orchestrator.close)
+        return orchestrator
+
+    async def test_failing_bom(self):
+        """A failing bill-of-materials query releases all waiters with the error."""
+
+        def fetch_bom(order_id):
+            raise ConnectionError("database down")
+
+        changeover = self.orchestrator(StubStore(), fetch_bom=fetch_bom).changeover(1)
+        with self.assertRaises(ConnectionError):
+            await asyncio.wait_for(changeover.wait_product(3), timeout=5.0)
+        with self.assertRaises(ConnectionError):
+            await asyncio.wait_for(changeover.wait(), timeout=5.0)
+        self.assertTrue(changeover.ready.is_set())
+        self.assertTrue(changeover.progress()["failed"])
+
+    async def test_failing_product(self):
+        """A failing product releases its waiters with the error, while ready products stay available."""
+        changeover = self.orchestrator(StubStore(failing=[4])).changeover(1)
+        with self.assertRaises(OSError):
+            await asyncio.wait_for(changeover.wait_product(4), timeout=5.0)
+        with self.assertRaises(OSError):
+            await asyncio.wait_for(changeover.wait(), timeout=5.0)
+
+        self.assertTrue(all(event.is_set() for event in changeover.product_ready.values()))
+        self.assertEqual((await asyncio.wait_for(changeover.wait_product(1), timeout=5.0)).shape, (2, 8))
+
+    async def test_incremental_index(self):
+        """Ready products are merged into the index, and updates within the publish interval are coalesced."""
+        orchestrator = self.orchestrator(
+            StubStore(delay=0.01), publish_interval=0.2, index_options={"prototypes": True}
+        )
+        changeover = await orchestrator.changeover(1).wait()
+
+        self.assertLess(len(self.published), 6)
+        self.assertIs(self.published[-1], changeover.index)
+        self.assertEqual(sorted(changeover.index.labels.tolist()), [1, 2, 3, 4, 5, 6])
+
+        expected = EmbeddingIndex.from_embeddings(changeover.embeddings, prototypes=True)
+        queries = np.random.default_rng(0).normal(size=(5, 8))
+        self.assertEqual(changeover.index.match(queries), expected.match(queries))
+
+    async def test_prefetched_order(self):
+        """A prefetched order publishes its index once it becomes current."""
+        orchestrator = self.orchestrator(StubStore())
+        prefetched = await orchestrator.prefetch(2).wait()
+        self.assertEqual(self.published, [])
+
+        self.assertIs(orchestrator.changeover(2), prefetched)
+        self.assertEqual([len(index) for index in self.published], [12])
+
+
+class TestEmbeddingIndexMerge(unittest.TestCase):
+    """Tests of merging embedding indexes."""
+
+    def test_merge(self):
+        """Merging keeps the stored vectors and rejects mixed quantization."""
+        first = EmbeddingIndex.from_embeddings({1: np.eye(4)[:2]}, quantize=True)
+        second = EmbeddingIndex.from_embeddings({2: np.eye(4)[2:]}, quantize=True)
+        merged = first.merge(second)
+
+        self.assertEqual(merged.labels.tolist(), [1, 1, 2, 2])
+        self.assertEqual(merged.vectors.dtype, np.int8)
+        self.assertEqual(merged.match(np.eye(4)), [1, 1, 2, 2])
+        with self.assertRaises(ValueError):
+            first.merge(EmbeddingIndex.from_embeddings({2: np.eye(4)[2:]}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the top-k search and the
+# classification of the support-set embedding index.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.inference import REDUNDANT_BRICK, EmbeddingIndex
+
+
+class TestEmbeddingIndex(unittest.TestCase):
+    """Tests of the cosine search of the embedding index."""
+
+    def setUp(self):
+        """Create an index of three products with orthogonal embeddings."""
+        self.index = EmbeddingIndex(np.eye(3, dtype=np.float32), np.array([7, 8, 9]))
+
+    def test_search(self):
+        """Neighbours are sorted by descending similarity, and k is capped at the index size."""
+        similarities, labels = self.index.search(np.array([[0.1, 1.0, 0.5]], dtype=np.float32), k=5)
+        self.assertEqual(labels.tolist(), [[8, 9, 7]])
+        self.assertTrue(np.all(np.diff(similarities) <= 0))
+
+    def test_classify(self):
+        """A query far from all embeddings is labelled as redundant brick."""
+        labels, _ = self.index.classify(np.array([[1.0, 0.0, 0.0], [-1.0, -1.0, 0.0]], dtype=np.float32))
+        self.assertEqual(labels, [7, REDUNDANT_BRICK])
+
+    def test_empty_index(self):
+        """Searching an empty index raises a clear error instead of failing inside the top-k selection."""
+        index = EmbeddingIndex(np.empty((0, 3), dtype=np.float32), np.empty(0))
+        with self.assertRaisesRegex(ValueError, "empty"):
+            index.search(np.ones((2, 3), dtype=np.float32))
+        with self.assertRaisesRegex(ValueError, "at least 1"):
+            self.index.search(np.ones((2, 3), dtype=np.float32), k=0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the routing of the embeddings
+# of the shared inference server back to the streams that sent the
+# crops, also after invalid input and timeouts.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.inference_server import InferenceServer
+
+CROP_SIZE = (32, 32)
+
+
+def crop(value):
+    """Create a crop with one gray value and a brighter square, so different values embed differently."""
+    image = np.full((*CROP_SIZE, 3), value, dtype=np.uint8)
+    image[8:24, 8:24] = 255 - value
+    return image
+
+
+class TestInferenceServer(unittest.TestCase):
+    """Tests of InferenceServer and InferenceClient with an untrained backbone."""
+
+    @classmethod
+    def setUpClass(cls):
+        """Start one server with three streams for all tests."""
+        cls.server = InferenceServer(n_streams=3, crop_size=CROP_SIZE, max_batch=8, slots_per_stream=4, timeout=60.0)
+        cls.server.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the server and release the shared memory."""
+        cls.server.stop()
+
+    def test_routing(self):
+        """Each stream receives the embeddings of its own crops, also when a call is sent in several rounds."""
+        crops = [crop(value) for value in range(0, 250, 25)]
+        first = self.server.client(0).embed(crops)
+        second = self.server.client(1).embed(crops[::-1])
+
+        self.assertEqual(first.shape, (len(crops), self.server.embedding_dim))
+        self.assertEqual(self.server.embedding_dim, 512)
+        np.testing.assert_allclose(np.linalg.norm(first, axis=1), 1.0, rtol=1e-5)
+        np.testing.assert_allclose(second[::-1], first, atol=1e-4)
+        self.assertGreater(np.abs(first[0] - first[-1]).max(), 1e-3)
+
+    def test_invalid_shape(self):
+        """A call with a crop of the wrong size is rejected before any crop is sent."""
+        client = self.server.client(2)
+        with self.assertRaises(ValueError):
+            client.embed([crop(10), np.zeros((16, 16, 3), dtype=np.uint8)])
+
+        expected = self.server.client(0).embed([crop(200)])
+        np.testing.assert_allclose(client.embed([crop(200)]), expected, atol=1e-4)
+
+    def test_late_result_discarded(self):
+        """A result that arrives after its call timed out is not mistaken for the result of the next call."""
+        client = self.server.client(2)
+        client.timeout = 0.0
+        with self.assertRaises(RuntimeError):
+            client.embed([crop(0)])
+
+        client.timeout = 60.0
+        expected = self.server.client(0).embed([crop(250)])
+        np.testing.assert_allclose(client.embed([crop(250)]), expected, atol=1e-4)
+
+
+class TestInferenceServerStartup(unittest.TestCase):
+    """Tests of the startup of the server process."""
+
+    def test_failing_backbone(self):
+        """A server that cannot load its backbone fails to start instead of leaving clients waiting."""
+        server = InferenceServer(n_streams=1, checkpoint_path="missing.pth", crop_size=CROP_SIZE)
+        with self.assertRaises(RuntimeError):
+            server.client(0)
+        with self.assertRaises(RuntimeError):
+            server.start(timeout=60.0)
+        self.assertIsNone(server.embedding_dim)
+        server.stop()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the counts, the growth and the
+# thread safety of the missing-brick counter.
+######################################################################
+
+import sys
+import threading
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.missing_bricks import MissingBrickCounter
+
+
+class TestMissingBrickCounter(unittest.TestCase):
+    """Tests of MissingBrickCounter."""
+
+    def setUp(self):
+        """Create a small counter, so that registering orders grows its matrices."""
+        self.counter = MissingBrickCounter(n_stripes=2, initial_orders=1, initial_pieces=2)
+
+    def test_missing_and_surplus(self):
+        """Recognitions decrement the expected counts, and unknown piece IDs are ignored."""
+        self.counter.register_order(1, {3001: 2, 3002: 1, 3003: 1})
+        self.assertEqual(self.counter.recognize(1, 3001), 1)
+        self.assertEqual(self.counter.recognize(1, 3002, count=2), -1)
+        self.assertIsNone(self.counter.recognize(1, 9999))
+        self.assertEqual(self.counter.recognize_many(1, [3003, 9999]), 1)
+
+        self.assertEqual(self.counter.missing(1).tolist(), [(3001, 2, 1)])
+        self.assertEqual(self.counter.surplus(1).tolist(), [(3002, 1, -1)])
+        self.assertFalse(self.counter.is_complete(1))
+        self.counter.recognize(1, 3001)
+        self.assertTrue(self.counter.is_complete(1))
+
+    def test_growth_and_row_reuse(self):
+        """Orders beyond the initial capacity keep their counts, and closed rows are reused."""
+        for order_id in range(1, 6):
+            self.counter.register_order(order_id, {order_id: order_id, 100 + order_id: 1})
+        for order_id in range(1, 6):
+            self.assertEqual(
+                self.counter.snapshot(order_id).tolist(), [(order_id, order_id, order_id), (100 + order_id, 1, 1)]
+            )
+
+        self.counter.close_order(2)
+        self.counter.register_order(6, {1: 3})
+        self.assertEqual(sorted(self.counter.orders()), [1, 3, 4, 5, 6])
+        self.assertEqual(self.counter.snapshot(6).tolist(), [(1, 3, 3)])
+
+    def test_concurrent_recognitions(self):
+        """Concurrent decrements, also while new orders grow the matrices, are not lost."""
+        self.counter.register_order(1, {3001: 4000, 3002: 4000})
+
+        def recognize(piece_id):
+            for _ in range(500):
+                self.counter.recognize(1, piece_id)
+                self.counter.recognize_many(1, [piece_id])
+
+        threads = [threading.Thread(target=recognize, args=(piece_id,)) for piece_id in (3001, 3002) * 4]
+        for thread in threads:
+            thread.start()
+        for order_id in range(2, 20):
+            self.counter.register_order(order_id, {4000 + order_id: 1})
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.counter.snapshot(1).tolist(), [(3001, 4000, 0), (3002, 4000, 0)])
+
+
+if __name__ == "__main__":
+    unittest.main()
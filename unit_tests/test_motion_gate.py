@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the skip decision and the crop
+# hints of the motion gate, and how the video pipeline maps detections
+# in a crop hint back to frame coordinates.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.motion_gate import MotionGate
+from models.video_stream_run import ConveyorFrameSource, Frame, VideoStreamRunner
+
+
+def frame_with_square(y1, y2, x1, x2, shape=(100, 100)):
+    """Create a black frame with a white square."""
+    image = np.zeros((*shape, 3), dtype=np.uint8)
+    image[y1:y2, x1:x2] = 255
+    return image
+
+
+class TestMotionGate(unittest.TestCase):
+    """Tests of MotionGate."""
+
+    def hint(self, image):
+        """Return the crop hint of a frame after an empty frame initialized the background."""
+        gate = MotionGate(scale=8, margin=1)
+        self.assertIsNone(gate.update(np.zeros_like(image)))
+        return gate.update(image)
+
+    def test_skip_empty_belt(self):
+        """Only the frames of passing bricks reach the detector, once the ghost of the first brick faded."""
+        gate = MotionGate()
+        source = ConveyorFrameSource(
+            [1, 2], dim=(64, 96, 3), n_frames=120, period=40, travel=4, brick_size=24, fps=None
+        )
+        active = [index for index, image in enumerate(source) if gate.update(image) is not None]
+
+        self.assertEqual(active[-8:], [40, 41, 42, 43, 80, 81, 82, 83])
+        self.assertEqual(gate.stats.summary()["skipped"], 120 - len(active))
+
+    def test_static_frames_skipped(self):
+        """The first frame initializes the background, and unchanged frames are skipped."""
+        gate = MotionGate()
+        image = frame_with_square(40, 60, 40, 60)
+        self.assertEqual([gate.update(image) for _ in range(3)], [None, None, None])
+        self.assertEqual(gate.stats.summary()["skip_ratio"], 1.0)
+
+    def test_hint_inside(self):
+        """The hint covers the changed blocks grown by the margin."""
+        self.assertEqual(self.hint(frame_with_square(40, 56, 24, 40)), (16, 32, 48, 64))
+
+    def test_hint_top_left_edge(self):
+        """The margin is clipped at the top and left edge."""
+        self.assertEqual(self.hint(frame_with_square(0, 10, 0, 10)), (0, 0, 24, 24))
+
+    def test_hint_bottom_right_edge(self):
+        """The pixels beyond the last full block at the bottom and right edge belong to the hint."""
+        self.assertEqual(self.hint(frame_with_square(90, 100, 90, 100)), (80, 80, 100, 100))
+
+
+class FixedGate:
+    """Stand-in gate that returns predefined crop hints."""
+
+    def __init__(self, hints):
+        self.hints = iter(hints)
+
+    def update(self, image):
+        """Return the next crop hint."""
+        return next(self.hints)
+
+
+class TestDetectRegions(unittest.TestCase):
+    """Tests of the crop-hint handling of the detection stage."""
+
+    def test_hint_offset(self):
+        """Boxes detected inside a crop hint are shifted to frame coordinates, and skipped frames are not detected."""
+        regions = []
+
+        def detector(images):
+            regions.extend(image.shape for image in images)
+            return [[(2, 3, 10, 12)] for _ in images]
+
+        runner = VideoStreamRunner(
+            [],
+            None,
+            None,
+            detector=detector,
+            crop_size=(8, 8),
+            embedder=lambda crops: np.zeros((len(crops), 2)),
+            gate=FixedGate([(40, 30, 90, 80), None]),
+        )
+        image = np.zeros((100, 120, 3), dtype=np.uint8)
+        runner._detect_regions([Frame(0, 0.0, image), Frame(1, 0.0, image)])
+
+        # Without a gate, the whole frame is searched and the boxes are not shifted
+        runner.gate = None
+        runner._detect_regions([Frame(2, 0.0, image)])
+
+        crops = runner.crops.get_batch(10, timeout=0.0)
+        self.assertEqual(regions, [(50, 50, 3), (100, 120, 3)])
+        self.assertEqual([(crop.frame_index, crop.box) for crop in crops], [(0, (42, 33, 50, 42)), (2, (2, 3, 10, 12))])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests that the materialized order
+# piece totals follow ORM changes and ORM bulk statements.
+######################################################################
+
+import subprocess
+import sys
+import textwrap
+import unittest
+from pathlib import Path
+
+from helpers import SQLiteTestCase
+
+from database.config import get_session
+from database.piece_totals import refresh_piece_totals, verify_piece_totals
+from database.schema import OrderSet, SetPiece
+from sqlalchemy import delete, insert, update
+
+
+class TestPieceTotals(SQLiteTestCase):
+    """Tests of the incremental refresh of the order piece totals."""
+
+    def assertTotalsFresh(self):
+        """Assert that the materialized totals match the live aggregate."""
+        report = verify_piece_totals(self.engine)
+        self.assertTrue(report["ok"], report)
+        self.assertGreater(report["rows"], 0)
+
+    def execute(self, statement, parameters=None):
+        """Execute a statement in an ORM session and commit it."""
+        with get_session(self.engine) as session:
+            session.execute(statement, parameters)
+            session.commit()
+
+    def test_populated_totals(self):
+        """Objects added through the ORM are materialized on flush."""
+        self.assertTotalsFresh()
+
+    def test_orm_change(self):
+        """Changing and deleting ORM objects refreshes the affected orders."""
+        with get_session(self.engine) as session:
+            session.get(OrderSet, 1).quantity += 2
+            session.delete(session.get(SetPiece, 1))
+            session.commit()
+        self.assertTotalsFresh()
+
+    def test_bulk_update(self):
+        """An ORM bulk UPDATE with a WHERE clause refreshes the affected orders."""
+        self.execute(update(OrderSet).where(OrderSet.set_id == 2).values(quantity=OrderSet.quantity + 1))
+        self.assertTotalsFresh()
+        self.execute(update(SetPiece).where(SetPiece.piece_id == 3).values(quantity=50))
+        self.assertTotalsFresh()
+
+    def test_bulk_update_moving_rows(self):
+        """Rows moved to another order by an UPDATE refresh both the old and the new order."""
+        self.execute(update(OrderSet).where(OrderSet.order_id == 1).values(order_id=2))
+        self.assertTotalsFresh()
+
+    def test_bulk_update_by_primary_key(self):
+        """An ORM bulk UPDATE with one parameter set per row refreshes the affected orders."""
+        self.execute(update(SetPiece), [{"id": 1, "quantity": 99}, {"id": 6, "quantity": 42}])
+        self.assertTotalsFresh()
+
+    def test_bulk_delete(self):
+        """An ORM bulk DELETE refreshes the affected orders."""
+        self.execute(delete(SetPiece).where(SetPiece.set_id == 1))
+        self.assertTotalsFresh()
+        self.execute(delete(OrderSet).where(OrderSet.order_id == 3))
+        self.assertTotalsFresh()
+
+    def test_bulk_insert(self):
+        """An ORM bulk INSERT refreshes the affected orders."""
+        self.execute(insert(SetPiece), [{"set_id": 2, "piece_id": 1, "quantity": 7}])
+        self.assertTotalsFresh()
+        self.execute(insert(OrderSet).values(order_id=4, set_id=3, quantity=5))
+        self.assertTotalsFresh()
+
+    def test_core_write_requires_refresh(self):
+        """Core writes bypass the session and are only materialized by refresh_piece_totals."""
+        with self.engine.begin() as connection:
+            connection.execute(update(OrderSet).where(OrderSet.order_id == 1).values(quantity=9))
+        self.assertFalse(verify_piece_totals(self.engine)["ok"])
+
+        with self.engine.begin() as connection:
+            refresh_piece_totals(connection, [1])
+        self.assertTotalsFresh()
+
+
+class TestListenerRegistration(unittest.TestCase):
+    """Tests that the refresh listeners are active without importing database.piece_totals."""
+
+    def test_fresh_interpreter(self):
+        """ORM writes in a process that only imports config, schema and queries are materialized."""
+        script = textwrap.dedent(
+            """
+            import datetime
+
+            from sqlalchemy import create_engine
+
+            from database.config import get_session
+            from database.queries import fetch_order_bom
+            from database.schema import Base, Order, OrderSet, Piece, Set, SetPiece
+
+            engine = create_engine("sqlite://")
+            Base.metadata.create_all(engine)
+            with get_session(engine) as session:
+                order = Order(date=datetime.date.today(), total_sets=1)
+                set_ = Set(name="set")
+                piece = Piece(name="piece", color="red")
+                session.add_all([order, set_, piece])
+                session.flush()
+                session.add_all(
+                    [
+                        OrderSet(order_id=order.id, set_id=set_.id, quantity=2),
+                        SetPiece(set_id=set_.id, piece_id=piece.id, quantity=4),
+                    ]
+                )
+                session.commit()
+            print(fetch_order_bom(engine, 1).tolist())
+            """
+        )
+        src = Path(__file__).resolve().parents[1] / "src"
+        result = subprocess.run(
+            [sys.executable, "-c", script], cwd=src, capture_output=True, text=True, timeout=60, check=False
+        )
+        self.assertEqual(result.returncode, 0, result.stderr)
+        self.assertEqual(result.stdout.strip(), "[(1, 8)]")
+
+
+if __name__ == "__main__":
+    unittest.main()
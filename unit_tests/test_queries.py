@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the bill of materials query
+# and its cache against an in-memory SQLite database.
+######################################################################
+
+import unittest
+
+from helpers import SQLiteTestCase
+
+from database.catalog import QueryCounter
+from database.config import get_session
+from database.piece_totals import piece_totals_statement
+from database.queries import OrderBomCache, fetch_order_bom
+from database.schema import Order, OrderSet, utc_now
+from sqlalchemy import select
+
+
+class TestOrderBom(SQLiteTestCase):
+    """Tests of fetch_order_bom and OrderBomCache."""
+
+    def live_bom(self, order_id):
+        """Compute the bill of materials of an order from order_sets and set_pieces."""
+        with self.engine.connect() as connection:
+            rows = connection.execute(piece_totals_statement([order_id])).all()
+        return sorted((piece_id, total) for _, piece_id, total in rows)
+
+    def change_quantity(self, order_id):
+        """Increment the quantity of the first set of an order through the ORM."""
+        with get_session(self.engine) as session:
+            order_set = session.scalars(select(OrderSet).where(OrderSet.order_id == order_id)).first()
+            order_set.quantity += 1
+            session.commit()
+
+    def test_fetch_order_bom(self):
+        """The materialized bill of materials matches the live aggregate."""
+        bom = fetch_order_bom(self.engine, 1)
+        self.assertEqual(bom.tolist(), self.live_bom(1))
+        self.assertFalse(bom.flags.writeable)
+
+    def test_cache_hit(self):
+        """Repeated scans within revalidate_after are answered without any statement."""
+        cache = OrderBomCache(self.engine, revalidate_after=60.0)
+        first = cache.get(1)
+        with QueryCounter(self.engine) as counter:
+            second = cache.get(1)
+
+        self.assertIs(first, second)
+        self.assertEqual(counter.count, 0)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_revalidation_hit(self):
+        """An unchanged order is revalidated with a single statement."""
+        cache = OrderBomCache(self.engine, revalidate_after=0.0)
+        first = cache.get(1)
+        with QueryCounter(self.engine) as counter:
+            second = cache.get(1)
+
+        self.assertIs(first, second)
+        self.assertEqual(counter.count, 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_updated_at_invalidation(self):
+        """Changes within the same second as the cached read are detected through Order.updated_at."""
+        cache = OrderBomCache(self.engine, revalidate_after=0.0)
+        for _ in range(3):
+            before = cache.get(1)
+            self.change_quantity(1)
+            after = cache.get(1)
+
+            self.assertNotEqual(after.tolist(), before.tolist())
+            self.assertEqual(after.tolist(), self.live_bom(1))
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+    def test_order_update_invalidation(self):
+        """A direct ORM update of an order bumps its updated_at."""
+        cache = OrderBomCache(self.engine, revalidate_after=0.0)
+        cache.get(1)
+        with get_session(self.engine) as session:
+            session.get(Order, 1).total_sets += 1
+            session.commit()
+        cache.get(1)
+        self.assertEqual(cache.misses, 2)
+
+    def test_updated_at_utc(self):
+        """Inserted and updated orders carry the same naive UTC clock."""
+        with get_session(self.engine) as session:
+            order = session.get(Order, 1)
+            inserted = order.updated_at
+            order.total_sets += 1
+            session.commit()
+            updated = session.get(Order, 1).updated_at
+
+        self.assertLess(abs((utc_now() - inserted).total_seconds()), 60)
+        self.assertGreater(updated, inserted)
+
+    def test_invalidate(self):
+        """Invalidate drops one order or the whole cache."""
+        cache = OrderBomCache(self.engine, revalidate_after=60.0)
+        cache.get(1)
+        cache.get(2)
+
+        cache.invalidate(1)
+        cache.get(1)
+        cache.get(2)
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+        cache.invalidate()
+        cache.get(1)
+        cache.get(2)
+        self.assertEqual((cache.hits, cache.misses), (1, 5))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the batching, flushing,
+# backpressure and error handling of the recognition event writer.
+######################################################################
+
+import threading
+import time
+import unittest
+
+from helpers import SQLiteTestCase
+
+from database.recognition_log import RecognitionEventWriter
+from database.schema import RecognitionEvent
+from sqlalchemy import event, func, select
+
+
+class TestRecognitionEventWriter(SQLiteTestCase):
+    """Tests of RecognitionEventWriter against an in-memory SQLite database."""
+
+    num_records = 3
+
+    def count_rows(self):
+        """Return the number of stored recognition events."""
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.count()).select_from(RecognitionEvent)).scalar()
+
+    def wait_for(self, condition, timeout=5.0):
+        """Wait until a condition holds or the timeout passed."""
+        deadline = time.perf_counter() + timeout
+        while not condition() and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        return condition()
+
+    def test_batch_size_trigger(self):
+        """A full batch is written without waiting for the flush interval."""
+        with RecognitionEventWriter(self.engine, batch_size=5, flush_interval=60.0) as writer:
+            for index in range(5):
+                self.assertTrue(writer.record(1, 1, confidence=0.9, frame_index=index))
+            self.assertTrue(self.wait_for(lambda: writer.metrics()["written"] == 5))
+            self.assertEqual(writer.metrics()["batches"], 1)
+        self.assertEqual(self.count_rows(), 5)
+
+    def test_flush_interval_trigger(self):
+        """An incomplete batch is written once the flush interval passed."""
+        with RecognitionEventWriter(self.engine, batch_size=1000, flush_interval=0.1) as writer:
+            for index in range(3):
+                writer.record(1, None, frame_index=index)
+            self.assertTrue(self.wait_for(lambda: writer.metrics()["written"] == 3))
+            self.assertEqual(writer.metrics()["batches"], 1)
+
+    def test_flush(self):
+        """Flush writes all buffered events and returns once they are stored."""
+        writer = RecognitionEventWriter(self.engine, batch_size=1000, flush_interval=60.0)
+        for index in range(10):
+            writer.record(2, index % 3 + 1, frame_index=index)
+        self.assertTrue(writer.flush(timeout=5.0))
+        self.assertEqual(self.count_rows(), 10)
+
+        writer.close()
+        self.assertFalse(writer.metrics()["thread_alive"])
+        self.assertFalse(writer.record(2, 1))
+
+    def test_drop_on_full(self):
+        """Events are dropped and counted while the buffer is full, and the rest is written afterwards."""
+        release = threading.Event()
+
+        def stall(*args):
+            release.wait(5.0)
+
+        event.listen(self.engine, "before_cursor_execute", stall)
+        writer = RecognitionEventWriter(self.engine, batch_size=1, max_pending=2, put_timeout=0)
+        try:
+            accepted = [writer.record(1, 1, frame_index=index) for index in range(10)]
+        finally:
+            release.set()
+            event.remove(self.engine, "before_cursor_execute", stall)
+        writer.close()
+
+        metrics = writer.metrics()
+        self.assertIn(False, accepted)
+        self.assertEqual(metrics["dropped"], accepted.count(False))
+        self.assertEqual(metrics["written"], accepted.count(True))
+        self.assertEqual(self.count_rows(), accepted.count(True))
+
+    def test_unexpected_error(self):
+        """A batch that fails with a non-database error is counted, and the thread keeps writing."""
+
+        def fail(*args):
+            raise RuntimeError("disk on fire")
+
+        writer = RecognitionEventWriter(self.engine, flush_interval=60.0, retry_backoff=0.0)
+        event.listen(self.engine, "before_cursor_execute", fail)
+        writer.record(1, 1)
+        self.assertTrue(writer.flush(timeout=5.0))
+        event.remove(self.engine, "before_cursor_execute", fail)
+
+        metrics = writer.metrics()
+        self.assertEqual(metrics["failed"], 1)
+        self.assertTrue(metrics["thread_alive"])
+        self.assertIn("disk on fire", metrics["last_error"])
+
+        writer.record(1, 2)
+        self.assertTrue(writer.flush(timeout=5.0))
+        writer.close()
+        self.assertEqual(self.count_rows(), 1)
+
+    def test_recorder(self):
+        """The recorder stores product IDs, redundant bricks and unresolved tracks."""
+        recognitions = [
+            type("Recognition", (), {"label": label, "frame_index": 0, "confidence": 0.5, "track_id": 1})()
+            for label in (2, "Redundant Brick", None)
+        ]
+        with RecognitionEventWriter(self.engine) as writer:
+            on_result = writer.recorder(order_id=1, stream_id=0)
+            for recognition in recognitions:
+                on_result(recognition)
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(
+                select(RecognitionEvent.piece_id, RecognitionEvent.redundant).order_by(RecognitionEvent.id)
+            ).all()
+        self.assertEqual([tuple(row) for row in rows], [(2, False), (None, True), (None, False)])
+
+
+if __name__ == "__main__":
+    unittest.main()
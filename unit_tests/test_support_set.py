@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the reuse of the stored
+# support-set embeddings and their invalidation on checkpoint changes.
+######################################################################
+
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import numpy as np
+from torch import nn
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.support_set import SupportSetStore
+
+PARAMS = {"height": 8, "width": 8, "channels": 3, "n_images": 2, "dtype": np.uint8, "seed": 42}
+
+
+def tiny_backbone():
+    """Create a backbone that embeds images as their mean color."""
+    return nn.Sequential(nn.AdaptiveAvgPool2d(1), nn.Flatten()).eval()
+
+
+class TestSupportSetStore(unittest.TestCase):
+    """Tests of SupportSetStore with a stand-in backbone."""
+
+    def setUp(self):
+        """Create a store in a temporary directory with a stand-in checkpoint."""
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.checkpoint_path = Path(self.directory.name) / "model.pth"
+        self.checkpoint_path.write_bytes(b"weights-1")
+        self.store = SupportSetStore(
+            Path(self.directory.name) / "support_set", self.checkpoint_path, PARAMS, backbone=tiny_backbone()
+        )
+
+    def test_reuse(self):
+        """Stored embeddings are reused by later orders and by a reopened store."""
+        self.store.embeddings_for([1, 2])
+        self.assertEqual(self.store.last_changeover["embedded"], 2)
+
+        self.store.embeddings_for([2, 3])
+        self.assertEqual((self.store.last_changeover["reused"], self.store.last_changeover["embedded"]), (1, 1))
+
+        reopened = SupportSetStore(self.store.root, self.checkpoint_path, PARAMS, backbone=tiny_backbone())
+        reopened.embeddings_for([1, 2, 3])
+        self.assertEqual(reopened.last_changeover["reused"], 3)
+
+    def test_checkpoint_change(self):
+        """A replaced checkpoint drops the old embeddings and reloads the backbone from the new checkpoint."""
+        self.store.embeddings_for([1])
+        old_directory = self.store.directory
+
+        self.checkpoint_path.write_bytes(b"weights-2, retrained")
+        with mock.patch("models.support_set.load_backbone", return_value=tiny_backbone()) as load_backbone:
+            self.store.embeddings_for([1])
+        load_backbone.assert_called_once()
+        self.assertEqual(self.store.last_changeover["embedded"], 1)
+        self.assertFalse(old_directory.exists())
+        self.assertNotEqual(self.store.directory, old_directory)
+
+        # Touching the checkpoint without changing its contents keeps the embeddings
+        self.checkpoint_path.write_bytes(b"weights-2, retrained")
+        self.assertFalse(self.store.refresh_checkpoint())
+        self.store.embeddings_for([1])
+        self.assertEqual(self.store.last_changeover["reused"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the value range of the
+# generated synthetic product images.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from data.synthetic_data import generate_synthetic_batch, generate_synthetic_sample
+
+
+class TestSyntheticData(unittest.TestCase):
+    """Tests of the pixel values of the synthetic images."""
+
+    def test_wrap_wide_dtype(self):
+        """Pixel values of wider integer types wrap modulo 256 like uint8 pixel values."""
+        for dtype in (np.uint8, np.uint16, np.int32):
+            batch = generate_synthetic_batch(1, 4, (16, 16, 3), dtype=dtype)
+            sample = generate_synthetic_sample(1, 0, (16, 16, 3), dtype=dtype)
+            for images in (batch, sample):
+                self.assertEqual(images.dtype, dtype)
+                self.assertGreaterEqual(images.min(), 0)
+                self.assertLess(images.max(), 256)
+
+
+if __name__ == "__main__":
+    unittest.main()
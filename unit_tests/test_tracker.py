@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the IoU tracker and the
+# release of dropped crops by the video pipeline queues.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.inference import REDUNDANT_BRICK
+from models.tracker import IouTracker
+from models.video_stream_run import DropOldestQueue
+
+BOX = (10, 10, 50, 50)
+SIGNATURE = np.zeros((1, 4), dtype=np.float32)
+
+
+class TestIouTracker(unittest.TestCase):
+    """Tests of the track association, the classification cache and the single event per track."""
+
+    def setUp(self):
+        """Create a tracker and an event list."""
+        self.tracker = IouTracker(max_missed=2, min_confidence=0.8, max_pending_frames=5)
+        self.events = []
+        self.frame_index = 0
+
+    def step(self, boxes=(BOX,), signatures=SIGNATURE):
+        """Feed the detections of one frame and collect the events of ended tracks."""
+        update = self.tracker.update(list(boxes), signatures if boxes else np.empty((0, 0)), self.frame_index, 0.0)
+        self.frame_index += 1
+        self.events += update.events
+        return update
+
+    def observe(self, update, label, confidence):
+        """Answer the classification requests of an update."""
+        track_ids = update.track_ids[update.classify]
+        self.events += self.tracker.observe(track_ids, [label] * len(track_ids), [confidence] * len(track_ids))
+
+    def test_one_event_per_track(self):
+        """A confidently classified brick yields one event and is not classified again."""
+        update = self.step()
+        self.assertTrue(update.classify.all())
+        self.observe(update, 7, 0.95)
+        self.assertEqual(len(self.events), 1)
+
+        for _ in range(10):
+            update = self.step()
+            self.assertFalse(update.classify.any())
+            self.assertEqual(update.track_ids.tolist(), [self.events[0].track_id])
+        self.events += self.tracker.flush()
+
+        self.assertEqual([(event.label, round(event.confidence, 2)) for event in self.events], [(7, 0.95)])
+        self.assertEqual(self.tracker.summary()["classified"], 1)
+
+    def test_reclassify_low_confidence(self):
+        """A low confidence is re-classified at the next detection, but only once the request was answered."""
+        update = self.step()
+        self.assertFalse(self.step().classify.any())
+        self.observe(update, REDUNDANT_BRICK, 0.5)
+        self.assertEqual(self.events, [])
+
+        update = self.step()
+        self.assertTrue(update.classify.all())
+        self.observe(update, REDUNDANT_BRICK, 0.9)
+        self.assertFalse(self.step().classify.any())
+
+        self.events += self.tracker.flush()
+        self.assertEqual([event.label for event in self.events], [REDUNDANT_BRICK])
+
+    def test_reclassify_appearance_change(self):
+        """A confident track is re-classified when its appearance changes."""
+        self.observe(self.step(), 7, 0.95)
+        self.assertFalse(self.step(signatures=SIGNATURE + 0.05).classify.any())
+        self.assertTrue(self.step(signatures=SIGNATURE + 0.5).classify.all())
+
+    def test_best_label_when_never_settled(self):
+        """A track that never reaches min_confidence emits its best label when it ends."""
+        update = self.step()
+        self.observe(update, 3, 0.6)
+        for _ in range(4):
+            self.step(boxes=())
+
+        self.assertEqual([(event.label, round(event.confidence, 2)) for event in self.events], [(3, 0.6)])
+
+    def test_released_crop_is_classified_again(self):
+        """A track whose crop was dropped is classified again at its next detection."""
+        update = self.step()
+        self.assertFalse(self.step().classify.any())
+        self.assertEqual(self.tracker.release(update.track_ids), [])
+
+        update = self.step()
+        self.assertTrue(update.classify.all())
+        self.observe(update, 7, 0.95)
+        self.assertEqual([event.label for event in self.events], [7])
+
+    def test_expired_request_is_classified_again(self):
+        """A request that is not answered within max_pending_frames is sent again."""
+        self.step()
+        classify = [bool(self.step().classify.any()) for _ in range(6)]
+        self.assertEqual(classify, [False] * 5 + [True])
+
+    def test_unclassified_track_emits_unresolved(self):
+        """A track whose classification never arrives emits one unresolved event."""
+        self.step()
+        for _ in range(36):
+            self.step(boxes=())
+        self.events += self.tracker.flush()
+
+        self.assertEqual(len(self.events), 1)
+        self.assertIsNone(self.events[0].label)
+        self.assertEqual(self.events[0].confidence, 0.0)
+        self.assertEqual(self.tracker.summary()["unresolved"], 1)
+
+    def test_released_ended_track_emits_unresolved(self):
+        """Releasing an ended track emits it as unresolved, and a late result is ignored."""
+        update = self.step()
+        for _ in range(3):
+            self.step(boxes=())
+        self.assertEqual(self.events, [])
+
+        self.events += self.tracker.release(update.track_ids)
+        self.observe(update, 7, 0.95)
+        self.events += self.tracker.flush()
+        self.assertEqual([event.label for event in self.events], [None])
+
+    def test_flush_emits_in_flight_tracks(self):
+        """Flushing emits tracks whose classification is still in flight as unresolved."""
+        self.step()
+        self.events += self.tracker.flush()
+        self.assertEqual([event.label for event in self.events], [None])
+
+    def test_awaiting_overflow_emits_unresolved(self):
+        """Ended tracks evicted beyond max_awaiting are emitted as unresolved instead of being discarded."""
+        tracker = IouTracker(max_missed=0, max_awaiting=1)
+        tracker.update([BOX, (100, 100, 140, 140)], np.zeros((2, 4)), 0, 0.0)
+        events = tracker.update([], np.empty((0, 0)), 1, 0.0).events
+
+        self.assertEqual([event.label for event in events], [None])
+        self.assertEqual(len(tracker.flush()), 1)
+
+    def test_late_result_of_ended_track(self):
+        """The result of an ended track's first classification still emits its event."""
+        update = self.step()
+        for _ in range(3):
+            self.step(boxes=())
+        self.observe(update, 7, 0.5)
+        self.events += self.tracker.flush()
+        self.assertEqual([(event.label, round(event.confidence, 2)) for event in self.events], [(7, 0.5)])
+
+
+class TestDropOldestQueue(unittest.TestCase):
+    """Tests of the drop callback of the pipeline queues."""
+
+    def test_on_drop(self):
+        """The oldest item is dropped, counted and passed to the callback."""
+        dropped = []
+        queue = DropOldestQueue(2, on_drop=dropped.append)
+        for item in range(4):
+            queue.put(item)
+
+        self.assertEqual(dropped, [0, 1])
+        self.assertEqual(queue.dropped, 2)
+        self.assertEqual(queue.get_batch(4, timeout=0.0), [2, 3])
+
+
+if __name__ == "__main__":
+    unittest.main()
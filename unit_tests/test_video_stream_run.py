@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+######################################################################
+# Authors: David Anthony Parham
+#
+# Module Description: This script tests the concurrent stages of the
+# video stream runner and how they shut down when a stage fails.
+######################################################################
+
+import sys
+import unittest
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from models.inference import EmbeddingIndex
+from models.video_stream_run import SyntheticFrameSource, VideoStreamRunner
+
+CROP_SIZE = (16, 16)
+
+
+def constant_embedder(crops):
+    """Embed every crop as the embedding of product 1."""
+    return np.tile(np.array([[1.0, 0.0]], dtype=np.float32), (len(crops), 1))
+
+
+def failing_embedder(crops):
+    """Fail like a model that ran out of memory."""
+    raise MemoryError("out of memory")
+
+
+class TestVideoStreamRunner(unittest.TestCase):
+    """Tests of the pipeline with stand-in models."""
+
+    def setUp(self):
+        """Create an index of two products."""
+        self.index = EmbeddingIndex(np.eye(2, dtype=np.float32), np.array([1, 2]))
+
+    def runner(self, n_frames, **kwargs):
+        """Create a runner over an unpaced synthetic source."""
+        source = SyntheticFrameSource([1, 2], dim=(32, 32, 3), n_frames=n_frames, fps=None)
+        kwargs.setdefault("embedder", constant_embedder)
+        return VideoStreamRunner(source, None, self.index, crop_size=CROP_SIZE, **kwargs)
+
+    def test_run(self):
+        """Every frame of a finite source is recognized once the pipeline drained."""
+        report = self.runner(6).run()
+        self.assertEqual(report["recognitions"], 6)
+        self.assertIsNone(report["error"])
+
+    def test_failing_stage(self):
+        """A failing stage stops all stages, and the error is re-raised by stop and reported."""
+        for kwargs in ({"embedder": failing_embedder}, {"detector": lambda frames: 1 / 0}):
+            runner = self.runner(None, **kwargs)
+            with self.assertRaises(RuntimeError) as context:
+                runner.run()
+
+            self.assertIsInstance(context.exception.__cause__, (MemoryError, ZeroDivisionError))
+            self.assertFalse(any(thread.is_alive() for thread in runner._threads))
+            self.assertIn("stage failed", runner.report()["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()